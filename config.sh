@@ -38,6 +38,12 @@ readonly TELEMETRY_RSH="ssh"
 
 ###################################################################################################
 
+# Set to true when library/parse_dataflow_log.py --follow is sending Slack alerts for failures in the
+# summary logs, so the scripts it follows don't send their own per-failure alert as well
+readonly SLACK_ALERTS_FROM_LOG_FOLLOWER=false
+
+###################################################################################################
+
 # Define which experiment CPIDs are allowed to be distributed
 # 151 - Normalscan
 # 3503 - Twofsound
@@ -110,11 +110,52 @@ get_borealis_name() {
 	return 0
 }
 
+###################################################################################################
+# Write the md5 checksum sidecar of a file
+#
+# The sidecar is FILE.md5, next to the file, in the format of `md5sum --binary` with the file's
+# basename so it can be checked with `md5sum --check` from that directory. It is written once, when
+# the file is finalized, and travels with the file through the data flow so verify_transfer only
+# has to checksum the destination copy at each hop. The sidecar is left alone if it is newer than
+# the file (i.e. written by a previous run that failed to transfer the file).
+#
+# Example: write_checksum /data/borealis_data/[FILE]  -> /data/borealis_data/[FILE].md5
+#
+# Argument 1: File to checksum
+###################################################################################################
+write_checksum () {
+	local file=$1
+	local sidecar="${file}.md5"
+
+	if [[ -f $sidecar && $sidecar -nt $file ]]; then
+		return 0
+	fi
+	(cd "$(dirname $file)" && md5sum --binary "$(basename $file)" > "$(basename $sidecar)")
+}
+
+###################################################################################################
+# Move a file and its md5 checksum sidecar, if it has one, to a directory
+#
+# Argument 1: File to move
+# Argument 2: Destination directory
+###################################################################################################
+move_with_checksum () {
+	local file=$1
+	local dest_dir=$2
+
+	mv --verbose $file $dest_dir
+	if [[ -f "${file}.md5" ]]; then
+		mv --verbose "${file}.md5" $dest_dir
+	fi
+}
+
 ###################################################################################################
 # Verify transfer of a file using md5sum
-# 
-# Calculates the md5sum of the sent file, and compares it to the md5sum of the source file. If the 
-# destination file is on a different computer, specify the ssh address of the destination computer 
+#
+# Calculates the md5sum of the sent file, and compares it to the md5sum of the source file. The
+# source md5sum is read from the source file's checksum sidecar (see write_checksum) when it has
+# one, so only the destination copy is read; otherwise the source file is checksummed too. If the
+# destination file is on a different computer, specify the ssh address in argument 3
 # (Ex. transfer@192.168.1.204)
 # 
 # Example: Transferring between local directories (i.e. as in rsync_to_nas)
@@ -130,22 +171,26 @@ verify_transfer () {
 	local source_file=$1
 	local dest_file=$2
 	local dest_ssh=${3-""}  # Default to empty string
+	local source_md5
+	local dest_md5
 
-	TMP_FILE="/tmp/transfer_$(basename ${source_file}).md5" # Unique tmp file for this transfer
+	if [[ -f "${source_file}.md5" ]]; then
+		source_md5=$(cut --delimiter ' ' --fields 1 "${source_file}.md5")
+	else
+		source_md5=$(md5sum --binary $source_file | cut --delimiter ' ' --fields 1)
+	fi
 
 	if [[ -n $dest_ssh ]]; then
-		ssh $dest_ssh "md5sum --binary $dest_file" > $TMP_FILE
+		dest_md5=$(ssh $dest_ssh "md5sum --binary $dest_file" | cut --delimiter ' ' --fields 1)
 	else
-		md5sum --binary $dest_file > $TMP_FILE
+		dest_md5=$(md5sum --binary $dest_file | cut --delimiter ' ' --fields 1)
 	fi
 
-	# Convert md5sum to look at source file
-	sed -i "s~$dest_file~$source_file~g" $TMP_FILE
 	# Check md5sum of destination file is same as source
-	md5sum --check --status $TMP_FILE
-	retval=$?
- 	rm $TMP_FILE
-	return $retval
+	if [[ -n $source_md5 && $source_md5 == "$dest_md5" ]]; then
+		return 0
+	fi
+	return 1
 }
 
 ###################################################################################################
@@ -229,3 +274,63 @@ check_timestamp() {
 	# If end of function is reached, the file timestamp and modification times are consistent.
 	return 0
 }
+
+###################################################################################################
+# Append a structured event to the JSON-lines sidecar of a summary log
+#
+# Writes one JSON object per call to the `.jsonl` file next to the summary log (i.e. 
+# 20240101.rsync_to_nas_summary.jsonl next to 20240101.rsync_to_nas_summary.log) so that the data 
+# flow can be monitored without parsing the free text summary logs. The event records the script, 
+# host, radar, file, stage, status, file size in bytes, and duration in seconds. See 
+# library/dataflow_events.py for the python counterpart used to read and write these events.
+#
+# The `run start` event must be logged before the run's "Executing" line is written to the summary
+# log. If the summary log already holds earlier runs when the sidecar would be created (i.e. on the
+# day this function is first deployed), no sidecar is written for that day so that parsers fall 
+# back to the complete text log.
+#
+# Example: log_event $SUMMARY_FILE transfer success /data/borealis_data/[FILE] "" 12
+#
+# Argument 1: Summary log file
+# Argument 2: Stage (run, transfer, convert, distribute, etc.)
+# Argument 3: Status (start, finish, success, failed, skipped, etc.)
+# Argument 4: File the event is for (optional)
+# Argument 5: Size of the file in bytes (optional, defaults to the size of the file if it exists)
+# Argument 6: Duration of the operation in seconds (optional)
+###################################################################################################
+log_event() {
+	# Check function was called correctly
+	if [[ $# -lt 3 ]]; then
+		printf "log_event(): Invalid number of arguments\n"
+		printf "Usage: log_event summary_file stage status [file] [bytes] [duration]\n"
+		return 1
+	fi
+
+	local summary_file=$1
+	local stage=$2
+	local status=$3
+	local file=${4-""}
+	local bytes=${5-""}
+	local duration=${6-""}
+	local event_file="${summary_file%.log}.jsonl"
+
+	# Don't start a sidecar partway through a day's summary log
+	if [[ ! -f $event_file && -f $summary_file ]] && grep --quiet "^Executing" $summary_file; then
+		return 0
+	fi
+
+	if [[ -z $bytes && -f $file ]]; then
+		bytes=$(stat --format=%s "$file")
+	fi
+
+	# Escape backslashes and double quotes for use in JSON strings
+	file=$(basename -- "${file:-null}")
+	file=${file//\\/\\\\}
+	file=${file//\"/\\\"}
+
+	printf '{"time": "%s", "script": "%s", "host": "%s", "radar": "%s", "stage": "%s", "status": "%s", "file": %s, "bytes": %s, "duration": %s}\n' \
+		"$(date --utc "+%Y-%m-%d %H:%M:%S")" "$(basename -- $0)" "$(hostname)" "${RADAR_ID}" \
+		"$stage" "$status" \
+		"$([[ $file == "null" ]] && printf 'null' || printf '"%s"' "$file")" \
+		"${bytes:-null}" "${duration:-null}" >> $event_file
+}
@@ -0,0 +1,125 @@
+"""
+Copyright 2026 SuperDARN Canada, University of Saskatchewan
+
+Python counterpart of the `log_event` function in data_flow_functions.sh. Data flow events are written one JSON object
+per line to a `.jsonl` sidecar next to each summary log, i.e. 20240101.rsync_to_nas_summary.jsonl is the sidecar of
+20240101.rsync_to_nas_summary.log. Each event has the keys:
+    time, script, host, radar, stage, status, file, bytes, duration
+
+Usage:
+
+dataflow_events.py [-h] [--file FILE] [--bytes BYTES] [--duration DURATION] [--script SCRIPT] [--radar RADAR]
+                   summary_file stage status
+"""
+import argparse
+import json
+import os
+import socket
+from datetime import datetime, timezone
+
+EVENT_KEYS = ('time', 'script', 'host', 'radar', 'stage', 'status', 'file', 'bytes', 'duration')
+
+
+def event_log_path(summary_log):
+    """
+    Get the path of the JSON-lines sidecar for a summary log
+    :param summary_log: Path to a summary log. Ex) 20240101.rsync_to_nas_summary.log
+    :return: Path to the sidecar. Ex) 20240101.rsync_to_nas_summary.jsonl
+    """
+
+    base, ext = os.path.splitext(summary_log)
+    if ext != ".log":
+        base = summary_log
+    return f"{base}.jsonl"
+
+
+def log_event(summary_log, script, stage, status, file=None, num_bytes=None, duration=None, host=None, radar=None):
+    """
+    Append an event to the JSON-lines sidecar of a summary log
+    :param summary_log: Path to the summary log the event belongs to
+    :param script: Name of the data flow script the event is for
+    :param stage: Stage of the data flow (run, transfer, convert, distribute, etc.)
+    :param status: Status of the stage (start, finish, success, failed, skipped, etc.)
+    :param file: File the event is for. Only the file name is recorded
+    :param num_bytes: Size of the file in bytes. Defaults to the size of the file if it exists
+    :param duration: Duration of the operation in seconds
+    :param host: Host the event occurred on. Defaults to this computer's hostname
+    :param radar: Radar ID the event is for. Defaults to $RADAR_ID
+    :return: The event dictionary that was written
+    """
+
+    if num_bytes is None and file is not None and os.path.isfile(file):
+        num_bytes = os.path.getsize(file)
+
+    event = {'time': datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+             'script': script,
+             'host': host if host is not None else socket.gethostname(),
+             'radar': radar if radar is not None else os.environ.get("RADAR_ID", ""),
+             'stage': stage,
+             'status': status,
+             'file': os.path.basename(file) if file is not None else None,
+             'bytes': num_bytes,
+             'duration': duration}
+
+    # A single write to a file opened in append mode keeps concurrent writers from interleaving lines
+    with open(event_log_path(summary_log), 'a') as f:
+        f.write(json.dumps(event) + "\n")
+
+    return event
+
+
+def parse_event_line(line):
+    """
+    Parse a single line of a JSON-lines sidecar
+    :param line: Line from the sidecar
+    :return: Event dictionary, or None if the line is blank or not a complete JSON object
+    """
+
+    line = line.strip()
+    if line == "":
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None     # Partially written or corrupted line
+    if not isinstance(event, dict):
+        return None
+    for key in EVENT_KEYS:
+        event.setdefault(key, None)
+    return event
+
+
+def read_events(event_log):
+    """
+    Read all events from a JSON-lines sidecar
+    :param event_log: Path to the sidecar
+    :return: Generator of event dictionaries, in the order they were written
+    """
+
+    with open(event_log) as f:
+        for line in f:
+            event = parse_event_line(line)
+            if event is not None:
+                yield event
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("summary_file", help="Summary log the event belongs to")
+    parser.add_argument("stage", help="Stage of the data flow. Ex) run, transfer, convert, distribute")
+    parser.add_argument("status", help="Status of the stage. Ex) start, finish, success, failed")
+    parser.add_argument("--file", help="File the event is for")
+    parser.add_argument("--bytes", type=int, help="Size of the file in bytes. Defaults to the size of --file")
+    parser.add_argument("--duration", type=float, help="Duration of the operation in seconds")
+    parser.add_argument("--script", help="Data flow script the event is for. Defaults to the script in the summary "
+                                         "file name")
+    parser.add_argument("--radar", help="Radar ID the event is for. Defaults to $RADAR_ID")
+    args = parser.parse_args()
+
+    script = args.script
+    if script is None:
+        # Ex) 20240101.rsync_to_nas_summary.log -> rsync_to_nas
+        script = os.path.basename(args.summary_file).split('.')[-2].replace("_summary", "")
+
+    log_event(args.summary_file, script, args.stage, args.status, file=args.file, num_bytes=args.bytes,
+              duration=args.duration, radar=args.radar)
@@ -0,0 +1,136 @@
+"""
+Copyright 2026 SuperDARN Canada, University of Saskatchewan
+
+Hourly and daily rollups of data flow events, stored as compact columnar NumPy .npz files so that long term trends
+can be plotted without re-parsing the summary logs. One file is kept per site, script and resolution, i.e.
+sas.rsync_to_nas.hourly.npz, with the columns:
+    time            Start of the hour or day (UTC), datetime64[s]
+    runs            Number of times the script ran
+    files           Number of files successfully transferred/converted/distributed
+    bytes           Total size of the successful files in bytes (only known for logs with structured events)
+    failures        Number of files that failed
+    duration_mean   Mean run duration in seconds (NaN if no runs finished)
+    duration_max    Longest run duration in seconds (NaN if no runs finished)
+
+Rollups are updated incrementally: each bucket is derived from complete days of logs, so updating a rollup replaces
+the days that were re-parsed and keeps every older day as is.
+"""
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+RESOLUTIONS = {'hourly': timedelta(hours=1), 'daily': timedelta(days=1)}
+COLUMNS = ('time', 'runs', 'files', 'bytes', 'failures', 'duration_mean', 'duration_max')
+
+
+def rollup_path(rollup_dir, site, script, resolution):
+    """
+    :param rollup_dir: Directory the rollup files are kept in
+    :param site: Site ID. Ex) sas
+    :param script: Data flow script. Ex) rsync_to_nas
+    :param resolution: 'hourly' or 'daily'
+    :return: Path to the rollup file
+    """
+
+    return os.path.join(rollup_dir, f"{site}.{script}.{resolution}.npz")
+
+
+def bucket_start(dt, resolution):
+    """
+    :param dt: Datetime object
+    :param resolution: 'hourly' or 'daily'
+    :return: Datetime of the start of the bucket dt falls in
+    """
+
+    if resolution == 'hourly':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_events(events, resolution):
+    """
+    Accumulate events into time buckets
+    :param events: Iterable of event dictionaries (see dataflow_events.py)
+    :param resolution: 'hourly' or 'daily'
+    :return: Dictionary of bucket start datetime -> dictionary of accumulated counts
+    """
+
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"{resolution} not a valid rollup resolution")
+
+    buckets = {}
+    for event in events:
+        if event['time'] is None:
+            continue
+        dt = bucket_start(datetime.strptime(event['time'], "%Y-%m-%d %H:%M:%S"), resolution)
+        if dt not in buckets:
+            buckets[dt] = {'runs': 0, 'files': 0, 'bytes': 0, 'failures': 0, 'durations': []}
+        bucket = buckets[dt]
+
+        if event['status'] == 'start':
+            bucket['runs'] += 1
+        elif event['status'] == 'success':
+            bucket['files'] += 1
+            if event['bytes'] is not None:
+                bucket['bytes'] += event['bytes']
+        elif event['status'] == 'failed':
+            bucket['failures'] += 1
+        elif event['status'] == 'finish' and event['duration'] is not None:
+            bucket['durations'].append(event['duration'])
+
+    return buckets
+
+
+def buckets_to_arrays(buckets):
+    """
+    :param buckets: Dictionary returned by rollup_events()
+    :return: Dictionary of column name -> numpy array, sorted by time
+    """
+
+    times = sorted(buckets)
+    durations = [buckets[t]['durations'] for t in times]
+    return {'time': np.array(times, dtype='datetime64[s]'),
+            'runs': np.array([buckets[t]['runs'] for t in times], dtype=np.uint32),
+            'files': np.array([buckets[t]['files'] for t in times], dtype=np.uint32),
+            'bytes': np.array([buckets[t]['bytes'] for t in times], dtype=np.uint64),
+            'failures': np.array([buckets[t]['failures'] for t in times], dtype=np.uint32),
+            'duration_mean': np.array([np.mean(d) if d else np.nan for d in durations], dtype=np.float32),
+            'duration_max': np.array([np.max(d) if d else np.nan for d in durations], dtype=np.float32)}
+
+
+def load_rollup(path):
+    """
+    :param path: Path to a rollup file
+    :return: Dictionary of column name -> numpy array. Empty arrays if the file doesn't exist
+    """
+
+    if not os.path.isfile(path):
+        return buckets_to_arrays({})
+    with np.load(path) as data:
+        return {column: data[column] for column in COLUMNS}
+
+
+def update_rollup(path, buckets, days):
+    """
+    Merge newly accumulated buckets into a rollup file. All existing rows within the given days are replaced, so the
+    buckets must hold every event of those days.
+    :param path: Path to the rollup file
+    :param buckets: Dictionary returned by rollup_events()
+    :param days: Collection of date objects that the buckets were derived from
+    """
+
+    existing = load_rollup(path)
+    new = buckets_to_arrays(buckets)
+
+    replaced_days = np.array(sorted(set(days) | {t.date() for t in buckets}), dtype='datetime64[D]')
+    keep = ~np.isin(existing['time'].astype('datetime64[D]'), replaced_days)
+
+    merged = {column: np.concatenate([existing[column][keep], new[column]]) for column in COLUMNS}
+    order = np.argsort(merged['time'], kind='stable')
+    merged = {column: values[order] for column, values in merged.items()}
+
+    # Write to a temporary file first so an interrupted update doesn't lose the history
+    tmp_path = f"{path[:-len('.npz')]}.tmp.npz"
+    np.savez_compressed(tmp_path, **merged)
+    os.replace(tmp_path, path)
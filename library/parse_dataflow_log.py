@@ -12,10 +12,44 @@ What we want to parse:
 """
 import argparse
 import os
+import re
+import sys
+import bz2
+import gzip
 import json
-from glob import glob
+import time
+import urllib.request
 from socket import gethostbyaddr
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+from dataflow_events import event_log_path, parse_event_line
+
+# inotify is optional - follow mode falls back to polling the log directories when it is unavailable
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# numpy is optional - rollups are only written when it is installed
+try:
+    import dataflow_rollups
+except ImportError:
+    dataflow_rollups = None
+
+# zstandard is optional - only needed if old logs have been compressed with zstd
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+POSSIBLE_SCRIPTS = ["rsync_to_nas", "convert_and_restructure", "rsync_to_campus", "convert_on_campus",
+                    "distribute_borealis_data"]
+
+# Extensions of compressed logs that can be read in place of plain text logs, i.e. 20240101.rsync_to_nas_summary.log.gz
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".zst")
+
+# Date in a summary log filename. Ex) 20240101.rsync_to_nas_summary.log or sas.20240101.convert_on_campus_summary.log
+LOG_DATE_REGEX = re.compile(r"(?:^|\.)(\d{8})\.")
 
 
 def usage_msg():
@@ -25,13 +59,24 @@ def usage_msg():
     :return: The usage message
     """
 
-    usage_message = """ parse_dataflow_log.py [-h] [-v] [--site_id SITE_ID] [-n NUM_DAYS] -- log_dir out_dir
+    usage_message = """ parse_dataflow_log.py [-h] [-v] [--site_id SITE_ID] [-n NUM_DAYS] [--rollup_dir ROLLUP_DIR]
+                                 -- log_dir out_dir
     
     This script will parse the summary log files for all found dataflow scripts and collect telemetry info and 
     statistics. This data will be stored in two separate json files:
     - One for on-site data flow scripts
     - One for on-campus data flow scripts
     Each json file will be split into two sections: Summary and Statistics. 
+    Hourly and daily rollups of each script's activity are also kept in .npz files under --rollup_dir, updated with
+    the last NUM_DAYS of logs every time the script runs.
+
+    parse_dataflow_log.py --follow [--events_file EVENTS_FILE] [--slack_webhook WEBHOOK] -- log_dir
+
+    In follow mode the script watches the summary log directories and emits one JSON event per line as lines are
+    appended to the summary logs, following each script on to the next day's logfile.
+
+    Where a data flow script writes structured events to a JSON-lines sidecar next to its summary log (i.e.
+    20240101.rsync_to_nas_summary.jsonl), the events are read from the sidecar instead of parsing the text log.
     """
 
     return usage_message
@@ -46,6 +91,16 @@ def argument_parser():
     parser.add_argument("-n", metavar="NUM_DAYS", type=int, default=7, nargs="?",
                         help="Number of days to collect logfile information for. Defaults to 7 days")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print final parsed output in readable format")
+    parser.add_argument("--rollup_dir", help="Directory to keep the hourly and daily rollup .npz files in. Defaults to "
+                                             "out_dir/rollups")
+    parser.add_argument("-f", "--follow", action="store_true",
+                        help="Watch log_dir and emit structured events as summary log lines are written")
+    parser.add_argument("--events_file", help="Follow mode: append JSON-lines events to this file instead of stdout")
+    parser.add_argument("--slack_webhook", default=os.environ.get("SLACK_DATAFLOW_WEBHOOK"),
+                        help="Follow mode: Slack webhook to alert on failure events. Defaults to "
+                             "$SLACK_DATAFLOW_WEBHOOK")
+    parser.add_argument("--poll_interval", type=float, default=0.5,
+                        help="Follow mode: seconds between checks of the log directories. Defaults to 0.5")
 
     return parser
 
@@ -63,14 +118,11 @@ def get_dataflow_overview(log_directory, scripts):
     if not os.path.isdir(log_directory):
         raise NotADirectoryError(f"{log_directory} is not a valid directory")
 
-    possible_scripts = ["rsync_to_nas", "convert_and_restructure", "rsync_to_campus", "convert_on_campus",
-                        "distribute_borealis_data"]
-
     if isinstance(scripts, str):
         scripts = [scripts]
 
     for s in scripts:
-        if s not in possible_scripts:
+        if s not in POSSIBLE_SCRIPTS:
             raise ValueError(f"{s} not a valid script name")
 
     # Search for each data flow script's logfile, and parse it for overview information
@@ -81,17 +133,14 @@ def get_dataflow_overview(log_directory, scripts):
         summary_data[script] = {}
 
         # Find all log files for script
-        logs = []
-        pattern = f'*{script}*.log'
-        for directory, _, _, in os.walk(log_directory):
-            logs.extend(glob(os.path.join(directory, pattern)))
+        logs = find_logs(log_directory, script)
 
         # Get the latest logfile to get most up-to-date summary info
-        latest_log = max(logs, key=os.path.getmtime)
+        latest_log = max(logs, key=log_sort_key)
 
         # Get the last entered log entry
         latest_entry = []
-        with open(latest_log) as f:
+        with open_log(latest_log) as f:
             for line in f:
                 latest_entry.append(line.strip())
                 if line.startswith("########"):
@@ -182,14 +231,11 @@ def parse_logfile(log_directory, scripts, n):
     if not os.path.isdir(log_directory):
         raise NotADirectoryError(f"{log_directory} is not a valid directory")
 
-    possible_scripts = ["rsync_to_nas", "convert_and_restructure", "rsync_to_campus", "convert_on_campus",
-                        "distribute_borealis_data"]
-
     if isinstance(scripts, str):
         scripts = [scripts]
 
     for s in scripts:
-        if s not in possible_scripts:
+        if s not in POSSIBLE_SCRIPTS:
             raise ValueError(f"{s} not a valid script name")
 
     dataflow_stats = {}
@@ -197,17 +243,18 @@ def parse_logfile(log_directory, scripts, n):
     old_log_threshold = timedelta(days=n)
 
     for script in scripts:
-        # Find all log files for script
-        logs = []
-        pattern = f'*{script}*.log'
-        for directory, _, _, in os.walk(log_directory):
-            logs.extend(glob(os.path.join(directory, pattern)))
+        # Find the log files for script from the last n days. Logs are pruned using the date in their filename, so
+        # older (possibly compressed) logs are never opened
+        start_date = (datetime.now(timezone.utc) - old_log_threshold).date()
+        logs = find_logs(log_directory, script, start_date)
 
         # Get the n latest logfiles
-        latest_logs = sorted(logs, key=os.path.getmtime, reverse=True)[0:n]
-        # Remove all logs older than n days
+        latest_logs = sorted(logs, key=log_sort_key, reverse=True)[0:n]
+        # Remove all logs older than n days. Only needed for logs without a date in their filename
         copy = latest_logs.copy()
         for log in latest_logs:
+            if get_log_date(log) is not None:
+                continue
             log_dt = datetime.fromtimestamp(os.path.getmtime(log))
             current_dt = datetime.now()
             if current_dt - old_log_threshold > log_dt:
@@ -232,6 +279,45 @@ def parse_logfile(log_directory, scripts, n):
     return dataflow_stats
 
 
+def update_rollups(log_directory, rollup_directory, scripts, n, site_id=None):
+    """
+    Update the hourly and daily rollups of each script with the last n days of logs. Days that are re-parsed replace
+    the existing rollup rows for those days, older rows are kept.
+    :param log_directory: Directory to start searching logfiles
+    :param rollup_directory: Directory the rollup .npz files are kept in
+    :param scripts: List of all scripts to update rollups for
+    :param n: Number of days of logs to parse
+    :param site_id: Site ID to file the rollups under. Defaults to the radar recorded in the logs
+    """
+
+    if dataflow_rollups is None:
+        print("numpy is not installed, not updating rollups")
+        return
+
+    if isinstance(scripts, str):
+        scripts = [scripts]
+
+    os.makedirs(rollup_directory, exist_ok=True)
+    start_date = (datetime.now(timezone.utc) - timedelta(days=n)).date()
+
+    for script in scripts:
+        # Every log of each day is needed, since the rollup rows of the days parsed are replaced
+        logs = find_logs(log_directory, script, start_date)
+        days = {get_log_date(log) for log in logs} - {None}
+
+        events = {}     # Site ID -> list of events
+        for log in logs:
+            for event in iter_log_events(log):
+                site = site_id if site_id is not None else (event['radar'] or "unknown")
+                events.setdefault(site, []).append(event)
+
+        for site, site_events in events.items():
+            for resolution in dataflow_rollups.RESOLUTIONS:
+                buckets = dataflow_rollups.rollup_events(site_events, resolution)
+                path = dataflow_rollups.rollup_path(rollup_directory, site, script, resolution)
+                dataflow_rollups.update_rollup(path, buckets, days)
+
+
 def parse_transfer_logs(logfiles, threshold):
     """
     Parse given rsync_to_nas or rsync_to_campus logfiles for telemetry info. Gets following info:
@@ -252,45 +338,36 @@ def parse_transfer_logs(logfiles, threshold):
     no_action = False       # Flag to check if script executed transfers when it was triggered
     empty_runs = 0          # Number of times the script performed no transfers
     transfer_times = []
+    transfer_dt = None
 
     for log in logfiles:
-        with open(log) as f:
-            lines = f.readlines()
-            for index, line in enumerate(lines):
-                # Loop through each logfile and collect statistics
-
-                # Get time of transfer
-                if line.startswith("Executing"):
-                    if no_action:
-                        empty_runs += 1
-                    no_action = True
-                    date_string = lines[index+1].split()[0:2]
-                    date_string = ' '.join(date_string)
-                    dt_format = "%Y%m%d %H:%M:%S"
-                    transfer_dt = datetime.strptime(date_string, dt_format)     # datetime transfer occurred
-
-                # Check if successful file is old
-                if 'successful' in line.lower():
-                    successful_files += 1
-                    filename = line.split()[-1].split('/')[-1]
-                    file_dt = get_file_datetime(filename)   # datetime file was created
-                    if transfer_dt - threshold > file_dt:
-                        old_files.append(filename)
-                    no_action = False
-
-                # Record all failed transfers
-                if 'failed' in line:
-                    filename = line.split()[-1].split('/')[-1]
-                    failed_files.append(filename)
-                    no_action = False
-
-                # Calculate the total transfer time
-                if line.startswith("Finished"):
-                    date_string = ' '.join(line.split()[-3:-1])
-                    dt_format = "%Y%m%d %H:%M:%S"
-                    end_dt = datetime.strptime(date_string, dt_format)     # datetime transfer occurred
-                    transfer_time = end_dt - transfer_dt
-                    transfer_times.append(transfer_time)
+        for event in iter_log_events(log):
+            # Loop through each logfile's events and collect statistics
+
+            # Get time of transfer
+            if event['status'] == 'start':
+                if no_action:
+                    empty_runs += 1
+                no_action = True
+                transfer_dt = get_event_datetime(event)     # datetime transfer occurred
+
+            # Check if successful file is old
+            elif event['status'] == 'success':
+                successful_files += 1
+                filename = event['file']
+                file_dt = get_file_datetime(filename)   # datetime file was created
+                if transfer_dt is not None and transfer_dt - threshold > file_dt:
+                    old_files.append(filename)
+                no_action = False
+
+            # Record all failed transfers
+            elif event['status'] == 'failed':
+                failed_files.append(event['file'])
+                no_action = False
+
+            # Calculate the total transfer time
+            elif event['status'] == 'finish' and event['duration'] is not None:
+                transfer_times.append(timedelta(seconds=event['duration']))
 
     total_files = successful_files + len(failed_files)
     if total_files > 0:
@@ -338,64 +415,52 @@ def parse_convert_logs(logfiles, threshold):
     no_action = False       # Flag to check if script executed transfers when it was triggered
     empty_runs = 0          # Number of times the script performed no transfers
     transfer_times = []
+    transfer_dt = None
 
     for log in logfiles:
-        with open(log) as f:
-            lines = f.readlines()
-            for index, line in enumerate(lines):
-                # Loop through each logfile and collect statistics
-
-                # Get time of transfer
-                if line.startswith("Executing"):
-                    if no_action:
-                        empty_runs += 1
-                    no_action = True
-
-                    if 'convert_and_restructure' in line:
-                        scriptname = 'convert_and_restructure'
-                    if 'convert_on_campus' in line:
-                        scriptname = 'convert_on_campus'
-
-                    date_string = lines[index+1].split()[0:2]
-                    date_string = ' '.join(date_string)
-                    dt_format = "%Y%m%d %H:%M:%S"
-                    transfer_dt = datetime.strptime(date_string, dt_format)     # datetime transfer occurred
-
-                # Check if successful file is old
-                if line.startswith("Successfully converted:"):
-                    filename = line.split()[-1].split('/')[-1]
-                    # print(filename)
-                    if 'rawacf' in filename:
-                        successful_rawacf += 1
-                    if 'antennas_iq' in filename:
-                        successful_antennas_iq += 1
-
-                    file_dt = get_file_datetime(filename)   # datetime file was created
-                    if transfer_dt - threshold > file_dt:
-                        old_files.append(filename)
-                    no_action = False
-
-                # Record all failed conversions/restructures
-                if line.startswith("File failed to convert:"):
-                    filename = line.split()[-1].split('/')[-1]
-                    if 'rawacf' in filename:
-                        failed_rawacf.append(filename)
-                    if 'antennas_iq' in filename:
-                        failed_antennas_iq.append(filename)
-                    no_action = False
-
-                # Record all files that have records removed
-                if line.startswith("Removed records from"):
-                    filename = line.split()[-1][:-1].split('/')[-1]
-                    records_removed.append(filename)
-
-                # Calculate the total transfer time
-                if line.startswith("Finished"):
-                    date_string = ' '.join(line.split()[-3:-1])
-                    dt_format = "%Y%m%d %H:%M:%S"
-                    end_dt = datetime.strptime(date_string, dt_format)  # datetime transfer occurred
-                    transfer_time = end_dt - transfer_dt
-                    transfer_times.append(transfer_time)
+        for event in iter_log_events(log):
+            # Loop through each logfile's events and collect statistics
+
+            # Get time of transfer
+            if event['status'] == 'start':
+                if no_action:
+                    empty_runs += 1
+                no_action = True
+
+                if event['script'] in ['convert_and_restructure', 'convert_on_campus']:
+                    scriptname = event['script']
+
+                transfer_dt = get_event_datetime(event)     # datetime transfer occurred
+
+            # Check if successful file is old
+            elif event['status'] == 'success':
+                filename = event['file']
+                if 'rawacf' in filename:
+                    successful_rawacf += 1
+                if 'antennas_iq' in filename:
+                    successful_antennas_iq += 1
+
+                file_dt = get_file_datetime(filename)   # datetime file was created
+                if transfer_dt is not None and transfer_dt - threshold > file_dt:
+                    old_files.append(filename)
+                no_action = False
+
+            # Record all failed conversions/restructures
+            elif event['status'] == 'failed':
+                filename = event['file']
+                if 'rawacf' in filename:
+                    failed_rawacf.append(filename)
+                if 'antennas_iq' in filename:
+                    failed_antennas_iq.append(filename)
+                no_action = False
+
+            # Record all files that have records removed
+            elif event['status'] == 'records_removed':
+                records_removed.append(event['file'])
+
+            # Calculate the total transfer time
+            elif event['status'] == 'finish' and event['duration'] is not None:
+                transfer_times.append(timedelta(seconds=event['duration']))
 
     total_rawacf = successful_rawacf + len(failed_rawacf)
     total_antennas_iq = successful_antennas_iq + len(failed_antennas_iq)
@@ -428,6 +493,164 @@ def parse_convert_logs(logfiles, threshold):
     return stats
 
 
+def iter_log_events(log_path):
+    """
+    Get the events recorded in a summary logfile. If the data flow script wrote a JSON-lines sidecar next to the
+    logfile the events are read straight from it, otherwise the text of the logfile is parsed line by line.
+    :param log_path: Path to a summary logfile. Ex) 20240101.rsync_to_nas_summary.log
+    :return: Generator of event dictionaries, in the order they were written
+    """
+
+    events_file = find_event_log(log_path)
+    if events_file is not None:
+        with open_log(events_file) as f:
+            for line in f:
+                event = parse_event_line(line)
+                if event is not None:
+                    yield event
+        return
+
+    parser = SummaryLineParser(get_log_script(log_path))
+    with open_log(log_path) as f:
+        for line in f:
+            event = parser.parse_line(line)
+            if event is not None:
+                yield event
+
+
+def strip_compressed_extension(log_path):
+    """
+    :param log_path: Path to a logfile, possibly compressed. Ex) 20240101.rsync_to_nas_summary.log.gz
+    :return: Path with any compression extension removed. Ex) 20240101.rsync_to_nas_summary.log
+    """
+
+    for ext in COMPRESSED_EXTENSIONS:
+        if log_path.endswith(ext):
+            return log_path[:-len(ext)]
+    return log_path
+
+
+def find_event_log(log_path):
+    """
+    Find the JSON-lines event sidecar of a summary logfile. The sidecar may be compressed independently of the log
+    :param log_path: Path to a summary logfile, possibly compressed
+    :return: Path to the sidecar, or None if the script didn't write one
+    """
+
+    events_file = event_log_path(strip_compressed_extension(log_path))
+    for candidate in (events_file, *(events_file + ext for ext in COMPRESSED_EXTENSIONS)):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def open_log(log_path):
+    """
+    Open a logfile for reading as text, decompressing it as it is read if it is compressed with gzip, bzip2 or zstd
+    :param log_path: Path to the logfile
+    :return: Open text stream of the logfile
+    """
+
+    if log_path.endswith(".gz"):
+        return gzip.open(log_path, 'rt')
+    if log_path.endswith(".bz2"):
+        return bz2.open(log_path, 'rt')
+    if log_path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(f"The zstandard package is required to read {log_path}")
+        return zstandard.open(log_path, 'rt')
+    return open(log_path)
+
+
+def get_log_date(log_path):
+    """
+    Get the date a summary logfile was written from the logfile name
+    :param log_path: Path to a summary logfile. Ex) 20240101.rsync_to_nas_summary.log.gz
+    :return: Date object of the logfile, or None if there is no date in the filename
+    """
+
+    match = LOG_DATE_REGEX.search(os.path.basename(log_path))
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def log_sort_key(log_path):
+    """ :return: Key to sort logfiles by the date they were written, using the modification time for ties """
+    log_date = get_log_date(log_path)
+    log_dt = datetime.min if log_date is None else datetime.combine(log_date, datetime.min.time())
+    return log_dt, os.path.getmtime(log_path)
+
+
+def find_logs(log_directory, script, start_date=None):
+    """
+    Find the summary logfiles of a script, including logfiles compressed with gzip, bzip2 or zstd. If a log exists
+    both compressed and uncompressed (i.e. while it is being compressed), only the uncompressed log is returned.
+    :param log_directory: Directory to start searching for summary logfiles
+    :param script: Name of the data flow script
+    :param start_date: Skip logfiles and YYYY/MM log directories dated before this date. Logfiles without a date in
+    their name are always returned
+    :return: List of logfile paths
+    """
+
+    if start_date is not None:
+        # Log directories are named using the local date but logfiles using the UTC date, so allow a day of overlap
+        directory_start_date = start_date - timedelta(days=1)
+
+    logs = {}   # Uncompressed logfile path -> path of the logfile found
+    for directory, subdirectories, filenames in os.walk(log_directory):
+        if start_date is not None:
+            # Don't descend into YYYY or YYYY/MM directories that are entirely before the start date
+            subdirectories[:] = [d for d in subdirectories
+                                 if not is_old_log_directory(directory, d, directory_start_date)]
+
+        for filename in filenames:
+            if script not in filename:
+                continue
+            log_path = strip_compressed_extension(filename)
+            if not log_path.endswith(".log"):
+                continue
+            if start_date is not None:
+                log_date = get_log_date(filename)
+                if log_date is not None and log_date < start_date:
+                    continue
+            log_path = os.path.join(directory, log_path)
+            if logs.get(log_path) != log_path:     # Prefer the uncompressed log
+                logs[log_path] = os.path.join(directory, filename)
+
+    return list(logs.values())
+
+
+def is_old_log_directory(parent, directory, start_date):
+    """
+    :param parent: Path of the directory containing directory
+    :param directory: Name of the directory
+    :param start_date: Date object
+    :return: True if directory is a YYYY or YYYY/MM log directory that only holds logs from before start_date
+    """
+
+    if re.fullmatch(r"\d{4}", directory):
+        return int(directory) < start_date.year
+    year = os.path.basename(os.path.normpath(parent))
+    if re.fullmatch(r"\d{2}", directory) and re.fullmatch(r"\d{4}", year):
+        return (int(year), int(directory)) < (start_date.year, start_date.month)
+    return False
+
+
+def get_event_datetime(event):
+    """
+    :param event: Event dictionary
+    :return: Datetime object of the time the event occurred, or None if the time is unknown
+    """
+
+    if event['time'] is None:
+        return None
+    return datetime.strptime(event['time'], "%Y-%m-%d %H:%M:%S")
+
+
 def get_file_datetime(filename):
     """
     Parse a given filename and return a datetime object of its timestamp
@@ -441,6 +664,299 @@ def get_file_datetime(filename):
     return datetime.strptime(filename, dt_format)
 
 
+def get_log_script(log_path):
+    """
+    Get the data flow script that wrote a summary logfile from the logfile name
+    :param log_path: Path to a summary logfile. Ex) 20240101.rsync_to_nas_summary.log
+    :return: Name of the data flow script, or None if the logfile doesn't belong to a known script
+    """
+
+    filename = os.path.basename(log_path)
+    for script in POSSIBLE_SCRIPTS:
+        if script in filename:
+            return script
+    return None
+
+
+class SummaryLineParser(object):
+    """
+    Turns the lines of a single summary logfile into structured events, one line at a time. The parser keeps the state
+    needed to interpret a line (which run it belongs to, the host running the script) so it can be fed lines as they
+    are appended to the logfile.
+
+    Each event is a dictionary with the keys: time, script, host, radar, stage, status, file, bytes, duration, message.
+    Status is one of 'start', 'finish', 'success', 'failed' or 'records_removed'.
+    """
+
+    dt_format = "%Y%m%d %H:%M:%S"
+
+    def __init__(self, script=None):
+        """
+        :param script: Name of the data flow script that writes the logfile, if known
+        """
+        self.script = script
+        self.host = None
+        self.radar = None
+        self.run_dt = None
+        self.expecting_start_time = False
+
+    def stage(self):
+        """ :return: The data flow stage the script performs (transfer, convert or distribute) """
+        if self.script is None:
+            return None
+        if self.script.startswith("rsync"):
+            return "transfer"
+        if self.script.startswith("convert"):
+            return "convert"
+        return "distribute"
+
+    def event(self, status, dt=None, stage=None, filename=None, duration=None, message=None):
+        """ :return: Event dictionary for the current run of the script """
+        if dt is None:
+            dt = self.run_dt
+        return {'time': dt.strftime("%Y-%m-%d %H:%M:%S") if dt is not None else None,
+                'script': self.script,
+                'host': self.host,
+                'radar': self.radar,
+                'stage': stage if stage is not None else self.stage(),
+                'status': status,
+                'file': filename,
+                'bytes': None,
+                'duration': duration,
+                'message': message}
+
+    def parse_line(self, line):
+        """
+        Parse a single summary log line
+        :param line: Line from the summary logfile
+        :return: Event dictionary, or None if the line doesn't describe an event
+        """
+
+        line = line.strip()
+        if line == "":
+            return None
+
+        # The UTC start time is written on the line following "Executing ..."
+        if self.expecting_start_time:
+            self.expecting_start_time = False
+            try:
+                self.run_dt = datetime.strptime(' '.join(line.split()[0:2]), self.dt_format)
+            except ValueError:
+                self.run_dt = None
+            return self.event('start', stage='run', message=line)
+
+        if line.startswith("Executing"):
+            # Ex): "Executing /home/radar/data_flow/borealis/rsync_to_nas on sasborealis for sas"
+            words = line.split()
+            script = os.path.basename(words[1]) if len(words) > 1 else None
+            if script in POSSIBLE_SCRIPTS:
+                self.script = script
+            if "on" in words[2:-1]:
+                self.host = words[words.index("on", 2) + 1]
+            if "for" in words[2:-1]:
+                self.radar = words[words.index("for", 2) + 1]
+            self.expecting_start_time = True
+            return None
+
+        if line.startswith("Finished"):
+            try:
+                end_dt = datetime.strptime(' '.join(line.split()[-3:-1]), self.dt_format)
+            except ValueError:
+                return None
+            duration = (end_dt - self.run_dt).total_seconds() if self.run_dt is not None else None
+            return self.event('finish', dt=end_dt, stage='run', duration=duration, message=line)
+
+        if line.startswith("Removed records from"):
+            filename = line.split()[-1][:-1].split('/')[-1]
+            return self.event('records_removed', filename=filename, message=line)
+
+        if 'successful' in line.lower():
+            return self.event('success', filename=line.split()[-1].split('/')[-1], message=line)
+
+        if 'failed' in line:
+            return self.event('failed', filename=line.split()[-1].split('/')[-1], message=line)
+
+        return None
+
+
+class SummaryLogFollower(object):
+    """
+    Follows the summary logfiles in a directory tree, parsing lines as they are appended and passing the resulting
+    events to a callback. New logfiles (i.e. the next day's logfile, or a new YYYY/MM directory) are picked up as they
+    are created. Uses inotify to wake up when the logs change if the inotify_simple package is installed, otherwise
+    the directories are polled.
+    """
+
+    def __init__(self, log_directory, callback, scripts=None, poll_interval=0.5, idle_timeout=timedelta(days=1),
+                 from_start=False):
+        """
+        :param log_directory: Directory to start searching for summary logfiles
+        :param callback: Called with each event dictionary as soon as its line is parsed
+        :param scripts: List of scripts to follow. Defaults to all data flow scripts
+        :param poll_interval: Seconds between checks of the log directories
+        :param idle_timeout: Stop checking a logfile once it hasn't been written to in this long. timedelta
+        :param from_start: If True, emit events for the existing contents of the logfiles. Otherwise only lines
+        written after the follower starts are parsed
+        """
+
+        if not os.path.isdir(log_directory):
+            raise NotADirectoryError(f"{log_directory} is not a valid directory")
+
+        if scripts is None:
+            scripts = POSSIBLE_SCRIPTS
+        if isinstance(scripts, str):
+            scripts = [scripts]
+        for s in scripts:
+            if s not in POSSIBLE_SCRIPTS:
+                raise ValueError(f"{s} not a valid script name")
+
+        self.log_directory = log_directory
+        self.callback = callback
+        self.scripts = scripts
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout.total_seconds()
+
+        self.directories = {}   # Directory path -> last seen mtime
+        self.logs = {}          # Logfile path -> dictionary of offset, partial line, parser, last growth time
+
+        self.inotify = None
+        if inotify_simple is not None:
+            self.inotify = inotify_simple.INotify()
+            self.watch_flags = (inotify_simple.flags.MODIFY | inotify_simple.flags.CREATE |
+                                inotify_simple.flags.MOVED_TO)
+
+        self.add_directory(log_directory, from_start)
+
+    def add_directory(self, directory, from_start=True):
+        """ Start watching a directory and its subdirectories, and follow any summary logfiles within them """
+        self.directories[directory] = os.stat(directory).st_mtime_ns
+        if self.inotify is not None:
+            self.inotify.add_watch(directory, self.watch_flags)
+        self.scan_directory(directory, from_start)
+
+    def scan_directory(self, directory, from_start=True):
+        """ Find any new subdirectories and summary logfiles within a watched directory """
+        now = time.time()
+        for entry in os.scandir(directory):
+            if entry.is_dir():
+                if entry.path not in self.directories:
+                    self.add_directory(entry.path, from_start)
+                continue
+            if entry.path in self.logs or not entry.name.endswith((".log", ".jsonl")):
+                continue
+            if get_log_script(entry.name) not in self.scripts:
+                continue
+            if entry.name.endswith(".log") and os.path.isfile(event_log_path(entry.path)):
+                continue    # The script writes structured events for this logfile, follow those instead
+            stat = entry.stat()
+            if now - stat.st_mtime > self.idle_timeout:
+                continue    # Old logfile that won't be written to again
+            if entry.name.endswith(".jsonl"):
+                parser = None
+                # The sidecar is created before the first line of the day's run is written, so the text log is no
+                # longer needed
+                self.logs.pop(entry.path[:-len(".jsonl")] + ".log", None)
+            else:
+                parser = SummaryLineParser(get_log_script(entry.name))
+            self.logs[entry.path] = {'offset': 0 if from_start else stat.st_size,
+                                     'partial': "",
+                                     'parser': parser,
+                                     'last_growth': now}
+
+    def read_log(self, log_path, log):
+        """ Parse all complete lines appended to a logfile since it was last read """
+        try:
+            size = os.path.getsize(log_path)
+        except FileNotFoundError:
+            self.logs.pop(log_path)
+            return
+        if size < log['offset']:
+            # Logfile was truncated or replaced, start again from the beginning
+            log['offset'] = 0
+            log['partial'] = ""
+        if size == log['offset']:
+            if time.time() - log['last_growth'] > self.idle_timeout:
+                self.logs.pop(log_path)
+            return
+
+        with open(log_path) as f:
+            f.seek(log['offset'])
+            data = f.read()
+            log['offset'] = f.tell()
+        log['last_growth'] = time.time()
+
+        lines = (log['partial'] + data).split("\n")
+        log['partial'] = lines.pop()    # Hold on to an incomplete last line until the rest of it is written
+        for line in lines:
+            if log['parser'] is None:
+                event = parse_event_line(line)
+            else:
+                event = log['parser'].parse_line(line)
+            if event is not None:
+                self.callback(event)
+
+    def poll(self):
+        """ Check the watched directories and logfiles once, emitting events for any newly written lines """
+        for directory, mtime in list(self.directories.items()):
+            try:
+                current_mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                self.directories.pop(directory)
+                continue
+            if current_mtime != mtime:
+                self.directories[directory] = current_mtime
+                self.scan_directory(directory)
+
+        for log_path, log in list(self.logs.items()):
+            self.read_log(log_path, log)
+
+    def run(self):
+        """ Follow the logs until interrupted """
+        while True:
+            self.poll()
+            if self.inotify is not None:
+                # Wake up as soon as anything changes, but check at least every poll_interval for missed changes
+                self.inotify.read(timeout=int(self.poll_interval * 1000), read_delay=50)
+            else:
+                time.sleep(self.poll_interval)
+
+
+def json_lines_callback(stream):
+    """
+    :param stream: Open text stream to write events to (Ex: sys.stdout)
+    :return: Callback that writes each event to the stream as a line of JSON
+    """
+
+    def write_event(event):
+        stream.write(json.dumps(event) + "\n")
+        stream.flush()
+
+    return write_event
+
+
+def slack_alert_callback(webhook, site_id=None):
+    """
+    :param webhook: Slack webhook to send alerts to (generally the #data-flow-alerts channel)
+    :param site_id: Site ID to include in the alert message
+    :return: Callback that sends a Slack alert for every failure event
+    """
+
+    def alert(event):
+        if event['status'] != 'failed':
+            return
+        radar = site_id if site_id is not None else event['radar']
+        description = event.get('message') or f"{event['stage']} failed: {event['file']}"
+        message = f"{event['time']}   {event['script']} {radar} - {description}"
+        request = urllib.request.Request(webhook, data=json.dumps({'text': message}).encode(),
+                                         headers={'Content-type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except OSError as err:
+            print(f"Slack alert failed with error: {err}. Attempted message was {message}", file=sys.stderr)
+
+    return alert
+
+
 def print_dataflow_dict(dataflow_dict):
     for i in dataflow_dict:
         print(i)
@@ -469,6 +985,25 @@ if __name__ == '__main__':
     num_days = args.n
     verbose = args.verbose
 
+    if args.follow:
+        if args.events_file is None:
+            event_stream = sys.stdout
+        else:
+            event_stream = open(args.events_file, 'a')
+        callbacks = [json_lines_callback(event_stream)]
+        if args.slack_webhook:
+            callbacks.append(slack_alert_callback(args.slack_webhook, args.site_id))
+
+        def emit(event):
+            for callback in callbacks:
+                callback(event)
+
+        try:
+            SummaryLogFollower(log_dir, emit, poll_interval=args.poll_interval).run()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
     if args.out_dir is None:
         out_dir = log_dir
     else:
@@ -489,6 +1024,12 @@ if __name__ == '__main__':
     campus_summary_dict = get_dataflow_overview(log_dir, campus_scripts)
     campus_detailed_dict = parse_logfile(log_dir, campus_scripts, num_days)
 
+    if args.rollup_dir is None:
+        rollup_dir = os.path.join(out_dir, "rollups")
+    else:
+        rollup_dir = args.rollup_dir
+    update_rollups(log_dir, rollup_dir, site_scripts + campus_scripts, num_days, args.site_id)
+
     today = datetime.now().strftime("%Y-%m-%d %H:%M")
     print(f"\n{today}")
     print(f"Parsing logs in {log_dir}")
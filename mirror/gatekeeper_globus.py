@@ -30,13 +30,16 @@ import globus_sdk
 from globus_sdk.scopes import TransferScopes
 import inspect
 from datetime import datetime, timedelta
-from os.path import expanduser, isfile, getsize, isdir
+from os.path import expanduser, isfile, getsize, isdir, abspath
 from os import listdir, mkdir, remove, rename, stat
 import shutil
 import fnmatch
 import sys
+import signal
 import subprocess
+import threading
 import time
+import traceback
 # Import smtp library and email MIME function for email alerts
 import smtplib
 from email.mime.text import MIMEText
@@ -44,24 +47,34 @@ import pydarnio
 import logging
 import argparse
 import hashlib
-
-from tools.gatekeeper_class import Gatekeeper, parse_data_filename, sha1hashing
-
-# Make sure there is only one instance running of this script
-from tendo import singleton
-
-me = singleton.SingleInstance()
+from concurrent.futures import FIRST_COMPLETED
+
+from tools.gatekeeper_class import Gatekeeper, hash_and_test_parallel, HASH_WORKERS, BZ2_FAILED, EMPTY_FILE, \
+    LOCAL_HASHES_DIR, TRANSFER_ERRORS, make_upload_chunks, UPLOAD_CHUNK_BYTES, UPLOAD_CHUNKS_IN_FLIGHT, FileRecord, \
+    group_by_yearmonth
+from tools.blocklist_index import BlocklistIndex
+from tools.hashes_file import HashesFile
+from tools.mirror_filter import MirrorFilter
+from tools.run_journal import RunJournal, JOURNAL_DIRNAME, HASHED, VALIDATED, SUBMITTING, SUBMITTED, CONFIRMED, \
+    HASHES_UPLOADED
+from tools.run_metrics import RunMetrics, metrics_filename
+from tools.holding_watcher import HoldingWatcher, SETTLE_S, RETRY_S
+from tools.run_lock import FileLock, RUN_LOCK, COMMIT_LOCK, shard_lock_name
+from tools.hash_cache import HashCache, HASH_CACHE_FILENAME, file_digests
 
 HOME = expanduser("~")
 TRANSFER_RT_FILENAME = f"{HOME}/.globus_transfer_rt"
 PERSONAL_UUID_FILENAME = f"{HOME}/.globusonline/lta/client-id.txt"
 GATEKEEPER_APP_FILENAME = f"{HOME}/mirror_id_files/gatekeeper_app_id.txt"
+DAEMON_MAX_BACKOFF_S = 3600  # Most seconds the daemon waits after a batch failed, doubling from --poll_s
 
+PERSONAL_UUID = None
 if isfile(PERSONAL_UUID_FILENAME):
     with open(PERSONAL_UUID_FILENAME) as f:
         PERSONAL_UUID = f.readline().strip()
 
 # Client ID retrieved from https://auth.globus.org/v2/web/developers
+gatekeeper_app_CLIENT_ID = None
 if isfile(GATEKEEPER_APP_FILENAME):
     with open(GATEKEEPER_APP_FILENAME) as f:
         file = f.readlines()
@@ -70,8 +83,17 @@ if isfile(GATEKEEPER_APP_FILENAME):
             gatekeeper_app_CLIENT_ID = line.split("=")[1].split()[0]
 
 
-def main():
+def main(argv=None, gk=None, files=None):
+    """ Run the gatekeeper once, or with --daemon keep running it on files as they arrive (see run_daemon())
+
+    :param argv: Command line arguments, defaults to the arguments of the script
+    :param gk: Gatekeeper to use instead of authenticating with Globus in Step 1), i.e. one with a
+    LocalTransferClient for benchmarks (see tools/benchmark_gatekeeper.py)
+    :param files: Only consider these files in the holding directory, defaults to all files matching the pattern
+    :return: With --shard_by, the exit code of the shard that did worst (0 if they all succeeded)
+    """
     start_time = datetime.now().strftime("%s")
+    run_start = time.time()
 
     parser = argparse.ArgumentParser(description='Given a local holding directory and a mirror directory this program'
                                                  'will perform checks on all local rawacf files, transfer all files to'
@@ -85,21 +107,75 @@ def main():
     parser.add_argument('-r', '--radar', type=str, default='', help='Particular radar to transfer. e.g., sas, cly')
     parser.add_argument('-p', '--pattern', type=str, default="*rawacf.bz2",
                         help='Sync pattern of rawacf files, default is rawacf.bz2')
-    args = parser.parse_args()
+    parser.add_argument('-w', '--hash_workers', type=int, default=HASH_WORKERS,
+                        help=f'Number of files to hash at the same time, default is {HASH_WORKERS}')
+    parser.add_argument('--hash_cache', type=str, default=HASH_CACHE_FILENAME,
+                        help=f'Hash cache database, default is {HASH_CACHE_FILENAME}. Empty string disables the cache')
+    parser.add_argument('--verify_fraction', type=float, default=0.01,
+                        help='Fraction of cached hashes to verify by rehashing the file, default is 0.01')
+    parser.add_argument('--chunk_gb', type=float, default=UPLOAD_CHUNK_BYTES / 1e9,
+                        help=f'Largest upload task in GB, files are uploaded in chunks of one yyyymm up to this size. '
+                             f'Default is {UPLOAD_CHUNK_BYTES / 1e9:g}')
+    parser.add_argument('--chunks_in_flight', type=int, default=UPLOAD_CHUNKS_IN_FLIGHT,
+                        help=f'Number of upload chunks transferring at the same time, default is '
+                             f'{UPLOAD_CHUNKS_IN_FLIGHT}')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running, uploading files in batches as they arrive in the holding directory')
+    parser.add_argument('--poll_s', type=float, default=30,
+                        help='Seconds between scans of the holding directory in daemon mode, default is 30')
+    parser.add_argument('--settle_s', type=float, default=SETTLE_S,
+                        help=f'Seconds a file must be unchanged before it is uploaded in daemon mode, default is '
+                             f'{SETTLE_S}')
+    parser.add_argument('--batch_files', type=int, default=5000,
+                        help='Most files in each batch in daemon mode, default is 5000')
+    parser.add_argument('--shard', action='store_true',
+                        help='Run as a shard for the radar (-r) and/or yyyymm (-y) given, alongside other shards')
+    parser.add_argument('--shard_by', type=str, default='', choices=['', 'radar', 'year_month'],
+                        help='Run a shard for each radar or each yyyymm of the files in the holding directory')
+    parser.add_argument('--max_shards', type=int, default=4,
+                        help='Number of shards running at the same time with --shard_by, default is 4')
+    parser.add_argument('--refresh_hashes_h', type=float, default=24,
+                        help=f'Hours between refreshes of the local copy of the mirror raw hashes files in '
+                             f'{LOCAL_HASHES_DIR}, which only get the months that changed in master.hashes. Default is '
+                             f'24, 0 turns the refreshes off')
+    parser.add_argument('--rebuild_master_hashes', action='store_true',
+                        help='Get every hashes file from the mirror, rebuild master.hashes from them and upload it, '
+                             'instead of uploading files. Repairs a master.hashes that is out of date')
+    args = parser.parse_args(argv)
+
+    if args.rebuild_master_hashes and (args.shard_by or args.shard or args.daemon):
+        parser.error("--rebuild_master_hashes runs alone, it can't be used with --shard_by, --shard or --daemon")
+    if args.shard_by:
+        if getattr(args, args.shard_by) != '' or args.shard or args.daemon:
+            parser.error(f"--shard_by {args.shard_by} can't be used with --shard, --daemon or the "
+                         f"{'-r' if args.shard_by == 'radar' else '-y'} it sets for each shard")
+        exit_codes = run_shards(args, argv)
+        return max(exit_codes.values(), key=abs, default=0)
+    shard = None
+    if args.shard:
+        if args.daemon or (args.radar == '' and args.year_month == ''):
+            parser.error("--shard needs -r and/or -y, and can't be used with --daemon")
+        shard = "_".join(part for part in (args.radar, args.year_month) if part != '')
+    # A run from the command line locks out the runs it would clash with, a given gatekeeper runs under the caller's
+    run_locks = take_run_locks(shard) if gk is None else []
 
     ###################################################################################################################
     # Step 1)
     # Check for refresh token and relevant consents
 
     # If we have refresh token, try initializing gatekeeper object with it for auto authentication
-    if isfile(TRANSFER_RT_FILENAME):
+    if gk is not None:
+        print("Using the given gatekeeper and its transfer backend")
+        if shard is not None and gk.shard != shard:
+            gk.set_shard(shard)
+    elif isfile(TRANSFER_RT_FILENAME):
         with open(TRANSFER_RT_FILENAME) as f:
             print("Found refresh token for automatic authentication")
-            gk = Gatekeeper(gatekeeper_app_CLIENT_ID, transfer_rt=f.readline())
+            gk = Gatekeeper(gatekeeper_app_CLIENT_ID, transfer_rt=f.readline(), shard=shard)
     # Otherwise, manually authenticate and get a refresh token for future auto authentication
     else:
         print("Need to get transfer refresh token manually for future automatic authentication")
-        gk = Gatekeeper(gatekeeper_app_CLIENT_ID)
+        gk = Gatekeeper(gatekeeper_app_CLIENT_ID, shard=shard)
         # Now check for all possible consents required on the globus endpoint and personal endpoint
         gk.check_for_consent_required()
         gk.check_for_consent_required(PERSONAL_UUID, gk.get_holding_dir())
@@ -108,25 +184,55 @@ def main():
                   "and you must login a second time (dumb, I know) to get those consents.")
         gk.get_auth_with_login(gk.consents)
 
+    if args.daemon:
+        return run_daemon(gk, args, argv)
+
     ###################################################################################################################
     # Step 2)
     # Check script arguments as well as existence of various directories
+
+    # Time each step of the run (see tools/run_metrics.py)
+    metrics = RunMetrics(metrics_filename(gk.log_file), gk)
+    gk.run_metrics = metrics
+    metrics.step("1", "Authenticate", started=run_start)
+    metrics.step("2", "Check directories")
     logger = gk.logger
 
-    # Clear out working directory ~/tmp/* before use
+    # Clear out working directory ~/tmp/* before use, except for the journal of the last run (see Step 8.5) and, in
+    # daemon mode, the files from the mirror's .config/ that are only got again when they change (see Step 3)
+    keep = [JOURNAL_DIRNAME]
+    if gk.keep_mirror_config:
+        keep += ["master.hashes", "all_failed.txt", "blocklist"]
     if isdir(gk.get_working_dir()):
-        shutil.rmtree(gk.get_working_dir())
-        mkdir(gk.get_working_dir())
+        for entry in listdir(gk.get_working_dir()):
+            if entry in keep:
+                continue
+            if isdir(f"{gk.get_working_dir()}/{entry}"):
+                shutil.rmtree(f"{gk.get_working_dir()}/{entry}")
+            else:
+                remove(f"{gk.get_working_dir()}/{entry}")
         logger.info(f"Clearing out working directory: {gk.get_working_dir()}")
     if not isdir(gk.get_working_dir()):
         sub = f"Directory {gk.get_working_dir()} DNE"
         gk.log_email_exit(logger.error, 1, 1, sub=sub)
 
+    # The journal records how far each file got, so a run that is killed can be resumed by the next one
+    journal = RunJournal(f"{gk.get_working_dir()}/{JOURNAL_DIRNAME}")
+    if len(journal.resumable()) > 0:
+        logger.info(f"Found journal of an unfinished run with {len(journal.resumable())} files submitted or further, "
+                    f"it will be resumed in Step 8.5)")
+
     logger.info(f"Args: {args.holding}  {args.mirror}  {args.pattern}")
     if args.year_month:
         logger.info(f"Gatekeeper processing rawacfs for {args.year_month}")
     if args.radar:
         logger.info(f"Gatekeeper processing rawacfs for {args.radar}")
+    # Shards update the files on the mirror that all runs share only while holding the commit lock, getting them
+    # again first, so other shards' updates aren't written over (see tools/run_lock.py)
+    commit_lock = None
+    if shard is not None:
+        logger.info(f"Running as shard {shard} in {gk.get_working_dir()}")
+        commit_lock = FileLock(COMMIT_LOCK)
 
     # Set holding directory, mirror directory, yearmonth, radar, and sync pattern from parsed arguments
     # Set holding directory, mirror directory, yearmonth, radar, and sync pattern from parsed arguments
@@ -146,15 +252,29 @@ def main():
         sub = f"Mirror root dir {gk.get_mirror_root_dir()} DNE"
         gk.log_email_exit(logger.error, 1, 1, sub=sub)
 
+    # Repair master.hashes rather than upload files: every hashes file is got from the mirror and hashed again, so
+    # nothing in the current master.hashes is trusted (see Gatekeeper.update_master_hashes())
+    if args.rebuild_master_hashes:
+        metrics.step("3", "Rebuild master.hashes")
+        logger.info("Rebuilding master.hashes from every hashes file on the mirror")
+        gk.update_master_hashes()
+        if not gk.wait_for_last_task(timeout_s=600) or not gk.last_task_succeeded():
+            gk.log_email_exit(logger.error, 1, 1, sub="Uploading the rebuilt master.hashes failed. Exiting.")
+        gk.log_email_exit(logger.info, 0, 1, msg="Rebuilt master.hashes. Exiting.")
+
     ###################################################################################################################
     # Step 3)
     # Make a list of files_to_upload consisting of all rawacf files in the holding directory
     # Get some files from mirror: master hashes, failed files list, blocklist directory
+    metrics.step("3", "List holding, get mirror files")
 
     # Get list of files to upload from the holding directory
     # Create files to upload dictionary where keys are filenames and values are empty dictionaries
     # Values will be set in Step 5) after the holding directory is hashed
     files_to_upload = gk.list_of_files_to_upload()
+    if files is not None:
+        batch_files = set(files)
+        files_to_upload = [file for file in files_to_upload if file in batch_files]
     # If yyyymm is passed but radar is not, list will contain all radars for that month
     # If radar is passed but yyyymm is not, list will contain all yearmonths for that radar
     # If both yyyymm and radar are passed, list will contain files from only the given radar and yearmonth
@@ -165,61 +285,61 @@ def main():
     if chosen_radar != '':
         files_to_upload = [file for file in files_to_upload if chosen_radar in file]
     files_to_upload.sort()
-    files_to_upload_dict = {file: {} for file in files_to_upload}
-    if len(files_to_upload) == 0:
+    # Filled with a FileRecord of each file in Step 5). Files are only ever removed, so the keys stay sorted
+    files_to_upload_dict = dict.fromkeys(files_to_upload)
+    if len(files_to_upload) == 0 and len(journal.resumable()) == 0:
         msg = "No files to upload. Exiting."
         gk.log_email_exit(logger.error, 0, 1, msg=msg)
     else:
         logger.info(f"Initial set of files to upload ({len(files_to_upload)}): {files_to_upload}\n")
 
-    # Get master hashes file
-    logger.info("Getting master hashes file...")
-    gk.get_master_hashes()
-    if not gk.wait_for_last_task():
-        msg = "get_master_hashes timeout. Exiting."
-        gk.log_email_exit(logger.error, 0, 1, msg=msg)
-
-    # Get failed files list
-    logger.info("Getting failed files list (all_failed.txt)...")
-    gk.get_failed()
-    if not gk.wait_for_last_task():
-        msg = "get_failed timeout. Exiting."
-        gk.log_email_exit(logger.error, 0, 1, msg=msg)
-
-    # Recursively get blocklist folder and generate list of blocked files
-    logger.info("Getting blocklist directory...\n")
-    gk.get_blocklist(dest_path=f"{gk.get_working_dir()}/blocklist/")
-    if not gk.wait_for_last_task(timeout_s=300):
-        msg = "get_blocklist timeout. Exiting"
+    # Get master hashes file, failed files list (all_failed.txt) and blocklist folder from the mirror. The three
+    # transfers are independent, so they are all submitted before waiting for any of them
+    # In daemon mode they are kept from the last batch, and only the ones that changed on the mirror are got again
+    changed_config = {"master.hashes", "all_failed.txt", "blocklist"}
+    config_listing = None
+    if gk.keep_mirror_config:
+        config_listing = gk.mirror_config_listing()
+        changed_config = set(name.split('/')[0] for name, _ in
+                             set(config_listing.items()) ^ set(gk.mirror_config.items()))
+        changed_config |= set(name for name in ("master.hashes", "all_failed.txt")
+                              if not isfile(f"{gk.get_working_dir()}/{name}"))
+        if not isdir(f"{gk.get_working_dir()}/blocklist/"):
+            changed_config.add("blocklist")
+    logger.info("Getting master hashes file, failed files list (all_failed.txt) and blocklist directory...\n")
+    mirror_gets = {}
+    if "master.hashes" in changed_config:
+        mirror_gets["get_master_hashes"] = gk.get_master_hashes()
+    if "all_failed.txt" in changed_config:
+        mirror_gets["get_failed"] = gk.get_failed()
+    if "blocklist" in changed_config:
+        # Start from an empty directory, so blocklist files that were removed from the mirror are gone too
+        if isdir(f"{gk.get_working_dir()}/blocklist/"):
+            shutil.rmtree(f"{gk.get_working_dir()}/blocklist/")
+        mirror_gets["get_blocklist"] = gk.get_blocklist(dest_path=f"{gk.get_working_dir()}/blocklist/")
+    if len(mirror_gets) < 3:
+        logger.info(f"Unchanged on the mirror since the last batch: "
+                    f"{sorted(set(['master.hashes', 'all_failed.txt', 'blocklist']) - changed_config)}")
+    if not gk.wait_for_tasks(mirror_gets.values(), timeout_s=300):
+        timed_out = [name for name, result in mirror_gets.items() if not gk.task_future(result).done()]
+        msg = f"{', '.join(timed_out)} timeout. Exiting."
         gk.log_email_exit(logger.error, 0, 1, msg=msg)
+    if config_listing is not None:
+        gk.mirror_config = config_listing
 
     ###################################################################################################################
     # Step 4)
     # Make a list of blocked data files from the blocklist/ directory obtained above
     # Remove all blocked data files from files_to_upload
     # Log the list of blocked files in holding_dir and move them to holding_dir/blocked
+    metrics.step("4", "Blocklist", files_in=len(files_to_upload_dict))
 
-    # Store all txt files from blocklist directory
-    blocklist_files = []
-    for f in listdir(f"{gk.get_working_dir()}/blocklist/"):
-        if fnmatch.fnmatch(f, "*.txt"):
-            blocklist_files.append(f)
-
-    # Store the filenames within the txt files
-    # Append filename from beginning of line
-    blocked_data = []
-    for f in blocklist_files:
-        with open(f"{gk.get_working_dir()}/blocklist/{f}") as blocklist_file:
-            for line in blocklist_file:
-                blocked_data.append(line.strip('\n').strip('\r'))
+    # Index the lines in the txt files from the blocklist directory
+    blocklist_index = BlocklistIndex.from_directory(f"{gk.get_working_dir()}/blocklist/")
+    logger.info(f"Read {len(blocklist_index)} unique blocklist lines")
 
     # If file in files_to_upload appears in the blocklist, add file to blocked_files_to_remove to be removed below
-    blocked_files_to_remove = []
-    for data_file in sorted(files_to_upload):
-        for blocked_file in blocked_data:
-            if data_file in blocked_file:
-                blocked_files_to_remove.append(data_file)
-    blocked_files_to_remove = sorted(list(set(blocked_files_to_remove)))
+    blocked_files_to_remove = blocklist_index.blocked(files_to_upload)
 
     # Remove blocked files from files_to_upload
     # Make blocked dir in holding_dir, /holding_dir/blocked/cur_date/
@@ -232,46 +352,59 @@ def main():
             files_to_upload_dict.pop(file_to_remove)
 
         gk.move_files_to_subdir("Blocked", blocked_files_to_remove)
-        files_to_upload = sorted(list(files_to_upload_dict.keys()))
+        files_to_upload = list(files_to_upload_dict)
 
     ###################################################################################################################
     # Step 5)
-    # Hash each rawacf in files_to_upload list
+    # Hash each rawacf in files_to_upload list, several files at a time
+    # The bzip2 integrity test for Step 7) is done in the same read of each file
     # Fill files_to_upload dictionary with relevant metadata
     # If any rawacf fails to be hashed, remove it from dictionary and move on to next file
+    # Files left in the holding directory by previous runs get their hashes from the hash cache instead of being rehashed
+    metrics.step("5", "Hash and bz2 test", files_in=len(files_to_upload_dict))
+    hash_cache = None
+    if args.hash_cache != '':
+        hash_cache = HashCache(args.hash_cache, verify_fraction=args.verify_fraction, logger=logger)
+    logger.info(f"Hashing {len(files_to_upload)} files with {args.hash_workers} workers...")
+    data_hashes, bz2_results, hash_errors, bytes_hashed, hash_time = \
+        hash_and_test_parallel(gk.get_holding_dir(), files_to_upload, workers=args.hash_workers, cache=hash_cache)
+    metrics.set(bytes_hashed=bytes_hashed)
+    logger.info(f"Hashed {bytes_hashed / 1e6:.1f} MB in {hash_time:.1f} s "
+                f"({bytes_hashed / 1e6 / max(hash_time, 1e-6):.1f} MB/s)")
+    if hash_cache is not None:
+        logger.info(f"Hash cache: {hash_cache.hits} hits, {hash_cache.misses} misses")
+        if len(hash_cache.mismatches) > 0:
+            gk.log_email_exit(logger.warning, 1, 0, msg=f"Cached hashes didn't match the files' current hashes, the "
+                                                        f"files may be corrupted: {hash_cache.mismatches}\n")
+        hash_cache.close()
+
     failed_hashes = []
     for filename in files_to_upload:
-        try:
-            data_hash = sha1hashing(gk.get_holding_dir(), filename)
-            logger.info(f"Successfully hashed {filename} in {gk.get_holding_dir()}: {data_hash}")
-        except Exception as e:
-            logger.warning(f"Failed to hash {filename} in {gk.get_holding_dir()} with error: {e}")
+        if filename in hash_errors:
+            logger.warning(f"Failed to hash {filename} in {gk.get_holding_dir()} with error: {hash_errors[filename]}")
             files_to_upload_dict.pop(filename)
             failed_hashes.append(filename)
             continue
-        elements = parse_data_filename(filename)
-        radar = elements[6]
-        data_type = elements[7]
-        if data_type == "rawacf":
-            data_type = "raw"
-        metadata = {'year': f'{elements[0]}', 'month': f'{elements[1]}', 'day': f'{elements[2]}',
-                    'yearmonth': filename[0:6], 'hash': data_hash, 'type': data_type, 'radar': radar}
-        files_to_upload_dict[filename].update(metadata)
+        data_hash = data_hashes[filename]
+        logger.info(f"Successfully hashed {filename} in {gk.get_holding_dir()}: {data_hash}")
+        files_to_upload_dict[filename] = FileRecord(filename, data_hash)
+    journal.record(HASHED, {filename: data_hashes[filename] for filename in files_to_upload_dict})
 
     # Update files_to_upload list if any files were removed from dictionary due to hash fail
     if len(failed_hashes) > 0:
         logger.info(f"Files failed to be hashed ({len(failed_hashes)}): {failed_hashes}")
-        files_to_upload = sorted(list(files_to_upload_dict.keys()))
+        files_to_upload = list(files_to_upload_dict)
 
     ###################################################################################################################
     # Step 5.5) Will remove this section once Cedar allocation is increased!
     # Don't transfer files from new NSSC radars until our allocation on Cedar is increased
     # Move data from new nssc radars to holding_dir/new_nssc_data/ for local storage
     # Then, remake/check files_to_upload and exit if no files remaining in holding_dir
+    metrics.step("5.5", "New NSSC radars", files_in=len(files_to_upload_dict))
     new_radars = ('hje', 'hjw', 'lje', 'ljw', 'sze', 'szw')
     new_data = []
     for filename in files_to_upload_dict:
-        if files_to_upload_dict[filename]['radar'] in new_radars:
+        if files_to_upload_dict[filename].radar in new_radars:
             new_data.append(filename)
 
     if len(new_data) > 0:
@@ -279,9 +412,9 @@ def main():
         for file in new_data:
             files_to_upload_dict.pop(file)
         gk.move_files_to_subdir("new_nssc_data", new_data)
-        files_to_upload = sorted(list(files_to_upload_dict.keys()))
+        files_to_upload = list(files_to_upload_dict)
 
-    if len(files_to_upload) == 0:
+    if len(files_to_upload) == 0 and len(journal.resumable()) == 0:
         msg = "No files to upload. Exiting."
         gk.log_email_exit(logger.info, 0, 1, msg=msg)
 
@@ -289,77 +422,117 @@ def main():
     # Step 6)
     # Get unique list of yyyymm combos from files to upload dictionary
     # Create yearmonth dictionary to organize files_to_upload by their yearmonth
-    # Loop through yyyymm combos and get the yyyymm.hashes file from the mirror on each iteration
-    # Perform sha1sum comparison between rawacfs in holding dir and recently acquired hashfile in working dir
+    # Get the yyyymm.hashes files for all yyyymm combos from the mirror in a single transfer
+    # Perform sha1sum comparison between rawacfs in holding dir and the acquired hashfiles in working dir
     # Handle each file individually depending on the result of the sha1sum comparison
     # Log the list of nonmatching files and move them to holding_dir/nomatch/
+    metrics.step("6", "Compare with mirror hashes", files_in=len(files_to_upload_dict))
 
     # Get unique list of yyyymm combos and create dictionary
-    # Keys are yyyymm and values are the files_to_upload_dict items corresponding to the given yyyymm
-    yearmonth = sorted(list(set([filename[0:6] for filename in files_to_upload_dict.keys()])))
-    yearmonth.sort()
-    yearmonth_dict = {ym: {} for ym in yearmonth}
-    for ym in yearmonth:
-        d = {k: v for k, v in files_to_upload_dict.items() if k[0:6] == ym}
-        yearmonth_dict[ym].update(d)
+    # Keys are yyyymm and values are the files in files_to_upload_dict for the given yyyymm, grouped in one pass
+    yearmonth_dict = group_by_yearmonth(files_to_upload_dict)
+    yearmonth = list(yearmonth_dict)
 
-    # Get appropriate hashes files for yyyymm for all files in list
+    # Find which yyyymm.hashes files exist on the mirror
     logger.info(f"Set of years and months for data files in holding directory: {str(yearmonth)}")
-    non_matching_files = []
+    hash_yearmonths = []
     for ym in yearmonth:
         hash_path = gk.get_hash_file_path(int(ym[0:4]), int(ym[4:6]))
         logger.info(f"Checking if {hash_path} exists on mirror...")
-        if gk.check_for_file_existence(hash_path):
-            # Get yyyymm.hashes from mirror to working dir
-            gk.get_hashes(int(ym[0:4]), int(ym[4:6]), dest_path=gk.get_working_dir())
-            if not gk.wait_for_last_task():
-                logger.warning(f"Get hashes for {ym} didn't complete. Removing files from files_to_upload")
-                # Remove all files w/ given yyyymm from files_to_upload if get_hashes timed out
-                for item in list(yearmonth_dict[ym].keys()):
-                    files_to_upload_dict.pop(item)
-                yearmonth_dict.pop(ym)
-            else:
-                logger.info(f"{ym} hash file retrieved from mirror.")
-
-                # Create dictionary to contain filenames as keys and hashes as values for ym.hashes of current iteration
-                ym_hashes = {}
-                with open(f"{gk.get_working_dir()}/{ym}.hashes", 'r') as hash_file:
-                    for line in hash_file:
-                        (val, key) = line.split()
-                        ym_hashes[key] = val
-
-                # loop over files in holding dir for ym of current iteration and compare hashes to ym.hashes
-                for holding_file in list(yearmonth_dict[ym].keys()):
-                    # Compare hashes to see if the file should go to nomatch/ directory or just be removed from holding
-                    if holding_file in ym_hashes.keys():
-                        # If hashes do not match, add file to nonmatching files list (to be moved to nomatch/ directory)
-                        if files_to_upload_dict[holding_file]['hash'] != ym_hashes[holding_file]:
-                            logger.warning(f"{holding_file} hash doesn't match. Adding to no match list, and removing "
-                                           f"from list of files to upload.")
-                            non_matching_files.append(holding_file)
-                        # If hashes match, remove from holding directory
-                        else:
-                            logger.info(f"{holding_file} already exists on mirror and hash matches. Removing from files "
-                                        f"to upload.")
-                            # Comment out removal of matching files from holding dir for testing purposes
-                            try:
-                                remove(f"{gk.get_holding_dir()}/{holding_file}")
-                            except OSError as error:
-                                logger.error(f"Error trying to remove file: {error}.")
-                        # Remove file from files to upload since this filename is already on the mirror
-                        files_to_upload_dict.pop(holding_file)
-
+        if gk.file_exists(hash_path, name_filter="name:~*.hashes"):
+            hash_yearmonths.append(ym)
         # If yyyymm.hashes DNE, create it ONLY IF yyyymm is the current year and month
+        # No need to do the checks below for this yearmonth as there is clearly no data for it yet
+        elif gk.cur_month == int(ym[4:6]) and gk.cur_year == int(ym[0:4]):
+            logger.info(f"Hash file for {ym} doesn't exist, creating new directory.")
+            gk.create_new_data_dir(ym[0:4], ym[4:6])
         else:
-            # Need to check if this is the current month, otherwise error out
-            # No need to do the above checks for this yearmonth as there is clearly no data for it yet
-            if gk.cur_month == int(ym[4:6]) and gk.cur_year == int(ym[0:4]):
-                logger.info(f"Hash file for {ym} doesn't exist, creating new directory.")
-                gk.create_new_data_dir(ym[0:4], ym[4:6])
-            else:
-                # Error, previous month's hash files should exist already
-                sub = f"Hash file {ym}.hashes not found. Exiting."
-                gk.log_email_exit(logger.error, 1, 1, sub=sub)
+            # Error, previous month's hash files should exist already
+            sub = f"Hash file {ym}.hashes not found. Exiting."
+            gk.log_email_exit(logger.error, 1, 1, sub=sub)
+
+    # Bring the local copy of the mirror's raw hashes files up to date every --refresh_hashes_h hours, transferring
+    # only the months whose sha1 in master.hashes differs from the local copy. Shards take turns, as for Step 12)
+    if args.refresh_hashes_h > 0 and gk.local_hashes_refresh_due(args.refresh_hashes_h):
+        if commit_lock is not None:
+            commit_lock.acquire()
+        try:
+            if gk.local_hashes_refresh_due(args.refresh_hashes_h):
+                refreshed = gk.refresh_local_hashes(data_types=['raw'])
+                logger.info(f"Refreshed {LOCAL_HASHES_DIR}, {len(refreshed)} hash files transferred: {refreshed}")
+        except TRANSFER_ERRORS as error:
+            # The run doesn't need the local copy, so it carries on and the next run tries again
+            logger.warning(f"Couldn't refresh {LOCAL_HASHES_DIR}: {error}")
+        finally:
+            if commit_lock is not None:
+                commit_lock.release()
+
+    # Copy the yyyymm.hashes that are up to date in the local copy of the mirror hashes (see refresh_local_hashes())
+    # rather than transferring them, and load the mirror filter of the local copy
+    local_yearmonths = []
+    mirror_filter = None
+    if isdir(LOCAL_HASHES_DIR):
+        master_hashes = gk.read_master_hashes()
+        local_yearmonths = gk.copy_local_hashes(hash_yearmonths, gk.get_working_dir(), master_hashes)
+        if len(local_yearmonths) > 0:
+            logger.info(f"{len(local_yearmonths)} hash files copied from {LOCAL_HASHES_DIR}: {local_yearmonths}")
+        mirror_filter = MirrorFilter.load(LOCAL_HASHES_DIR)
+
+    # Get the rest of the yyyymm.hashes from mirror to working dir in one transfer
+    fetched_yearmonths = list(local_yearmonths)
+    transfer_yearmonths = [ym for ym in hash_yearmonths if ym not in local_yearmonths]
+    if len(transfer_yearmonths) > 0:
+        gk.get_hashes_months([(int(ym[0:4]), int(ym[4:6])) for ym in transfer_yearmonths],
+                             dest_path=gk.get_working_dir())
+        if gk.wait_for_last_task(timeout_s=60 * (1 + len(transfer_yearmonths) // 10)):
+            fetched_yearmonths += transfer_yearmonths
+        else:
+            # Use the hashes files that did make it, and hold back the files of every other yyyymm
+            transferred = [info['destination_path'].split('/')[-1] for info in gk.get_task_successful_transfers()]
+            fetched_yearmonths += [ym for ym in transfer_yearmonths if f"{ym}.hashes" in transferred]
+        fetched_yearmonths.sort()
+    for ym in hash_yearmonths:
+        if ym not in fetched_yearmonths:
+            logger.warning(f"Get hashes for {ym} didn't complete. Removing files from files_to_upload")
+            # Remove all files w/ given yyyymm from files_to_upload if get_hashes timed out
+            for item in yearmonth_dict[ym]:
+                files_to_upload_dict.pop(item)
+            yearmonth_dict.pop(ym)
+    if len(fetched_yearmonths) > 0:
+        logger.info(f"{len(fetched_yearmonths)} hash files retrieved from mirror: {fetched_yearmonths}")
+
+    non_matching_files = []
+    for ym in fetched_yearmonths:
+        # Skip the lookups if the mirror filter was built from this ym.hashes and rules out every file in holding for ym
+        ym_hashes_digest = file_digests(f"{gk.get_working_dir()}/{ym}.hashes")['sha1']
+        if mirror_filter is not None and mirror_filter.is_current("raw", ym, ym_hashes_digest) \
+                and not any(mirror_filter.might_contain(holding_file) for holding_file in yearmonth_dict[ym]):
+            logger.info(f"None of the {len(yearmonth_dict[ym])} files for {ym} are on the mirror (mirror filter)")
+            continue
+
+        # Load ym.hashes of current iteration for lookups of hashes by filename
+        ym_hashes = HashesFile.load(f"{gk.get_working_dir()}/{ym}.hashes")
+
+        # loop over files in holding dir for ym of current iteration and compare hashes to ym.hashes
+        for holding_file in yearmonth_dict[ym]:
+            # Compare hashes to see if the file should go to nomatch/ directory or just be removed from holding
+            if holding_file in ym_hashes:
+                # If hashes do not match, add file to nonmatching files list (to be moved to nomatch/ directory)
+                if files_to_upload_dict[holding_file].hash != ym_hashes[holding_file]:
+                    logger.warning(f"{holding_file} hash doesn't match. Adding to no match list, and removing "
+                                   f"from list of files to upload.")
+                    non_matching_files.append(holding_file)
+                # If hashes match, remove from holding directory
+                else:
+                    logger.info(f"{holding_file} already exists on mirror and hash matches. Removing from files "
+                                f"to upload.")
+                    # Comment out removal of matching files from holding dir for testing purposes
+                    try:
+                        remove(f"{gk.get_holding_dir()}/{holding_file}")
+                    except OSError as error:
+                        logger.error(f"Error trying to remove file: {error}.")
+                # Remove file from files to upload since this filename is already on the mirror
+                files_to_upload_dict.pop(holding_file)
 
     # Make nomatch dir in holding_dir, /holding_dir/nomatch/cur_date/
     # Move non-matching files to /holding_dir/nomatch/cur_date/
@@ -369,51 +542,37 @@ def main():
 
     ###################################################################################################################
     # Step 7)
-    # Bzip check all files in list, and do other checks like file size check
+    # Bzip check all files in list, and do other checks like file size check (both done while hashing in Step 5)
     # Create a dictionary of failed_files, the keys are the filenames (string) and the values are
     # the hash and the reason for failure (strings) in a tuple, which is immutable and fixed in size
     # Log the dictionary of failed files (hash  filename  |  reason for failure)
+    metrics.step("7", "Failed file checks", files_in=len(files_to_upload_dict))
 
     failed_files = {}
     # Loop through files_to_upload_dict as it contains only rawacfs still eligible for transfer
-    files_to_upload = sorted(list(files_to_upload_dict.keys()))
+    files_to_upload = list(files_to_upload_dict)
     for filename in files_to_upload:
         data_file = filename
-        data_file_hash = files_to_upload_dict[filename]['hash']
-        logger.info(f"bunzip -t {data_file}")
-        # Perform bzip test on data file (-t == test)
-        bunzip2_process = subprocess.Popen(f"cd {gk.get_holding_dir()}; bunzip2 -t {data_file}",
-                                           shell=True, stdout=subprocess.PIPE,
-                                           stderr=subprocess.PIPE)
-        out, err = bunzip2_process.communicate()
-        bunzip2_process_output = out.decode().split("\n")
-        bunzip2_process_error = err.decode().split("\n")
-
-        filesize = getsize(f"{gk.get_holding_dir()}{data_file}")
-        # Check error code of bzip test and log a relevant error message
-        # Remove from files_to_upload if any nonzero error code
-        if bunzip2_process.returncode == 1 or bunzip2_process.returncode == 3:
-            logger.warning(f"OUTPUT: {bunzip2_process_output}")
-            logger.warning(f"ERROR: {bunzip2_process_error}")
+        data_file_hash = files_to_upload_dict[filename].hash
+        # bzip2 test (-t) results come from hashing in Step 5)
+        if not isfile(f"{gk.get_holding_dir()}{data_file}"):
             # File not found. Remove from files to upload
-            logger.warning(f"Error. File {data_file} not found by bunzip2 test. Removing from list.")
+            logger.warning(f"Error. File {data_file} not found for bunzip2 test. Removing from list.")
             files_to_upload_dict.pop(data_file)
-        elif bunzip2_process.returncode == 2:
+            continue
+        failure_reason, failure_description = bz2_results[data_file]
+        if failure_reason == BZ2_FAILED:
             # Error with bz2 integrity of file.
-            logger.warning(f"Error. File {data_file} failed the bzip2 test! Removing from list.")
+            logger.warning(f"Error. File {data_file} failed the bzip2 test ({failure_description})! Removing from "
+                           f"list.")
             files_to_upload_dict.pop(data_file)
-            failed_files[data_file] = (data_file_hash, "Failed BZ2 integrity test")
-        elif filesize == 14 or filesize == 0:
-            # Data file is empty (header of rawacf is 14 bytes)
-            logger.warning(f"File {data_file} empty. Removing from list.")
+            failed_files[data_file] = (data_file_hash, failure_reason)
+        elif failure_reason == EMPTY_FILE:
+            # Data file is empty (header of rawacf is 14 bytes) or smaller than the header
+            logger.warning(f"File {data_file} empty ({failure_description}). Removing from list.")
             files_to_upload_dict.pop(data_file)
-            failed_files[data_file] = (data_file_hash, "File contains no records (empty)")
-        elif filesize < 14:
-            # Data file is smaller than the header (14 bytes)
-            logger.warning(f"File {data_file} too small. Removing from list.")
-            files_to_upload_dict.pop(data_file)
-            failed_files[data_file] = (data_file_hash, "File contains no records (empty)")
-        # If file passed bzip test and is not empty, run bzcat to unzip the file
+            failed_files[data_file] = (data_file_hash, failure_reason)
+        # File passed bzip test and is not empty
         else:
             # At this point, remaining files passed unzip test and are not empty
             logger.info(f"{data_file} passed all tests.")
@@ -422,27 +581,43 @@ def main():
         logger.info(f"Found failed files ({len(failed_files)}): ")
         for failed in failed_files:
             logger.info(f"{failed_files[failed][0]}  {failed} | {failed_files[failed][1]}")
+    journal.record(VALIDATED, {filename: record.hash for filename, record in files_to_upload_dict.items()})
 
     ###################################################################################################################
     # Step 8)
     # Append failed files to all_failed.txt in working dir and upload to mirror
     # Transfer failed files to failed directory on mirror
     # Move failed files to holding_dir/failed/
+    metrics.step("8", "Upload failed files", files_in=len(files_to_upload_dict))
 
     # Update all_failed.txt with new failed files and upload to mirror
-    logger.info("Updating all_failed.txt\n")
-    try:
-        result = gk.update_failed(failed_files)
-        if result is None:
-            msg = "Error with updating failed files list on mirror, please check it manually\r\n"
+    # The copy in the working dir is about to differ from the mirror's, so don't keep it for the next batch
+    gk.mirror_config.pop("all_failed.txt", None)
+    if commit_lock is not None and len(failed_files) == 0:
+        logger.info("No failed files, all_failed.txt is left as it is\n")
+    else:
+        logger.info("Updating all_failed.txt\n")
+        if commit_lock is not None:
+            # Other shards may have added to all_failed.txt since Step 3)
+            commit_lock.acquire()
+            gk.get_failed()
+            if not gk.wait_for_last_task(timeout_s=300):
+                msg = "get_failed timeout. Exiting."
+                gk.log_email_exit(logger.error, 1, 1, msg=msg)
+        try:
+            result = gk.update_failed(failed_files)
+            if result is None:
+                msg = "Error with updating failed files list on mirror, please check it manually\r\n"
+                sub = "error updating all_failed.txt"
+                gk.log_email_exit(logger.warning, 1, 0, msg=msg, sub=sub)
+            while not gk.wait_for_last_task(timeout_s=300):
+                logger.info("Still waiting for failed files list to upload and complete...")
+        except Exception as e:
+            msg = f"Error: {e}. Please update manually\r\n"
             sub = "error updating all_failed.txt"
             gk.log_email_exit(logger.warning, 1, 0, msg=msg, sub=sub)
-        while not gk.wait_for_last_task(timeout_s=300):
-            logger.info("Still waiting for failed files list to upload and complete...")
-    except Exception as e:
-        msg = f"Error: {e}. Please update manually\r\n"
-        sub = "error updating all_failed.txt"
-        gk.log_email_exit(logger.warning, 1, 0, msg=msg, sub=sub)
+        if commit_lock is not None:
+            commit_lock.release()
 
     # Upload failed files to failed dir on mirror with a timeout of 60s plus an extra 10s
     # for each additional file
@@ -467,75 +642,203 @@ def main():
         # Move failed files to /holding_dir/failed/cur_date/
         gk.move_files_to_subdir("Failed", failed_files)
 
+    ###################################################################################################################
+    # Step 8.5)
+    # Resume the run that left the journal, if it didn't finish
+    # Files it confirmed on the mirror still need their hashes added to yyyymm.hashes, even if they are gone from
+    # holding. Files it submitted are confirmed if its task transferred them. Files it was submitting when it was
+    # killed may have been transferred by a task it never recorded, so they are uploaded again like those its task
+    # didn't transfer. Months whose yyyymm.hashes it uploaded still need master.hashes updated in Step 12)
+    metrics.step("8.5", "Resume unfinished run", files_in=len(files_to_upload_dict))
+
+    # yyyymm: list of (hash, file) to add to yyyymm.hashes, filled in as files are confirmed on the mirror
+    yearmonth_hash_dict = {}
+    # Files the unfinished run submitted whose task hadn't transferred them. If an upload skips them because they are
+    # already on the mirror, they are confirmed too
+    resubmitted_files = {}
+    resumed_yearmonths = set(filename[0:6] for filename in journal.in_state(HASHES_UPLOADED))
+    if len(journal.resumable()) > 0:
+        resumed = {filename: entry.hash for filename, entry in journal.in_state(CONFIRMED).items()}
+        submitted = journal.in_state(SUBMITTED)
+        resubmitted_files.update({filename: entry.hash for filename, entry in journal.in_state(SUBMITTING).items()})
+        for task_id in sorted(set(entry.task_id for entry in submitted.values())):
+            task_files = {filename: entry.hash for filename, entry in submitted.items() if entry.task_id == task_id}
+            try:
+                transferred = [info['destination_path'].split('/')[-1]
+                               for info in gk.get_task_successful_transfers({'task_id': task_id})]
+            except TRANSFER_ERRORS as error:
+                logger.warning(f"Couldn't get the files transferred by task {task_id} of the unfinished run: {error}")
+                transferred = []
+            for filename, data_hash in task_files.items():
+                if filename in transferred:
+                    resumed[filename] = data_hash
+                else:
+                    resubmitted_files[filename] = data_hash
+
+        resumed_confirmed = {}
+        resumed_not_found = []
+        for filename, data_hash in sorted(resumed.items()):
+            if filename in files_to_upload_dict and files_to_upload_dict[filename].hash != data_hash:
+                # The file in holding has changed since, so it is uploaded as a new file
+                logger.warning(f"{filename} in holding doesn't match the hash in the journal, not resuming it")
+                continue
+            if not gk.file_exists(FileRecord(filename, data_hash).mirror_path(gk.mirror_root_dir)):
+                resumed_not_found.append(filename)
+                continue
+            resumed_confirmed[filename] = data_hash
+        journal.record(CONFIRMED, resumed_confirmed)
+        for filename, data_hash in resumed_confirmed.items():
+            if isfile(f"{gk.get_holding_dir()}/{filename}"):
+                remove(f"{gk.get_holding_dir()}/{filename}")
+            files_to_upload_dict.pop(filename, None)
+            yearmonth_hash_dict.setdefault(filename[0:6], []).append((data_hash, filename))
+        if len(resumed_not_found) > 0:
+            msg = (f"Files confirmed or transferred by the unfinished run aren't on the mirror: {resumed_not_found}. "
+                   f"Those still in holding will be uploaded again.")
+            gk.log_email_exit(logger.warning, 1, 0, msg=msg)
+
+        # Get the yyyymm.hashes files of the resumed months that weren't needed for the files in holding
+        resumed_yearmonths |= set(yearmonth_hash_dict.keys())
+        missing_yearmonths = sorted(ym for ym in resumed_yearmonths
+                                    if not isfile(f"{gk.get_working_dir()}/{ym}.hashes"))
+        if len(missing_yearmonths) > 0:
+            gk.get_hashes_months([(int(ym[0:4]), int(ym[4:6])) for ym in missing_yearmonths],
+                                 dest_path=gk.get_working_dir())
+            if not gk.wait_for_last_task(timeout_s=60 * (1 + len(missing_yearmonths) // 10)):
+                msg = f"Get hashes for the resumed months {missing_yearmonths} didn't complete. Exiting."
+                gk.log_email_exit(logger.error, 1, 1, msg=msg)
+        logger.info(f"Resumed unfinished run: {sum(len(v) for v in yearmonth_hash_dict.values())} files confirmed on "
+                    f"mirror, {len(resubmitted_files)} to upload again, hashes files of {sorted(resumed_yearmonths)}")
+
     ###################################################################################################################
     # Step 9)
-    # Upload files_to_upload to mirror
+    # Split files_to_upload into chunks of one yyyymm and at most --chunk_gb each, and upload them to the mirror as a
+    # pipeline: up to --chunks_in_flight chunks transfer at a time, and a new chunk is submitted as each one finishes
+    metrics.step("9-11", "Upload and update hashes", files_in=len(files_to_upload_dict))
 
     # Get updated list of files_to_upload from dictionary
-    files_to_upload = sorted(list(files_to_upload_dict.keys()))
+    files_to_upload = list(files_to_upload_dict)
     logger.info(f"Final set of files to upload ({len(files_to_upload)}): {files_to_upload}")
 
     # Exit if there are no files to upload
-    if len(files_to_upload) == 0:
+    if len(files_to_upload) == 0 and len(resumed_yearmonths) == 0:
+        journal.clear()
         msg = "No files to upload. Exiting."
         gk.log_email_exit(logger.info, 0, 1, msg=msg)
 
-    # Similar to failed files, timeout is 60 seconds plus an additional 10 seconds for each file
-    upload_timeout = 60 + 10 * len(files_to_upload)
-    logger.info(f"Uploading files to mirror with {upload_timeout} s timeout...\n")
-
-    # Now sync the files up to the mirror in the appropriate place
-    gk.sync_files_from_list(files_to_upload)
-    gk.wait_for_last_task(timeout_s=upload_timeout)
-    while not gk.wait_for_last_task():
-        logger.info("Still waiting for last task to complete...")
-    if not gk.last_task_succeeded():
-        msg = "Don't know which files were transferred successfully and which were not!"
-        sub = "sync_files_from_list failed"
-        gk.log_email_exit(logger.error, 1, 1, msg=msg, sub=sub)
+    chunks = make_upload_chunks(gk.get_holding_dir(), files_to_upload, max_chunk_bytes=args.chunk_gb * 1e9)
+    logger.info(f"Uploading files to mirror in {len(chunks)} chunks, {args.chunks_in_flight} at a time...\n")
+    # Number of chunks of each yyyymm still to finish, so its yyyymm.hashes is uploaded once they all have
+    chunks_left = {}
+    for ym, _ in chunks:
+        chunks_left[ym] = chunks_left.get(ym, 0) + 1
+    # yyyymm: (transfer result, list of (hash, file)) of each yyyymm.hashes upload
+    hashes_uploads = {}
+    # Resumed months with no files to upload have their hashes files uploaded right away, except by shards (see below)
+    for ym in sorted(resumed_yearmonths):
+        if ym not in chunks_left and commit_lock is None:
+            hashes_uploads[ym] = (gk.append_hashes(int(ym[0:4]), int(ym[4:6]), yearmonth_hash_dict.get(ym, [])),
+                                  yearmonth_hash_dict.get(ym, []))
 
     ###################################################################################################################
     # Step 10)
-    # Get a list of files that succeeded the transfer and a list of files that were skipped
-    # Create a dictionary and store the string to append to yyyymm.hashes for each yyyymm
-    # Remove succeeded files from holding_dir
-
-    # Check which files succeeded in the transfer. If a file was skipped it won't appear in this
-    succeeded = gk.get_task_successful_transfers()
-    # Create lists of succeeded and skipped files
-    succeeded_files = [str(info['destination_path'].split('/')[-1]) for info in succeeded]
-    skipped_files = [filename for filename in files_to_upload_dict if filename not in succeeded_files]
-
-    logger.info(f"Skipped files list: {skipped_files}")
-    logger.info(f"Skipped files: {gk.get_num_files_skipped()}")
-    logger.info(f"Transferred files: {len(succeeded_files)}")
-    logger.info(f"Total files: {gk.get_num_files_skipped() + len(succeeded_files)}")
-    logger.info(f"Files to upload: {len(files_to_upload)}\n")
+    # As each chunk finishes, get the list of its files that succeeded the transfer and the number that were skipped
+    # Remove succeeded files from holding_dir and append their "<hash> <filename>" to yyyymm.hashes in working dir
+    # A chunk that failed only holds back its own files that didn't transfer, which stay in holding for the next run
+
+    # The list of (hash, file) added to each yyyymm.hashes file are stored in yearmonth_hash_dict (from Step 8.5)
+    # Only succeeded files are added, so the keys are the yyyymm of the succeeded files
+    in_flight = {}  # task_id: (chunk label, yyyymm, list of files, transfer result)
+    num_succeeded = 0
+    num_skipped = 0
+    files_not_found = []
+    failed_chunks = []
+    next_chunk = 0
+    while next_chunk < len(chunks) or len(in_flight) > 0:
+        # Keep the pipeline full
+        while next_chunk < len(chunks) and len(in_flight) < max(args.chunks_in_flight, 1):
+            ym, chunk_files = chunks[next_chunk]
+            next_chunk += 1
+            label = f"sync_files_from_list {ym} chunk {next_chunk} of {len(chunks)}"
+            chunk_hashes = {filename: files_to_upload_dict[filename].hash for filename in chunk_files}
+            # Written ahead of the submit, so a run killed before the task ID is recorded still knows to confirm the
+            # files that task transferred
+            journal.record(SUBMITTING, chunk_hashes)
+            result = gk.sync_files_from_list(chunk_files, label=label)
+            journal.record(SUBMITTED, chunk_hashes, task_id=result['task_id'])
+            logger.info(f"Submitted {label} ({len(chunk_files)} files)")
+            in_flight[result['task_id']] = (label, ym, chunk_files, result)
+
+        # Similar to failed files, allow 60 seconds plus an additional 10 seconds for each file before reporting
+        # that the chunks are taking a while, then keep waiting
+        upload_timeout = 60 + 10 * min(len(chunk[2]) for chunk in in_flight.values())
+        if not gk.wait_for_tasks([chunk[3] for chunk in in_flight.values()], timeout_s=upload_timeout,
+                                 return_when=FIRST_COMPLETED):
+            logger.info(f"Still waiting for upload chunks to complete: {[chunk[0] for chunk in in_flight.values()]}")
+            continue
 
-    # Make a dictionary to store the '<hash1> <file1> \n <hash2> <file2>' string for each yyyymm.hashes file
-    # Use list of succeeded files to get yyyymm bc only succeeded files should be added to hash file
-    yearmonth = list(set([filename[0:6] for filename in succeeded_files]))
-    yearmonth.sort()
-    yearmonth_hash_dict = {ym: "" for ym in yearmonth}
+        for task_id in [task_id for task_id, chunk in in_flight.items() if gk.task_future(chunk[3]).done()]:
+            label, ym, chunk_files, result = in_flight.pop(task_id)
+            task = gk.task_future(result).result()
+            # Check which files succeeded in the transfer. If a file was skipped it won't appear in this
+            succeeded_files = [str(info['destination_path'].split('/')[-1])
+                               for info in gk.get_task_successful_transfers(result)]
+            num_succeeded += len(succeeded_files)
+            num_skipped += task['files_skipped']
+            logger.info(f"{label} {task['status']}: {len(succeeded_files)} transferred, {task['files_skipped']} "
+                        f"skipped of {len(chunk_files)} files")
+            if task['status'] != "SUCCEEDED":
+                failed_chunks.append(label)
+            else:
+                # Files the unfinished run submitted that were skipped, since its task did transfer them after all
+                succeeded_files += [filename for filename in chunk_files
+                                    if filename in resubmitted_files and filename not in succeeded_files]
+
+            # All the metadata of interest below is stored in the FileRecords of files_to_upload_dict
+            # Make sure "succeeded" file is truly on the mirror
+            # If not, leave file in holding_dir for next script run and do not update yyyymm.hashes for this file
+            # Each month directory is listed once, rather than one request per file
+            confirmed_files = {}
+            for filename in sorted(succeeded_files):
+                record = files_to_upload_dict[filename]
+                if gk.file_exists(record.mirror_path(gk.mirror_root_dir)):
+                    confirmed_files[filename] = record.hash
+                else:
+                    files_not_found.append(filename)
+            journal.record(CONFIRMED, confirmed_files)
+            for filename, data_hash in confirmed_files.items():
+                remove(f"{gk.get_holding_dir()}/{filename}")  # Comment this line for testing purposes
+                yearmonth_hash_dict.setdefault(ym, []).append((data_hash, filename))
+
+            ###########################################################################################################
+            # Step 11)
+            # Once every chunk of a yyyymm has finished, update yyyymm.hashes with its succeeded files and upload it
+            # to the mirror, while the remaining chunks transfer
+            # Shards commit the hashes of all their months at once, after the last chunk
+            chunks_left[ym] -= 1
+            if chunks_left[ym] > 0 or commit_lock is not None:
+                continue
+            new_hashes = yearmonth_hash_dict.get(ym, [])
+            hashfile_path = f"{gk.get_working_dir()}/{ym}.hashes"
+            # If there are new hashes, append them to hashfile and upload hashfile to mirror
+            if len(new_hashes) > 0 or ym in resumed_yearmonths:
+                logger.info(f"Updating hash file: {ym}")
+                hashes_uploads[ym] = (gk.append_hashes(int(ym[0:4]), int(ym[4:6]), new_hashes), new_hashes)
+            else:
+                msg = f"{hashfile_path} has no new hashes..."
+                gk.log_email_exit(logger.info, 0, 0, msg=msg)
 
-    # All the metadata of interest below is stored in files_to_upload_dict
-    # Remove each succeeded file from the holding dir and append "<hash> <filename> \n" to dictionary for yyyymm
-    files_not_found = []
-    for filename in sorted(list(succeeded_files)):
-        file_data = files_to_upload_dict[filename]
-        ym = file_data['yearmonth']
-        # Make sure "succeeded" file actually made it to the mirror
-        data_type = file_data['type']
-        year = file_data['year']
-        month = file_data['month']
-        # Make sure "succeeded" file is truly on the mirror
-        # If not, leave file in holding_dir for next script run and do not update yyyymm.hashes for this file
-        if gk.check_for_file_existence(f"{gk.mirror_root_dir}/{data_type}/{int(year):04d}/{int(month):02d}/{filename}"):
-            data_hash = files_to_upload_dict[filename]['hash']
-            remove(f"{gk.get_holding_dir()}/{filename}")  # Comment this line for testing purposes
-            yearmonth_hash_dict[ym] += f"{data_hash}  {filename}\n"
-        else:
-            files_not_found.append(filename)
+    logger.info(f"Skipped files: {num_skipped}")
+    logger.info(f"Transferred files: {num_succeeded}")
+    logger.info(f"Total files: {num_skipped + num_succeeded}")
+    logger.info(f"Files to upload: {len(files_to_upload)}\n")
+
+    # log and email the chunks that failed. Their files that weren't transferred remain in the holding directory
+    if len(failed_chunks) > 0:
+        msg = (f"Upload chunks {failed_chunks} failed! Files that weren't transferred will remain in holding "
+               f"directory.")
+        sub = "sync_files_from_list failed"
+        gk.log_email_exit(logger.warning, 1, 0, msg=msg, sub=sub)
 
     # log and email list of files that appeared to succeed transfer but are not found on mirror
     if len(files_not_found) > 0:
@@ -543,34 +846,53 @@ def main():
                f"Files will remain in holding directory.")
         gk.log_email_exit(logger.warning, 1, 0, msg=msg)
 
-    ###################################################################################################################
-    # Step 11)
-    # Update the yyyymm.hashes files with their corresponding succeeded files and upload to mirror
-
-    yearmonth = sorted(list(yearmonth_hash_dict.keys()))
-    logger.info(f"Updating hash files: {yearmonth}")
-    # Update yyyymm.hashes from dictionary and upload to mirror
-    for ym in yearmonth:
-        hash_string = yearmonth_hash_dict[ym]
-        hashfile_path = f"{gk.get_working_dir()}/{ym}.hashes"
-        # If string is not empty, append it to hashfile
-        if hash_string != "":
-            hash_string.strip("\n")
-            with open(hashfile_path, 'a') as f:
-                f.write(f"{hash_string}")
-            # Upload hashfile to mirror
-            gk.put_hashes(int(ym[0:4]), int(ym[4:6]),
-                          source_path=gk.get_working_dir())
-            while not gk.wait_for_last_task():
-                logger.info("Still waiting for hashes task to finish... ")
-                continue
+    if commit_lock is not None:
+        # A shard commits its hashes while holding the commit lock, until master.hashes is updated in Step 12). The
+        # yyyymm.hashes are got from the mirror again, since other shards may have added to them, and this shard's
+        # new hashes are merged into them
+        logger.info("Waiting for the commit lock to update the hashes files...")
+        commit_lock.acquire()
+        commit_yearmonths = sorted(set(yearmonth_hash_dict.keys()) | resumed_yearmonths)
+        gk.invalidate_listings()
+        mirror_yearmonths = [ym for ym in commit_yearmonths
+                             if gk.file_exists(gk.get_hash_file_path(int(ym[0:4]), int(ym[4:6])),
+                                               name_filter="name:~*.hashes")]
+        if len(mirror_yearmonths) > 0:
+            gk.get_hashes_months([(int(ym[0:4]), int(ym[4:6])) for ym in mirror_yearmonths],
+                                 dest_path=gk.get_working_dir())
+            if not gk.wait_for_last_task(timeout_s=60 * (1 + len(mirror_yearmonths) // 10)) \
+                    or not gk.last_task_succeeded():
+                msg = f"Get hashes for {mirror_yearmonths} to commit them didn't complete. Exiting."
+                gk.log_email_exit(logger.error, 1, 1, msg=msg)
+        for ym in commit_yearmonths:
+            logger.info(f"Updating hash file: {ym}")
+            new_hashes = yearmonth_hash_dict.get(ym, [])
+            hashes_uploads[ym] = (gk.append_hashes(int(ym[0:4]), int(ym[4:6]), new_hashes), new_hashes)
+
+    while not gk.wait_for_tasks([upload[0] for upload in hashes_uploads.values()]):
+        logger.info("Still waiting for hashes tasks to finish... ")
+    # Only months whose yyyymm.hashes is on the mirror go in master.hashes. The others keep their files confirmed in
+    # the journal, so the next run adds their hashes again
+    uploaded_yearmonths = set()
+    failed_hashes_yearmonths = []
+    for ym, (result, new_hashes) in sorted(hashes_uploads.items()):
+        if gk.last_task_succeeded(result):
+            journal.record(HASHES_UPLOADED, {filename: data_hash for data_hash, filename in new_hashes})
+            uploaded_yearmonths.add(ym)
         else:
-            msg = f"{hashfile_path} update string is empty..."
-            gk.log_email_exit(logger.info, 0, 0, msg=msg)
+            failed_hashes_yearmonths.append(ym)
+    if len(failed_hashes_yearmonths) > 0:
+        msg = (f"Uploading hashes files of {failed_hashes_yearmonths} failed! They are left out of master.hashes and "
+               f"the journal is kept so the next run adds their hashes again.")
+        gk.log_email_exit(logger.warning, 1, 0, msg=msg, sub="put_hashes failed")
+
+    yearmonth = sorted(uploaded_yearmonths)
+    metrics.set(files_out=sum(len(new_hashes) for new_hashes in yearmonth_hash_dict.values()))
 
     ###################################################################################################################
     # Step 12)
     # Update master.hashes for the yyyymm.hashes file(s) modified in Step 11) above.
+    metrics.step("12", "Update master.hashes")
 
     # Logic of method to update master hashes:
     # 1) get master hash from mirror
@@ -588,11 +910,7 @@ def main():
 
     # Read master hashes file in as dictionary with filenames as keys and hashes as values
     # "Filenames" are of the form ./raw/yyyymm.hashes and ./dat/yyyymm.hashes
-    hashes = {}
-    with open(f"{gk.get_working_dir()}/master.hashes", 'r') as master_file:
-        for line in master_file:
-            (val, key) = line.split()
-            hashes[key] = val
+    hashes = gk.read_master_hashes(f"{gk.get_working_dir()}/master.hashes")
 
     # For each yyyymm in holding dir which passed all tests
     #    - hash the corresponding yyyymm.hashes
@@ -605,16 +923,20 @@ def main():
         logger.info(f"Moving {ym}.hashes to {raw_hash_dir}\n")
         rename(f"{gk.get_working_dir()}/{ym}.hashes",
                f"{raw_hash_dir}/{ym}.hashes")
-        # From working_dir, hash yyyymm.hashes file in working_dir/raw/
-        hash_process = subprocess.Popen(f"cd {gk.get_working_dir()}; sha1sum ./raw/{ym}.hashes",
-                                        shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        hash_process_out, hash_process_err = hash_process.communicate()
-        hash_process_output = hash_process_out.decode().split("\n")
-
+        # Hash yyyymm.hashes file in working_dir/raw/
         # Add yyyymm.hashes to dictionary if it doesn't exist, update existing hash o/w.
-        hashes[f"./raw/{ym}.hashes"] = hash_process_output[0].split()[0]
+        hashes[f"./raw/{ym}.hashes"] = file_digests(f"{raw_hash_dir}/{ym}.hashes")['sha1']
+        # Keep the local copy of the hashes files current, so it doesn't need to be transferred again
+        if isdir(f"{LOCAL_HASHES_DIR}/raw"):
+            shutil.copyfile(f"{raw_hash_dir}/{ym}.hashes", f"{LOCAL_HASHES_DIR}/raw/{ym}.hashes")
+
+    # Rebuild the mirror filter for the months whose hashes files were updated
+    if isdir(f"{LOCAL_HASHES_DIR}/raw"):
+        gk.update_mirror_filter(LOCAL_HASHES_DIR)
 
     # Overwrite entire master.hashes file with dictionary
+    # The copy in the working dir differs from the mirror's until it's uploaded, so don't keep it for the next batch
+    gk.mirror_config.pop("master.hashes", None)
     with open(f"{gk.get_working_dir()}/master.hashes", 'w') as master_file:
         for key in sorted(list(hashes.keys())):
             master_file.write(f"{hashes[key]}  {key}\n")
@@ -626,18 +948,150 @@ def main():
         if not gk.wait_for_last_task():
             msg = "Updating of master hashes didn't complete."
             gk.log_email_exit(logger.warning, 1, 0, msg=msg)
-    except globus_sdk.GlobusError as error:
+        elif gk.last_task_succeeded() and len(failed_hashes_yearmonths) == 0:
+            # Everything the run did is on the mirror, so there's nothing left to resume
+            journal.clear()
+    except TRANSFER_ERRORS as error:
         msg = f"Updating of master hashes didn't complete. {error}"
         gk.log_email_exit(logger.error, 1, 0, msg=msg)
     except Exception as error:
         msg = f"Updating master hashes failed. {error}"
         gk.log_email_exit(logger.error, 1, 0, msg=msg)
+    if commit_lock is not None:
+        commit_lock.release()
 
     finish_time = datetime.now().strftime("%s")
 
     total_time = (int(finish_time) - int(start_time))/60
+    metrics.finish()
     logger.info(f"Script finished. Total time: {total_time} minutes")
 
 
+def run_daemon(gk, args, argv=None):
+    """ Keep the gatekeeper running with an authorized transfer client, uploading files in batches as they arrive
+    in the holding directory rather than once per cron run. The holding directory is scanned every --poll_s seconds,
+    and each batch is the files that have been unchanged for --settle_s seconds (see tools/holding_watcher.py).
+    Each batch is a run of main() on those files, with its own log file, as a cron run would be, but master.hashes,
+    all_failed.txt and the blocklist are only got from the mirror when they change. A batch that fails is logged and
+    emailed, and the daemon waits longer after each failure in a row (up to DAEMON_MAX_BACKOFF_S) before the next
+    batch. Runs until interrupted (KeyboardInterrupt), or until SIGTERM, which lets the current batch finish first
+
+    :param gk: Authorized Gatekeeper from Step 1)
+    :param args: Parsed arguments, with --daemon
+    :param argv: Command line arguments, defaults to the arguments of the script
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    batch_argv = [arg for arg in argv if arg != '--daemon']
+    gk.keep_mirror_config = True
+    watcher = HoldingWatcher(args.holding, args.pattern, settle_s=args.settle_s, retry_s=RETRY_S)
+    gk.logger.info(f"Daemon watching {args.holding} for {args.pattern} every {args.poll_s} s")
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    backoff_s = 0
+    while not stop.is_set():
+        batch = watcher.settled_files(max_files=args.batch_files)
+        if len(batch) == 0:
+            stop.wait(args.poll_s)
+            continue
+        gk.start_run()
+        gk.logger.info(f"Daemon batch of {len(batch)} files")
+        try:
+            main(batch_argv, gk=gk, files=batch)
+        except SystemExit:
+            # The batch is over (nothing left to upload, or an error that was logged and emailed), but not the daemon.
+            # Files it left in holding are tried again after the watcher's retry time
+            backoff_s = 0
+        except Exception as error:
+            # Anything else the batch didn't handle (i.e. a transfer, file system or hash cache error) is reported, and
+            # the daemon backs off before trying the next batch rather than dying
+            backoff_s = min(max(2 * backoff_s, args.poll_s), DAEMON_MAX_BACKOFF_S)
+            msg = f"Daemon batch failed: {error}\n{traceback.format_exc()}\nNext batch in {backoff_s} s"
+            try:
+                gk.log_email_exit(gk.logger.error, 1, 0, msg=msg, sub="Gatekeeper daemon batch failed")
+            except Exception as email_error:
+                gk.logger.error(f"Couldn't email the failure: {email_error}")
+            stop.wait(backoff_s)
+        else:
+            backoff_s = 0
+    gk.logger.info("Daemon stopped")
+
+
+def take_run_locks(shard=None):
+    """ Lock out the gatekeeper runs this one would clash with (see tools/run_lock.py), or exit if one is running.
+    A run that isn't sharded runs alone, while shards run alongside any shard but their own
+
+    :param shard: Name of the shard, defaults to None for a run that isn't sharded
+    :return: List of the locks, which are held until the script exits
+    """
+    locks = [(FileLock(RUN_LOCK), shard is not None)]
+    if shard is not None:
+        locks.append((FileLock(shard_lock_name(shard)), False))
+    for lock, shared in locks:
+        if not lock.acquire(shared=shared, blocking=False):
+            print(f"Another gatekeeper run holds {lock.path}, quitting.")
+            sys.exit(-1)
+    return [lock for lock, _ in locks]
+
+
+def run_shards(args, argv=None):
+    """ Run the gatekeeper as several shards at once, one for each radar or yyyymm (--shard_by) of the files in the
+    holding directory, up to --max_shards at a time. Each shard is a gatekeeper_globus.py process run with --shard and
+    the -r or -y of its files, which hashes, validates and uploads them in a working directory of its own. The shards
+    take turns to update all_failed.txt, yyyymm.hashes and master.hashes on the mirror (see tools/run_lock.py)
+
+    :param args: Parsed arguments, with --shard_by
+    :param argv: Command line arguments, defaults to the arguments of the script
+    :return: Dictionary of shard: exit code of its process
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    # Shards can start and finish while this runs, but not a run that isn't sharded
+    run_lock = FileLock(RUN_LOCK)
+    if not run_lock.acquire(shared=True, blocking=False):
+        print(f"Another gatekeeper run holds {run_lock.path}, quitting.")
+        sys.exit(-1)
+
+    # Arguments for every shard, without the ones for running the shards
+    shard_argv = []
+    skip_value = False
+    for arg in argv:
+        if skip_value:
+            skip_value = False
+        elif arg in ('--shard_by', '--max_shards'):
+            skip_value = True
+        elif not arg.startswith(('--shard_by=', '--max_shards=')):
+            shard_argv.append(arg)
+
+    # The radars or yyyymm of the files in the holding directory
+    shards = set()
+    for filename in fnmatch.filter(listdir(args.holding), args.pattern):
+        if args.year_month not in filename or args.radar not in filename or not isfile(f"{args.holding}/{filename}"):
+            continue
+        if args.shard_by == "radar" and len(filename.split('.')) > 3:
+            shards.add(filename.split('.')[3])
+        elif args.shard_by == "year_month":
+            shards.add(filename[0:6])
+    shard_option = '-r' if args.shard_by == "radar" else '-y'
+    print(f"Running {len(shards)} shards by {args.shard_by}, {args.max_shards} at a time: {sorted(shards)}")
+
+    pending = sorted(shards)
+    running = {}  # shard: subprocess.Popen of its gatekeeper
+    exit_codes = {}
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < max(args.max_shards, 1):
+            shard = pending.pop(0)
+            running[shard] = subprocess.Popen([sys.executable, abspath(__file__)] + shard_argv +
+                                              [shard_option, shard, '--shard'])
+        time.sleep(1)
+        for shard, process in list(running.items()):
+            if process.poll() is not None:
+                exit_codes[shard] = process.returncode
+                running.pop(shard)
+                print(f"Shard {shard} finished with exit code {process.returncode}")
+    run_lock.release()
+    return exit_codes
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
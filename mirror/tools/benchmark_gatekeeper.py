@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark the whole gatekeeper (all 12 steps of gatekeeper_globus.py) offline, against a synthetic holding directory
+and a fake mirror served by a LocalTransferClient (see local_transfer_client.py).
+
+For each number of files, a fresh holding directory of bz2 files spread over the most recent months is made, along
+with a mirror holding the hashes files, master.hashes, all_failed.txt and blocklist the gatekeeper expects. Some of
+the files are already on the mirror, some are blocklisted and some are corrupt or empty, so every step has work to do.
+The gatekeeper runs with HOME set to the benchmark directory, so it never touches the real logs, hash cache or local
+copy of the mirror hashes, and with email turned off.
+
+Usage:
+    benchmark_gatekeeper.py [--files 1000 10000 100000] [--latency_s 0.1] [--bandwidth 1e8] [--failure_rate 0.01]
+                            [--chunk_gb 20]
+Prints the time each run took, the number of data files on the mirror afterwards and the number of calls made to the
+transfer backend.
+"""
+import argparse
+import bz2
+import hashlib
+import os
+import random
+import shutil
+import sys
+import time
+from datetime import datetime
+from os.path import dirname, abspath
+
+BENCHMARK_DIR = "/tmp/gatekeeper_benchmark"
+MIRROR_UUID = "benchmark-mirror"
+MIRROR_ROOT = "/sddata"
+RADARS = ('sas', 'pgr', 'rkn', 'inv', 'cly', 'kod')
+
+
+def year_months(num_months):
+    """ :return: List of the most recent num_months months (including the current one) as yyyymm, oldest first """
+    year, month = datetime.now().year, datetime.now().month
+    months = []
+    for _ in range(num_months):
+        months.append(f"{year:04d}{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months[::-1]
+
+
+def make_data_files(num_files, months):
+    """
+    :param num_files: Number of data files
+    :param months: yyyymm the files are spread over
+    :return: Sorted list of unique data file names, i.e. 20200101.0000.00.sas.rawacf.bz2
+    """
+    names = []
+    for i in range(num_files):
+        ym = months[i % len(months)]
+        slot, radar = divmod(i // len(months), len(RADARS))
+        day, minute = divmod(slot, 24 * 60)
+        names.append(f"{ym}{day % 28 + 1:02d}.{minute // 60:02d}{minute % 60:02d}.{day // 28:02d}.{RADARS[radar]}"
+                     f".rawacf.bz2")
+    return sorted(names)
+
+
+def make_tree(root, num_files, num_months, file_size, existing_fraction, blocked_fraction, corrupt_fraction, seed):
+    """
+    Make the holding directory and the fake mirror for one run
+
+    :return: Tuple of (holding directory, mirror endpoint directory, personal endpoint working directory)
+    """
+    rng = random.Random(seed)
+    holding_dir = f"{root}/holding"
+    mirror_dir = f"{root}/mirror"
+    home_dir = f"{root}/home"
+    for directory in (holding_dir, f"{mirror_dir}{MIRROR_ROOT}/.config/blocklist", f"{home_dir}/tmp",
+                      f"{home_dir}/logs/globus", f"{mirror_dir}/local_data/failed"):
+        os.makedirs(directory, exist_ok=True)
+
+    # Every file is a unique bz2 stream followed by a shared one, so files differ but are cheap to make
+    shared_stream = bz2.compress(bytes(rng.getrandbits(8) for _ in range(file_size)))
+    months = year_months(num_months)
+    mirror_hashes = {ym: [] for ym in months[:-1]}
+    blocked = []
+    for name in make_data_files(num_files, months):
+        data = bz2.compress(name.encode()) + shared_stream
+        draw = rng.random()
+        if draw < corrupt_fraction / 2:
+            data = data[:len(data) // 2]
+        elif draw < corrupt_fraction:
+            data = bz2.compress(b"")
+        elif draw < corrupt_fraction + blocked_fraction:
+            blocked.append(name)
+        elif draw < corrupt_fraction + blocked_fraction + existing_fraction and name[0:6] in mirror_hashes:
+            month_dir = f"{mirror_dir}{MIRROR_ROOT}/raw/{name[0:4]}/{name[4:6]}"
+            os.makedirs(month_dir, exist_ok=True)
+            with open(f"{month_dir}/{name}", 'wb') as f:
+                f.write(data)
+            mirror_hashes[name[0:6]].append(f"{hashlib.sha1(data).hexdigest()}  {name}\n")
+        with open(f"{holding_dir}/{name}", 'wb') as f:
+            f.write(data)
+
+    # Hashes files of the past months, and master.hashes of them
+    master_lines = []
+    for ym, lines in mirror_hashes.items():
+        month_dir = f"{mirror_dir}{MIRROR_ROOT}/raw/{ym[0:4]}/{ym[4:6]}"
+        os.makedirs(month_dir, exist_ok=True)
+        contents = "".join(lines).encode()
+        with open(f"{month_dir}/{ym}.hashes", 'wb') as f:
+            f.write(contents)
+        master_lines.append(f"{hashlib.sha1(contents).hexdigest()}  ./raw/{ym}.hashes\n")
+    with open(f"{mirror_dir}{MIRROR_ROOT}/.config/master.hashes", 'w') as f:
+        f.writelines(master_lines)
+    with open(f"{mirror_dir}{MIRROR_ROOT}/.config/all_failed.txt", 'w') as f:
+        f.write(f"{'0' * 40}  19930101.0000.00.sas.rawacf.bz2 | Failed BZ2 integrity test\n")
+    with open(f"{mirror_dir}{MIRROR_ROOT}/.config/blocklist/benchmark.txt", 'w') as f:
+        f.writelines(f"raw/{name[0:4]}/{name[4:6]}/{name}  benchmark\n" for name in blocked)
+    return holding_dir, mirror_dir, home_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the gatekeeper against a local fake mirror")
+    parser.add_argument("--files", type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Numbers of files in the holding directory, one run each. Default 1000 10000 100000")
+    parser.add_argument("--dir", default=BENCHMARK_DIR,
+                        help=f"Directory for the synthetic files, cleared before each run. Default {BENCHMARK_DIR}")
+    parser.add_argument("--months", type=int, default=3, help="Number of recent months the files span. Default 3")
+    parser.add_argument("--file_size", type=int, default=4096,
+                        help="Uncompressed bytes of data in each file. Default 4096")
+    parser.add_argument("--existing_fraction", type=float, default=0.1,
+                        help="Fraction of files (of past months) already on the mirror. Default 0.1")
+    parser.add_argument("--blocked_fraction", type=float, default=0.01,
+                        help="Fraction of files that are blocklisted. Default 0.01")
+    parser.add_argument("--corrupt_fraction", type=float, default=0.01,
+                        help="Fraction of files that are truncated or empty. Default 0.01")
+    parser.add_argument("--latency_s", type=float, default=0.0,
+                        help="Seconds each call to the transfer backend takes. Default 0")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="Bytes per second transfers run at. Default unlimited")
+    parser.add_argument("--failure_rate", type=float, default=0.0,
+                        help="Fraction of calls to the transfer backend that fail. Default 0")
+    parser.add_argument("--file_failure_rate", type=float, default=0.0,
+                        help="Fraction of files that fail to transfer. Default 0")
+    parser.add_argument("--hash_workers", type=int, default=4, help="Files hashed at the same time. Default 4")
+    parser.add_argument("--chunk_gb", type=float, default=None,
+                        help="Largest upload chunk in GB. Default the gatekeeper's default")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic files and failures. Default 0")
+    args = parser.parse_args()
+
+    # Everything the gatekeeper keeps in the home directory goes in the benchmark directory instead. This has to be set
+    # before the gatekeeper modules are imported, since they read it at import time
+    os.environ["HOME"] = f"{args.dir}/home"
+    sys.path.append(dirname(dirname(abspath(__file__))))
+    import gatekeeper_globus
+    from tools.gatekeeper_class import Gatekeeper, PERSONAL_UUID, TRANSFER_ERRORS
+    from tools.local_transfer_client import LocalTransferClient
+
+    print(f"{'files':>8} {'setup s':>8} {'run s':>8} {'files/s':>8} {'calls':>6} {'on mirror':>9}  calls by type")
+    for num_files in args.files:
+        shutil.rmtree(args.dir, ignore_errors=True)
+        setup_start = time.time()
+        holding, mirror, home = make_tree(args.dir, num_files, args.months, args.file_size, args.existing_fraction,
+                                          args.blocked_fraction, args.corrupt_fraction, args.seed)
+        setup_time = time.time() - setup_start
+
+        client = LocalTransferClient({PERSONAL_UUID: "/", MIRROR_UUID: mirror}, latency_s=args.latency_s,
+                                     bandwidth=args.bandwidth, failure_rate=args.failure_rate,
+                                     file_failure_rate=args.file_failure_rate, seed=args.seed)
+        gk = Gatekeeper("benchmark", working_dir=f"{home}/tmp/", transfer_client=client,
+                        log_dir=f"{home}/logs/globus", mirror_uuid=MIRROR_UUID)
+        gk.send_email = lambda *email_args, **email_kwargs: None
+        run_start = time.time()
+        result = ""
+        gatekeeper_args = ["-d", holding, "-m", MIRROR_ROOT, "-w", str(args.hash_workers), "--hash_cache", ""]
+        if args.chunk_gb is not None:
+            gatekeeper_args += ["--chunk_gb", str(args.chunk_gb)]
+        try:
+            gatekeeper_globus.main(gatekeeper_args, gk=gk)
+        except SystemExit:
+            result = " (exited early, see the log)"
+        except TRANSFER_ERRORS as error:
+            # Simulated failures the gatekeeper doesn't handle end the run, as they would with Globus
+            result = f" (failed: {error})"
+        run_time = time.time() - run_start
+
+        on_mirror = sum(1 for _, _, files in os.walk(f"{mirror}{MIRROR_ROOT}/raw") for f in files
+                        if not f.endswith(".hashes"))
+        calls = ", ".join(f"{name} {count}" for name, count in sorted(client.calls.items()))
+        print(f"{num_files:>8} {setup_time:>8.1f} {run_time:>8.1f} {num_files / max(run_time, 1e-6):>8.0f} "
+              f"{sum(client.calls.values()):>6} {on_mirror:>9}  {calls}{result}")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Index of the lines of the mirror blocklist (the .txt files in the mirror's .config/blocklist directory).
+
+A data file is blocked if its name appears anywhere in a blocklist line (i.e. "20200101.0000.00.sas.rawacf.bz2" is
+blocked by the lines "20200101.0000.00.sas.rawacf.bz2", "raw/2020/01/20200101.0000.00.sas.rawacf.bz2  bad data" and
+"old_20200101.0000.00.sas.rawacf.bz2.gz"), the same as testing `data_file in line` for every line.
+
+Rather than testing every data file against every line, an Aho-Corasick automaton is built over the data file names
+and every blocklist line is run through it once, which finds all the data files in all the lines in time proportional
+to the length of the blocklist.
+
+Usage:
+    blocklist_index.py blocklist_dir [file ...]
+Prints the given files that are blocked, or the number of blocklist lines if no files are given.
+"""
+import argparse
+import os
+from collections import deque
+
+
+class SubstringMatcher(object):
+    """ Aho-Corasick automaton that finds which of a set of strings appear in a text """
+
+    def __init__(self, patterns):
+        """
+        :param patterns: Iterable of strings to find. Empty strings are ignored
+        """
+        self.goto = [{}]  # State: {character: next state}
+        self.fail = [0]  # State: state of the longest proper suffix that is also a prefix of a pattern
+        self.output = [()]  # State: patterns that end at this state, including those of its fail states
+
+        for pattern in patterns:
+            if pattern == "":
+                continue
+            state = 0
+            for character in pattern:
+                next_state = self.goto[state].get(character)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                    self.goto[state][character] = next_state
+                state = next_state
+            self.output[state] = (pattern,)
+
+        # Breadth first, so the fail state of each state is set before those of its children
+        queue = deque(self.goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            for character, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state != 0 and character not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(character, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find(self, text, found=None):
+        """
+        :param text: Text to search
+        :param found: Set to add the patterns found to. Default None, a new set
+        :return: Set of the patterns that appear in the text
+        """
+        if found is None:
+            found = set()
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for character in text:
+            while state != 0 and character not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(character, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+class BlocklistIndex(object):
+    """ Substring lookups of data file names in the blocklist lines """
+
+    def __init__(self, lines):
+        """
+        :param lines: Iterable of blocklist lines, without line endings
+        """
+        self.lines = sorted(set(lines))
+
+    def __len__(self):
+        return len(self.lines)
+
+    @classmethod
+    def from_lines(cls, lines):
+        """
+        :param lines: Iterable of blocklist lines
+        :return: BlocklistIndex of the lines
+        """
+        return cls(line.strip('\n').strip('\r') for line in lines)
+
+    @classmethod
+    def from_directory(cls, blocklist_dir, pattern=".txt"):
+        """
+        :param blocklist_dir: Directory containing the blocklist files
+        :param pattern: Only files ending with this are blocklist files. Default ".txt"
+        :return: BlocklistIndex of the lines of all the blocklist files
+        """
+        lines = []
+        for blocklist_file in sorted(f for f in os.listdir(blocklist_dir) if f.endswith(pattern)):
+            with open(f"{blocklist_dir}/{blocklist_file}") as f:
+                lines.extend(f)
+        return cls.from_lines(lines)
+
+    def is_blocked(self, data_file):
+        """
+        :param data_file: Name of a data file. Ex) 20200101.0000.00.sas.rawacf.bz2
+        :return: True if the file name appears in a blocklist line
+        """
+        return len(self.blocked([data_file])) > 0
+
+    def blocked(self, data_files):
+        """
+        :param data_files: Iterable of data file names
+        :return: Sorted list of the unique data files that appear in a blocklist line
+        """
+        matcher = SubstringMatcher(set(data_files))
+        found = set()
+        for line in self.lines:
+            matcher.find(line, found)
+        return sorted(found)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check data files against the mirror blocklist")
+    parser.add_argument("blocklist_dir", help="Directory containing the blocklist .txt files")
+    parser.add_argument("files", nargs='*', help="Data file names to check")
+    args = parser.parse_args()
+
+    blocklist_index = BlocklistIndex.from_directory(args.blocklist_dir)
+    if len(args.files) == 0:
+        print(f"{len(blocklist_index)} blocklist lines")
+    for blocked_file in blocklist_index.blocked(os.path.basename(f) for f in args.files):
+        print(blocked_file)
@@ -6,6 +6,10 @@ Last modification 201706 by Kevin Krieger
 This script is designed to log on to the University of Saskatchewan globus
 SuperDARN mirror in order to check for and remove files given a list of files
 
+The files to delete are grouped by yyyymm: only the hashes files of those months are got from the mirror, each is
+changed in one pass, and the changed ones are put back in a single transfer. Files that aren't in the hashes files
+are looked for in listings of their month directories on the mirror.
+
 Example of script call:
 python /path/to/delete_files_globus.py -t 'raw' -r 'chroot/sddata/' -d 'local_data/deletions/'
         -l '~/logs/deletions_globus/' ~/mirror_blocklists/cve/${year}_cve_files_to_delete.txt
@@ -13,12 +17,18 @@ python /path/to/delete_files_globus.py -t 'raw' -r 'chroot/sddata/' -d 'local_da
 See 'Removing Blocked Files from the Mirror' subsection of Data Flow section of SDARN wiki for more info
 """
 
-from gatekeeper_class import Gatekeeper
-from os.path import expanduser, isfile, isdir
+from os.path import expanduser, isfile, isdir, dirname, abspath
 import argparse
 import sys
 from datetime import datetime
 
+# When run as a script rather than with python -m tools.delete_files_globus, put the mirror directory on the path so
+# the gatekeeper and the modules it uses are imported through the tools package
+if __package__ in (None, ''):
+    sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from tools.gatekeeper_class import Gatekeeper
+from tools.hashes_file import HashesFile
+
 HOME = expanduser("~")
 TRANSFER_RT_FILENAME = f"{HOME}/.globus_transfer_rt"
 GATEKEEPER_APP_FILENAME = f"{HOME}/mirror_id_files/gatekeeper_app_id.txt"
@@ -80,81 +90,77 @@ if __name__ == '__main__':
     files_to_delete = [x.strip() for x in files_to_delete]
     files_to_delete = [x for x in files_to_delete if data_type in x]
 
-    # Download hashes files
-    gk.get_hashes_all(data_type=data_type)
-    if not gk.wait_for_last_task(timeout_s=600):
-        logfile.write("Get hashes all didn't complete in time. Exiting\n")
-        sys.exit("Get hashes all didn't complete in time.")
-
-    # Now for each file to remove from the mirror, go through hashes files and find it, remove
-    # the line and put back all updated hashes files
+    # Group the files to delete by yyyymm, so each month's hashes file is only got, changed and saved once
+    files_by_month = {}
+    for file_to_delete in files_to_delete:
+        files_by_month.setdefault(file_to_delete[0:6], []).append(file_to_delete)
+    year_months = [(int(ym[0:4]), int(ym[4:6])) for ym in sorted(files_by_month)]
+    logfile.write("{} files to delete in {} months: {}\n".format(len(files_to_delete), len(year_months),
+                                                               sorted(files_by_month)))
+
+    # Download the hashes files of those months only, in one transfer
+    gk.get_hashes_months(year_months, data_type=data_type)
+    if not gk.wait_for_last_task(timeout_s=60 * (1 + len(year_months) // 10)):
+        logfile.write("Get hashes for {} didn't complete in time. Exiting\n".format(sorted(files_by_month)))
+        sys.exit("Get hashes didn't complete in time.")
+
+    # Now remove the files of each month from its hashes file in one pass, and put back all updated hashes files
     updated_hashes = []
+    files_in_hashes = []
     files_not_found = []
-    for file_to_delete in files_to_delete:
-        year = file_to_delete[0:4]
-        month = file_to_delete[4:6]
-        logfile.write("{}: year: {} month: {}\n".format(file_to_delete, year, month))
-        try:
-            with open("{}/{}{}.hashes".format(gk.get_working_dir(), year, month)) as hashfile:
-                files_list = hashfile.readlines()
-        except IOError:
+    for ym, month_files in sorted(files_by_month.items()):
+        hashfile_path = "{}/{}.hashes".format(gk.get_working_dir(), ym)
+        if not isfile(hashfile_path):
             # Just exit if we didn't find the hash file, that's a problem requiring human insight
-            logfile.write("Could not open {}{}.hashes, does it exist? Exiting\n".format(year, month))
+            logfile.write("Could not open {}.hashes, does it exist? Exiting\n".format(ym))
             sys.exit(1)
-
-        found = False
-        for f in files_list:
-            if file_to_delete in f:
-                # it exists. Remove it from the list
-                found = True
-                files_list = [x for x in files_list if f not in x]
-                logfile.write("Removed {} from {}{}.hashes\n".format(f.strip(), year, month))
-                updated_hashes.append("{}{}.hashes".format(year, month))
-                with open("{}/{}{}.hashes".format(gk.get_working_dir(),
-                                                  year, month), 'w') as hashfile:
-                    hashfile.writelines(files_list)
-                break
-        if not found:
-            files_not_found.append(file_to_delete)
-            logfile.write("{} DNE in {}{}.hashes for data type {}\n".format(file_to_delete,
-                                                                            year, month,
-                                                                            data_type))
-            files_to_delete = [x for x in files_to_delete if x != file_to_delete]
+        hashes_file = HashesFile.load(hashfile_path)
+
+        month_found = []
+        for file_to_delete in month_files:
+            data_hash = hashes_file.get(file_to_delete)
+            if data_hash is not None:
+                month_found.append(file_to_delete)
+                logfile.write("Removed {}  {} from {}.hashes\n".format(data_hash, file_to_delete, ym))
+            else:
+                files_not_found.append(file_to_delete)
+                logfile.write("{} DNE in {}.hashes for data type {}\n".format(file_to_delete, ym, data_type))
+        if len(month_found) > 0:
+            hashes_file.remove(month_found)
+            hashes_file.save(hashfile_path)
+            files_in_hashes += month_found
+            updated_hashes.append(ym)
 
     logfile.write("Files to delete:\n")
-    logfile.writelines(files_to_delete)
+    logfile.write("\n".join(files_in_hashes))
     logfile.write("\nFiles not found:\n")
-    logfile.writelines(files_not_found)
-    updated_hashes = list(set(updated_hashes))
-    logfile.write("Updated hashes files: {}\n".format(updated_hashes))
+    logfile.write("\n".join(files_not_found))
+    logfile.write("\nUpdated hashes files: {}\n".format(["{}.hashes".format(ym) for ym in updated_hashes]))
 
-    # Now that we have files to delete and updated_hashes files, upload the new hashes and then
+    # Now that we have files to delete and updated_hashes files, upload the new hashes in one transfer and then
     # remove the files, making sure both succeed
-    for updated_hash_file in updated_hashes:
-        year = updated_hash_file[0:4]
-        month = updated_hash_file[4:6]
-        gk.put_hashes(year, month, data_type)
-        while not gk.wait_for_last_task():
-            logfile.write("Still waiting for {}{}.hashes to upload...\n".format(year, month))
-            continue
-
-    if len(files_to_delete) > 0:
-        gk.move_files_on_endpoint(files_to_delete,
-                                  "{}/{}/".format(deletions_directory, cur_date),
-                                  data_type=data_type)
-    files_to_delete = []
+    if len(updated_hashes) > 0:
+        gk.put_hashes_months([(int(ym[0:4]), int(ym[4:6])) for ym in updated_hashes], data_type=data_type)
+        while not gk.wait_for_last_task(timeout_s=60 * (1 + len(updated_hashes) // 10)):
+            logfile.write("Still waiting for {} hashes files to upload...\n".format(len(updated_hashes)))
+        if not gk.last_task_succeeded():
+            logfile.write("Upload of the updated hashes files failed, not deleting any files. Exiting\n")
+            sys.exit("Upload of the updated hashes files failed.")
+
+    # Files not in the hashes files may still be on the mirror. Each month directory is listed once to find them,
+    # rather than one request per file
+    files_on_mirror = []
     for f in files_not_found:
-        year = f[0:4]
-        month = f[4:6]
-        if gk.check_for_file_existence("{}/{}/{}/{}/{}".format(gk.get_mirror_root_dir(),
-                                                               data_type, year, month,
-                                                               f.strip('\n'))):
-            logfile.write("{} on mirror but not in hashes file! Removing\n".format(f.strip('\n')))
-            files_to_delete.append(f)
-
+        if gk.file_exists("{}/{}/{}/{}/{}".format(gk.get_mirror_root_dir(), data_type, f[0:4], f[4:6], f)):
+            logfile.write("{} on mirror but not in hashes file! Removing\n".format(f))
+            files_on_mirror.append(f)
     logfile.write("Files not found in hashes but still on mirror:\n")
-    logfile.writelines(files_to_delete)
-    if len(files_to_delete) > 0:
-        gk.move_files_on_endpoint(files_to_delete,
-                                  "{}/{}".format(deletions_directory, cur_date),
+    logfile.write("\n".join(files_on_mirror) + "\n")
+
+    # Move all the files to the deletions directory together
+    files_to_move = files_in_hashes + files_on_mirror
+    if len(files_to_move) > 0:
+        gk.move_files_on_endpoint(files_to_move,
+                                  "{}/{}/".format(deletions_directory, cur_date),
                                   data_type=data_type)
+    logfile.write("Moved {} files to {}/{}/\n".format(len(files_to_move), deletions_directory, cur_date))
@@ -1,16 +1,25 @@
 import pydarnio
 import os
+import sys
 import argparse
+import bz2
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from os.path import dirname, abspath
 """
 Script to check for and move local special experiment files to a subdirectory. Main usage is to move files out of the
 holding directory when special experiment files are not flagged earlier in the data flow chain
 
 Usage:
-Call check_files(filepath) for a given path to see the list of files (if any) that are from special experiments.
-Then, call move_files(filepath) to move those files to a subdirectory.
-This could probably be done in a better way where the output of check_files() could be used for the move_files()
-    function to avoid redundancy. This has been done this way to allow for a manual check of the file list before
-    moving the flagged files to the subdirectory.
+Run the script with -p path (or call check_files(filepath)) to see the list of files (if any) that are from special
+experiments. The CPID of every file is written to a manifest, special_experiments/cpids.manifest by default.
+Then, run it again with --move (or call move_files(filepath)) to move the flagged files in the manifest to a
+subdirectory, without reading the files again. This allows for a manual check of the file list before moving the
+flagged files to the subdirectory.
+
+The files are sniffed several at a time in a process pool, and only as much of each file is decompressed as is needed
+to read the first record's cp scalar. CPIDs are cached in the hash cache (see hash_cache.py) per file identity, so files
+that are still in the directory the next time it is scanned aren't read again.
 
 Normal CPIDs:
     151  -> Normalscan
@@ -19,44 +28,210 @@ Normal CPIDs:
     3503 -> Twofsound
 """
 
+# Run as a script (python tools/flag_experiment_files.py), the mirror directory has to be on the path to import tools.*
+if __package__ in (None, ''):
+    sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from tools.hash_cache import HashCache, HASH_CACHE_FILENAME
+
+NORMAL_CPIDS = (151, 157, 191, 3503)
+SUBDIR = "special_experiments"
+MANIFEST_FILENAME = "cpids.manifest"  # In the special_experiments/ subdirectory, unless another manifest is given
+CPID_KIND = "cpid"  # Kind of the CPID entries in the hash cache
+SNIFF_WORKERS = 4  # Number of files sniffed at the same time
+SNIFF_BYTES = 64 * 1024  # Most bytes of the first record decompressed to find the cp scalar
+# DMAP scalar types: struct format of each fixed size type, strings are null terminated
+DMAP_FORMATS = {1: 'b', 2: 'h', 3: 'i', 4: 'f', 8: 'd', 10: 'q', 16: 'B', 17: 'H', 18: 'I', 19: 'Q'}
+DMAP_STRING = 9
+
+
+def read_cstring(data, offset):
+    """ :return: Tuple of (null terminated string at offset in data, offset after it) """
+    end = data.index(b'\0', offset)
+    return data[offset:end].decode('ascii', errors='replace'), end + 1
+
+
+def sniff_cpid(file_path):
+    """
+    Read the CPID of a DMAP file (i.e. a rawacf, bz2 compressed or not) from the cp scalar of its first record,
+    decompressing no more than that record's scalars
+
+    :param file_path: Path to the file
+    :return: CPID (int)
+    """
+    opener = bz2.open if file_path.endswith(".bz2") else open
+    with opener(file_path, 'rb') as f:
+        header = f.read(16)
+        _, size, num_scalars, _ = struct.unpack('<iiii', header)
+        data = f.read(min(size - 16, SNIFF_BYTES))
+    offset = 0
+    for _ in range(num_scalars):
+        name, offset = read_cstring(data, offset)
+        data_type = data[offset]
+        offset += 1
+        if data_type == DMAP_STRING:
+            _, offset = read_cstring(data, offset)
+            continue
+        value_format = '<' + DMAP_FORMATS[data_type]
+        if name == 'cp':
+            return struct.unpack_from(value_format, data, offset)[0]
+        offset += struct.calcsize(value_format)
+    raise ValueError(f"No cp scalar in the first record of {file_path}")
+
+
+def sniff_file(file_path):
+    """
+    Get the CPID of a file, falling back to pydarnio for files sniff_cpid() can't read. Run in the process pool
+
+    :param file_path: Path to the file
+    :return: Tuple of (CPID or None, error message or None)
+    """
+    try:
+        return sniff_cpid(file_path), None
+    except (OSError, EOFError, ValueError, KeyError, IndexError, struct.error):
+        pass
+    try:
+        return pydarnio.read_rawacf(file_path, mode="sniff")['cp'], None
+    except Exception as error:
+        return None, str(error)
+
+
+def scan_cpids(filepath, workers=SNIFF_WORKERS, cache=None):
+    """
+    Get the CPID of every file in a directory in a single pass, sniffing several files at a time
+
+    :param filepath: Directory to scan
+    :param workers: Number of files to sniff at the same time. Default SNIFF_WORKERS
+    :param cache: HashCache to get and store the CPIDs in. Default None, no cache
+    :return: Dictionary of filename: (CPID or None, error message or None, size, mtime_ns)
+    """
+    file_stats = {}
+    for entry in sorted(os.scandir(filepath), key=lambda entry: entry.name):
+        if entry.is_file():
+            file_stats[entry.name] = entry.stat()
 
-# Function to find and move files with abnormal CPIDs at a given path to a subdirectory
-def move_files(filepath):
-    normal_cpid = (151, 157, 191, 3503)
-    file_path = filepath
-    subdir = f"{file_path}/special_experiments/"
-    for f in sorted(os.listdir(file_path)):
-        if os.path.isfile(f"{file_path}/{f}"):
-            rec = pydarnio.read_rawacf(f"{file_path}/{f}", mode="sniff")
-            if rec['cp'] not in normal_cpid:
-                print(f"Not normal op! cpid = {rec['cp']}. Moving file {f}")
-                os.rename(f"{file_path}/{f}", f"{subdir}/{f}")
-            else:
-                print(f"Normal op! cpid = {rec['cp']}. {f}")
-
-
-# Function to find and log files with abnormal CPIDs at a given path
-def check_files(filepath):
-    normal_cpid = (151, 157, 191, 3503)
-    file_path = filepath
+    results = {}
+    to_sniff = []
+    for filename, file_stat in file_stats.items():
+        cached = None if cache is None else cache.lookup(f"{filepath}/{filename}", CPID_KIND, file_stat)
+        if cached is not None:
+            results[filename] = (int(cached), None)
+        else:
+            to_sniff.append(filename)
+
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        sniffed = executor.map(sniff_file, [f"{filepath}/{filename}" for filename in to_sniff], chunksize=16)
+        for filename, (cpid, error) in zip(to_sniff, sniffed):
+            results[filename] = (cpid, error)
+            if cache is not None and cpid is not None:
+                try:
+                    cache.store(f"{filepath}/{filename}", str(cpid), CPID_KIND, file_stats[filename])
+                except FileNotFoundError:
+                    pass  # Moved away since the directory was scanned
+    return {filename: (*results[filename], file_stats[filename].st_size, file_stats[filename].st_mtime_ns)
+            for filename in file_stats}
+
+
+def write_manifest(manifest_path, results):
+    """
+    Write the CPIDs of a scan to a manifest, one "cpid size mtime_ns filename" line per file. Files whose CPID
+    couldn't be read have "error" as their CPID
+
+    :param manifest_path: Path of the manifest, its directory is made if it doesn't exist
+    :param results: Dictionary from scan_cpids()
+    """
+    os.makedirs(dirname(abspath(manifest_path)), exist_ok=True)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        for filename, (cpid, _, size, mtime_ns) in sorted(results.items()):
+            f.write(f"{'error' if cpid is None else cpid} {size} {mtime_ns} {filename}\n")
+    os.replace(tmp_path, manifest_path)
+
+
+def read_manifest(manifest_path):
+    """ :return: Dictionary of filename: (CPID or None, size, mtime_ns) from a manifest written by write_manifest() """
+    manifest = {}
+    with open(manifest_path) as f:
+        for line in f:
+            cpid, size, mtime_ns, filename = line.rstrip('\n').split(' ', 3)
+            manifest[filename] = (None if cpid == "error" else int(cpid), int(size), int(mtime_ns))
+    return manifest
+
+
+def default_manifest(filepath):
+    """ :return: Path of the manifest of a directory, if no other is given """
+    return f"{filepath}/{SUBDIR}/{MANIFEST_FILENAME}"
+
+
+# Function to find and log files with abnormal CPIDs at a given path, and write the CPIDs of all files to a manifest
+def check_files(filepath, manifest_path=None, workers=SNIFF_WORKERS, cache=None):
+    if manifest_path is None:
+        manifest_path = default_manifest(filepath)
+    results = scan_cpids(filepath, workers, cache)
     file_list = []
-    for f in sorted(os.listdir(file_path)):
-        if os.path.isfile(f"{file_path}/{f}"):
-            rec = pydarnio.read_rawacf(f"{file_path}/{f}", mode="sniff")
-            if rec['cp'] not in normal_cpid:
-                print(f"Not normal op! cpid = {rec['cp']}. Moving file {f}")
-                file_list.append(f)
-            else:
-                print(f"Normal op! cpid = {rec['cp']}. {f}")
+    for f, (cpid, error, _, _) in results.items():
+        if cpid is None:
+            print(f"Couldn't read the cpid of {f}: {error}")
+        elif cpid not in NORMAL_CPIDS:
+            print(f"Not normal op! cpid = {cpid}. Moving file {f}")
+            file_list.append(f)
+        else:
+            print(f"Normal op! cpid = {cpid}. {f}")
+    write_manifest(manifest_path, results)
 
     print(file_list)
+    return file_list
+
+
+# Function to move the files with abnormal CPIDs in the manifest of a given path to a subdirectory. The directory is
+# scanned first if there is no manifest
+def move_files(filepath, manifest_path=None, workers=SNIFF_WORKERS, cache=None):
+    if manifest_path is None:
+        manifest_path = default_manifest(filepath)
+    if not os.path.isfile(manifest_path):
+        check_files(filepath, manifest_path, workers, cache)
+    subdir = f"{filepath}/{SUBDIR}/"
+    os.makedirs(subdir, exist_ok=True)
+    moved = []
+    for f, (cpid, size, mtime_ns) in sorted(read_manifest(manifest_path).items()):
+        if cpid is None or cpid in NORMAL_CPIDS:
+            continue
+        try:
+            file_stat = os.stat(f"{filepath}/{f}")
+        except FileNotFoundError:
+            print(f"{f} is gone, not moving it")
+            continue
+        if (file_stat.st_size, file_stat.st_mtime_ns) != (size, mtime_ns):
+            print(f"{f} changed since it was scanned, not moving it. Scan again")
+            continue
+        print(f"Not normal op! cpid = {cpid}. Moving file {f}")
+        os.rename(f"{filepath}/{f}", f"{subdir}/{f}")
+        moved.append(f)
+    return moved
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--path", help="Directory to scan for special experiment files", default='')
+    parser.add_argument("-m", "--manifest", default=None,
+                        help=f"Manifest of the CPIDs of the files, default is {SUBDIR}/{MANIFEST_FILENAME} in the "
+                             f"directory")
+    parser.add_argument("--move", action='store_true',
+                        help="Move the flagged files in the manifest to the subdirectory, scanning first if there is "
+                             "no manifest")
+    parser.add_argument("-w", "--workers", type=int, default=SNIFF_WORKERS,
+                        help=f"Number of files to sniff at the same time, default is {SNIFF_WORKERS}")
+    parser.add_argument("--hash_cache", type=str, default=HASH_CACHE_FILENAME,
+                        help=f"Hash cache database the CPIDs are cached in, default is {HASH_CACHE_FILENAME}. Empty "
+                             f"string disables the cache")
     args = parser.parse_args()
     filepath = args.path
 
-    check_files(filepath)
-    # move_files(filepath)
+    cpid_cache = None if args.hash_cache == '' else HashCache(args.hash_cache)
+    try:
+        if args.move:
+            move_files(filepath, args.manifest, args.workers, cpid_cache)
+        else:
+            check_files(filepath, args.manifest, args.workers, cpid_cache)
+    finally:
+        if cpid_cache is not None:
+            cpid_cache.close()
@@ -3,8 +3,8 @@ import globus_sdk
 from globus_sdk.scopes import TransferScopes
 import inspect
 from datetime import datetime, timedelta
-from os.path import expanduser, isfile, getsize, isdir
-from os import listdir, mkdir, remove, rename, stat
+from os.path import expanduser, isfile, getsize, isdir, normpath
+from os import listdir, mkdir, makedirs, remove, rename, stat
 import shutil
 import fnmatch
 import sys
@@ -17,12 +17,38 @@ import pydarnio
 import logging
 import argparse
 import hashlib
+import bz2
+from concurrent.futures import ThreadPoolExecutor, Future, ALL_COMPLETED
+
+from tools.hash_cache import HashCache, file_digests
+from tools.hashes_file import HashesFile
+from tools.transfer_backend import GlobusBackend, BackendError, BackendAPIError, BackendNetworkError
+from tools.mirror_filter import MirrorFilter
+from tools.task_tracker import TaskTracker
 
 HOME = expanduser("~")
+HASH_BUFFER_SIZE = 1024 * 1024  # Read files in 1 MiB blocks when hashing
+HASH_WORKERS = 4  # Number of files hashed at the same time
+BZ2_OUTPUT_SIZE = 1024 * 1024  # Max number of decompressed bytes held in memory at a time when testing bz2 files
+BZ2_FAILED = "Failed BZ2 integrity test"
+EMPTY_FILE = "File contains no records (empty)"
+EMPTY_FILE_SIZE = 14  # Size of a bz2 file with no data (header and end of stream marker only)
+UPLOAD_CHUNK_BYTES = 20 * 1000 ** 3  # Largest upload task, files are uploaded in chunks of one yyyymm up to this size
+UPLOAD_CHUNKS_IN_FLIGHT = 2  # Number of upload chunks transferring at the same time
 TRANSFER_RT_FILENAME = f"{HOME}/.globus_transfer_rt"
 PERSONAL_UUID_FILENAME = f"{HOME}/.globusonline/lta/client-id.txt"
 MIRROR_UUID_FILENAME = f"{HOME}/mirror_id_files/mirror_uuid.txt"
-
+# Persistent local copy of the mirror's hashes files (<data_type>/yyyymm.hashes) and master.hashes
+LOCAL_HASHES_DIR = f"{HOME}/mirror_hashes/"
+LOCAL_HASHES_STAMP = "last_refresh"  # Written in the local copy each time it is brought up to date with the mirror
+# Errors from a request to the transfer backend (see transfer_backend.py), from Globus or another backend
+TRANSFER_API_ERRORS = (globus_sdk.GlobusAPIError, BackendAPIError)
+TRANSFER_NETWORK_ERRORS = (globus_sdk.NetworkError, BackendNetworkError)
+TRANSFER_ERRORS = (globus_sdk.GlobusError, BackendError)
+
+# UUIDs of the endpoints, None on machines without the ID files (i.e. when using a LocalTransferClient)
+PERSONAL_UUID = None
+MIRROR_UUID = None
 if isfile(PERSONAL_UUID_FILENAME):
     with open(PERSONAL_UUID_FILENAME) as f:
         PERSONAL_UUID = f.readline().strip()
@@ -114,7 +140,49 @@ def parse_data_filename(filename):
         return year, month, day, hour, minute, second, abbrev, data_type
 
 
-def sha1hashing(filepath, filename):
+class FileRecord(object):
+    """ A data file being uploaded by the gatekeeper: the fields of its name, parsed once, and its sha1 digest.
+    Slotted, so the records of a large backfill take a fraction of the memory of a dictionary per file """
+    __slots__ = ('filename', 'year', 'month', 'day', 'yearmonth', 'radar', 'type', 'digest')
+
+    def __init__(self, filename, data_hash):
+        """
+        :param filename: Name of the data file, i.e. 20200804.2200.01.mcm.a.rawacf.bz2
+        :param data_hash: Hex sha1 digest of the file
+        """
+        elements = parse_data_filename(filename)
+        self.filename = filename
+        self.year = elements[0]
+        self.month = elements[1]
+        self.day = elements[2]
+        self.yearmonth = filename[0:6]
+        self.radar = elements[6]
+        # rawacf files are under raw/ on the mirror
+        self.type = "raw" if elements[7] == "rawacf" else elements[7]
+        self.digest = bytes.fromhex(data_hash)
+
+    @property
+    def hash(self):
+        """ :return: Hex sha1 digest of the file, as in the hashes files """
+        return self.digest.hex()
+
+    def mirror_path(self, mirror_root_dir):
+        """ :return: Path of the file on the mirror, under mirror_root_dir """
+        return f"{mirror_root_dir}/{self.type}/{self.year:04d}/{self.month:02d}/{self.filename}"
+
+
+def group_by_yearmonth(filenames):
+    """
+    :param filenames: Iterable of data file names
+    :return: Dictionary of yyyymm: list of the file names of that month, in the order given, with the months sorted
+    """
+    groups = {}
+    for filename in filenames:
+        groups.setdefault(filename[0:6], []).append(filename)
+    return dict(sorted(groups.items()))
+
+
+def sha1hashing(filepath, filename, buffer_size=HASH_BUFFER_SIZE):
     """
     Building function to hash files in blocks to save memory -
     if we switch to python 3.11, can use hashlib.file_digest instead
@@ -124,21 +192,203 @@ def sha1hashing(filepath, filename):
                      example: "/data/holding/globus/"
     :param filename: String, rawacf file to be hashed.
                      example: "20200804.2200.01.mcm.a.rawacf.bz2"
+    :param buffer_size: Number of bytes to read from the file at a time. Defaults to HASH_BUFFER_SIZE
     :return: Sha1sum hash of given rawacf file
     """
     sha1 = hashlib.sha1()
-    with open(f'{filepath}/{filename}', 'rb') as file_to_hash:
-        while data := file_to_hash.read(65536):  # true until end of buffer
-            sha1.update(data)
+    # Read into a single reused buffer rather than allocating a new bytes object for every block
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(f'{filepath}/{filename}', 'rb', buffering=0) as file_to_hash:
+        while size := file_to_hash.readinto(buffer):  # true until end of file
+            sha1.update(view[:size])
     return sha1.hexdigest()
 
 
+class Bz2StreamTester(object):
+    """ Incremental equivalent of `bunzip2 -t`. Feed it a bz2 file in chunks, then call finish() """
+
+    def __init__(self):
+        self.decompressor = bz2.BZ2Decompressor()
+        self.pending = b''  # Data after the end of a stream, too short yet to tell if it starts another stream
+        self.error = None
+        self.trailing_garbage = False
+
+    def feed(self, data):
+        """ :param data: Next chunk of the file """
+        if self.error is not None or self.trailing_garbage:
+            return
+        data = self.pending + data
+        self.pending = b''
+        try:
+            while data:
+                if self.decompressor.eof:
+                    # Concatenated streams (i.e. from pbzip2) are valid, anything else is ignored like bunzip2 does
+                    if len(data) < 3:
+                        self.pending = data
+                        return
+                    if not data.startswith(b'BZh'):
+                        self.trailing_garbage = True
+                        return
+                    self.decompressor = bz2.BZ2Decompressor()
+                # Limit the decompressed output so large files aren't held in memory
+                self.decompressor.decompress(data, BZ2_OUTPUT_SIZE)
+                while not self.decompressor.eof and not self.decompressor.needs_input:
+                    self.decompressor.decompress(b'', BZ2_OUTPUT_SIZE)
+                data = self.decompressor.unused_data if self.decompressor.eof else b''
+        except (OSError, ValueError, EOFError) as e:
+            self.error = f"data integrity error: {e}"
+
+    def finish(self):
+        """ :return: Description of the error if the file failed the test, None if it passed """
+        if self.error is None and not self.trailing_garbage:
+            if not self.decompressor.eof or (self.pending and b'BZh'.startswith(self.pending)):
+                self.error = "file ends unexpectedly"
+        return self.error
+
+
+def sha1_bz2_test(filepath, filename, buffer_size=HASH_BUFFER_SIZE):
+    """
+    Hash a rawacf and test its bz2 integrity (like `bunzip2 -t`) while reading the file only once
+
+    :param filepath: String, path of rawacf to be tested. example: "/data/holding/globus/"
+    :param filename: String, rawacf file to be tested. example: "20200804.2200.01.mcm.a.rawacf.bz2"
+    :param buffer_size: Number of bytes to read from the file at a time. Defaults to HASH_BUFFER_SIZE
+    :return: Tuple of (sha1sum hash, reason the file failed (BZ2_FAILED or EMPTY_FILE) or None if it passed,
+                       description of the failure or None)
+    """
+    sha1 = hashlib.sha1()
+    tester = Bz2StreamTester()
+    size = 0
+    with open(f'{filepath}/{filename}', 'rb', buffering=0) as file_to_test:
+        while chunk := file_to_test.read(buffer_size):  # true until end of file
+            sha1.update(chunk)
+            tester.feed(chunk)
+            size = file_to_test.tell()
+    error = tester.finish()
+    if error is not None:
+        return sha1.hexdigest(), BZ2_FAILED, error
+    if size <= EMPTY_FILE_SIZE:
+        return sha1.hexdigest(), EMPTY_FILE, f"{size} bytes"
+    return sha1.hexdigest(), None, None
+
+
+def hash_and_test_parallel(filepath, filenames, workers=HASH_WORKERS, buffer_size=HASH_BUFFER_SIZE, cache=None,
+                           test_bz2=True):
+    """
+    Hash (and optionally bz2 test) many files concurrently with a thread pool. hashlib and bz2 release
+    the GIL while working on large blocks, so the threads hash (and wait on the disk) in parallel.
+
+    :param filepath: String, path of the directory containing the rawacfs to be hashed.
+                     example: "/data/holding/globus/"
+    :param filenames: List of rawacf files in filepath to be hashed
+    :param workers: Number of files to hash at the same time. Defaults to HASH_WORKERS
+    :param buffer_size: Number of bytes to read from each file at a time. Defaults to HASH_BUFFER_SIZE
+    :param cache: HashCache to get the results for unchanged files from, and store new results in. Only
+                  used from the calling thread. Default None, read every file
+    :param test_bz2: Test the bz2 integrity of each file in the same read as the hash. Default True
+    :return: Tuple of (dictionary of filename: sha1sum hash for each file hashed,
+                       dictionary of filename: (reason for failure or None, description or None) for each
+                       file tested, empty if test_bz2 is False,
+                       dictionary of filename: exception for each file that failed to be hashed,
+                       total number of bytes read (not including cached files),
+                       time taken in seconds)
+    """
+    def hash_file(filename):
+        if test_bz2:
+            data_hash, reason, description = sha1_bz2_test(filepath, filename, buffer_size)
+        else:
+            data_hash, reason, description = sha1hashing(filepath, filename, buffer_size), None, None
+        return data_hash, reason, description, getsize(f'{filepath}/{filename}')
+
+    hashes = {}
+    bz2_results = {}
+    errors = {}
+    file_stats = {}
+    total_bytes = 0
+    start = time.monotonic()
+    to_hash = filenames
+    if cache is not None:
+        to_hash = []
+        for filename in filenames:
+            try:
+                file_stats[filename] = stat(f'{filepath}/{filename}')
+                cached_hash = cache.lookup(f'{filepath}/{filename}', 'sha1', file_stats[filename])
+                cached_bz2 = None
+                if test_bz2 and cached_hash is not None:
+                    cached_bz2 = cache.lookup(f'{filepath}/{filename}', 'bz2', file_stats[filename])
+            except Exception as e:
+                errors[filename] = e
+                continue
+            if cached_hash is None or (test_bz2 and cached_bz2 is None):
+                to_hash.append(filename)
+            else:
+                hashes[filename] = cached_hash
+                if test_bz2:
+                    # Only the reason is cached, 'OK' for files that passed
+                    bz2_results[filename] = (None, None) if cached_bz2 == 'OK' else (cached_bz2, "cached result")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {filename: executor.submit(hash_file, filename) for filename in to_hash}
+        for filename, future in futures.items():
+            try:
+                hashes[filename], reason, description, size = future.result()
+                total_bytes += size
+                if test_bz2:
+                    bz2_results[filename] = (reason, description)
+                if cache is not None:
+                    cache.store(f'{filepath}/{filename}', hashes[filename], 'sha1', file_stats[filename])
+                    if test_bz2:
+                        cache.store(f'{filepath}/{filename}', reason or 'OK', 'bz2', file_stats[filename])
+            except Exception as e:
+                errors[filename] = e
+    return hashes, bz2_results, errors, total_bytes, time.monotonic() - start
+
+
+def sha1hashing_parallel(filepath, filenames, workers=HASH_WORKERS, buffer_size=HASH_BUFFER_SIZE, cache=None):
+    """
+    Hash many files concurrently with a thread pool. See hash_and_test_parallel()
+
+    :return: Tuple of (dictionary of filename: sha1sum hash for each file hashed,
+                       dictionary of filename: exception for each file that failed to be hashed,
+                       total number of bytes hashed (not including cached files),
+                       time taken in seconds)
+    """
+    hashes, _, errors, total_bytes, seconds = hash_and_test_parallel(filepath, filenames, workers, buffer_size,
+                                                                     cache, test_bz2=False)
+    return hashes, errors, total_bytes, seconds
+
+
+def make_upload_chunks(filepath, filenames, max_chunk_bytes=UPLOAD_CHUNK_BYTES):
+    """
+    Split files to upload into chunks, one transfer task each. A chunk only has files of one yyyymm, so each
+    yyyymm.hashes file can be updated as soon as the chunks of its month are done, and holds at most max_chunk_bytes
+    of files (or a single file, if that is larger)
+
+    :param filepath: Directory the files are in
+    :param filenames: Names of the files, starting with yyyymm
+    :param max_chunk_bytes: Largest total size of the files in a chunk. Default UPLOAD_CHUNK_BYTES
+    :return: List of (yyyymm, list of filenames) tuples, in order of yyyymm and filename
+    """
+    chunks = []
+    chunk_bytes = 0
+    for filename in sorted(filenames):
+        size = getsize(f"{filepath}/{filename}") if isfile(f"{filepath}/{filename}") else 0
+        if len(chunks) == 0 or chunks[-1][0] != filename[0:6] or chunk_bytes + size > max_chunk_bytes:
+            chunks.append((filename[0:6], []))
+            chunk_bytes = 0
+        chunks[-1][1].append(filename)
+        chunk_bytes += size
+    return chunks
+
+
 class Gatekeeper(object):
     """ This is the gatekeeper class. It knows about globus and will
     control data flow onto the mirror """
 
     # Add _test to 3rd argument in constructor below for testing purposes
-    def __init__(self, client_id, client_secret=None, transfer_rt=None, working_dir=f"{HOME}/tmp/"):
+    def __init__(self, client_id, client_secret=None, transfer_rt=None, working_dir=f"{HOME}/tmp/",
+                 transfer_client=None, log_dir=f"/{HOME}/logs/globus", mirror_uuid=None, shard=None):
         """ Initialize member variables, check arguments, etc..
 
         :param client_id: retrieved from "Manage Apps" section of
@@ -147,7 +397,12 @@ class Gatekeeper(object):
         :param transfer_rt: is given by manually authenticating via the get_auth_with_login
         function. Defaults to None. str
         :param working_dir: A temporary working directory for the script. Defaults to tmp in the
-        home directory. Cleared upon init. str"""
+        home directory. Cleared upon init. str
+        :param transfer_client: Transfer backend (see tools/transfer_backend.py) to use instead of
+        authenticating with Globus, i.e. a LocalTransferClient for testing. Defaults to None
+        :param log_dir: Directory for the yyyy/mm/ log directories. Defaults to ~/logs/globus. str
+        :param mirror_uuid: UUID of the mirror endpoint. Defaults to the UUID in the mirror ID file
+        :param shard: Name of the shard for a sharded run (see set_shard()). Defaults to None, not sharded"""
         self.CLIENT_ID = client_id
         self.CLIENT_SECRET = client_secret
         self.TRANSFER_RT = transfer_rt
@@ -155,6 +410,7 @@ class Gatekeeper(object):
         self.transfer_rt_filename = TRANSFER_RT_FILENAME
         self.last_transfer_result = None
         self.working_dir = working_dir
+        self.shard = None
 
         self.holding_dir = None
         self.mirror_root_dir = None
@@ -162,25 +418,20 @@ class Gatekeeper(object):
         # Add _test for testing purposes
         self.mirror_failed_dir = 'local_data/failed/'
 
-        self.cur_year = datetime.now().year
-        self.cur_month = datetime.now().month
-        self.cur_day = datetime.now().day
-        self.cur_hour = datetime.now().hour
-        self.cur_minute = datetime.now().minute
-        self.cur_date = datetime.now().strftime("%Y%m%d")
+        self.set_current_date()
         self.possible_data_types = ['raw', 'dat']
 
         # Setup logger
-        logdir = f"/{HOME}/logs/globus"  # Add _test for testing purposes
-        logfile = (f"{logdir}/{self.cur_year:04d}/{self.cur_month:02d}/{self.cur_year:04d}{self.cur_month:02d}"
-                   f"{self.cur_day:02d}.{self.cur_hour:02d}{self.cur_minute:02d}_globus_gatekeeper.log")
-        # Make sure year and month directories for logfile exist
-        if not isdir(f"{logdir}/{self.cur_year:04d}/"):
-            mkdir(f"{logdir}/{self.cur_year:04d}/")
-        if not isdir(f"{logdir}/{self.cur_year:04d}/{self.cur_month:02d}/"):
-            mkdir(f"{logdir}/{self.cur_year:04d}/{self.cur_month:02d}/")
-
-        self.logger = extendable_logger(logfile, "Gatekeeper")
+        self.log_dir = log_dir  # Add _test for testing purposes
+        self.logger = None
+        self.log_file = None
+        if shard is not None:
+            self.set_shard(shard)
+        self.open_log()
+        # Per-step timings of the run, set by gatekeeper_globus.py (see tools/run_metrics.py)
+        self.run_metrics = None
+        # Seconds spent in wait_for_tasks(), for the run metrics
+        self.task_wait_s = 0.0
 
         # Potential consents required (new as of Globus endpoints v5 - see here: https://globus-sdk-python.readthedocs.io/en/stable/examples/minimal_transfer_script/index.html#example-minimal-transfer)
         self.consents = []
@@ -189,8 +440,24 @@ class Gatekeeper(object):
         # Note that this uuid is the new cedar globus version 5 uuid, and hardcoded here due to hacking
         # this shit together in a quick timeframe. Ideally this would be searched and found programmatically via the function below "get_superdarn_mirror_uuid, which works to get the correct uuid, but we need a transfer client to use it, but we need the uuid to get a transfer client... so yeah, chicken and egg"
         # TO DO: Get the mirror_uuid using a function, so we don't have to read it from a file.
-        self.mirror_uuid = MIRROR_UUID
-        self.transfer_client = self.get_transfer_client()
+        self.mirror_uuid = MIRROR_UUID if mirror_uuid is None else mirror_uuid
+        if transfer_client is None:
+            transfer_client = self.get_transfer_client()
+        self.transfer_client = transfer_client
+        # Follows every submitted task, so several can be outstanding at once (see wait_for_tasks())
+        self.task_tracker = TaskTracker(self.transfer_client, self.logger)
+
+        # Directory listings of endpoints, {(uuid, directory path, filter): set of entry names}. Kept for the whole run
+        # and cleared whenever something is written to an endpoint (see submit_transfer())
+        self.listing_cache = {}
+        # Directories made (or found to exist) on endpoints this run, {(uuid, normalized path)}, so each is only made
+        # once (see create_new_dir())
+        self.created_dirs = set()
+        # Keep master.hashes, all_failed.txt and the blocklist in the working dir between runs, and only get them
+        # again when they change on the mirror (see mirror_config_listing()). Set for the daemon mode
+        self.keep_mirror_config = False
+        # mirror_config_listing() when the files in the working dir were last got from the mirror
+        self.mirror_config = {}
 
         # Email information ##########################################################
         # smtpServer is the host to use that will actually send the email
@@ -204,8 +471,8 @@ class Gatekeeper(object):
         self.smtp_server = 'localhost'
         self.email_message = ''
 
-        # Check if there is a current transfer, that could be bad
-        if self.check_for_transfer_to_endpoint(self.mirror_uuid):
+        # Check if there is a current transfer, that could be bad. Shards run alongside each other's transfers
+        if self.shard is None and self.check_for_transfer_to_endpoint(self.mirror_uuid):
             sub = "Error: current active transfer to mirror"
             self.log_email_exit(self.logger.error, 1, 1, sub=sub)
 
@@ -259,12 +526,86 @@ class Gatekeeper(object):
         if email_flag:
             self.send_email()
         if exit_flag:
+            if self.run_metrics is not None:
+                self.run_metrics.finish(status="exited")
             sys.exit()
 
         # Reset subject and message for future emails
         self.email_subject = '[Gatekeeper Globus] ' + self.current_time.strftime("%Y%m%d.%H%M : ")
         self.email_message = ''
 
+    def set_current_date(self):
+        """ Set the cur_* date and time members to now """
+        self.cur_year = datetime.now().year
+        self.cur_month = datetime.now().month
+        self.cur_day = datetime.now().day
+        self.cur_hour = datetime.now().hour
+        self.cur_minute = datetime.now().minute
+        self.cur_date = datetime.now().strftime("%Y%m%d")
+
+    def open_log(self):
+        """ Log to a new file in log_dir/yyyy/mm/ named for the current date and time (see set_current_date()),
+        instead of the file the logger wrote to until now """
+        logdir = self.log_dir
+        logfile = (f"{logdir}/{self.cur_year:04d}/{self.cur_month:02d}/{self.cur_year:04d}{self.cur_month:02d}"
+                   f"{self.cur_day:02d}.{self.cur_hour:02d}{self.cur_minute:02d}_globus_gatekeeper"
+                   f"{'' if self.shard is None else f'_{self.shard}'}.log")
+        # Make sure year and month directories for logfile exist
+        if not isdir(f"{logdir}/{self.cur_year:04d}/"):
+            mkdir(f"{logdir}/{self.cur_year:04d}/")
+        if not isdir(f"{logdir}/{self.cur_year:04d}/{self.cur_month:02d}/"):
+            mkdir(f"{logdir}/{self.cur_year:04d}/{self.cur_month:02d}/")
+
+        if self.logger is not None:
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+        self.logger = extendable_logger(logfile, "Gatekeeper")
+        self.log_file = logfile
+
+    def set_shard(self, shard):
+        """ Work as one shard of a sharded run of gatekeeper_globus.py (see tools/run_lock.py), in a directory of its
+        own and with a log file of its own, so shards running at the same time don't clear or write over each other's
+        files. The shard directories are next to the working directory (i.e. ~/tmp_shards/shard_sas/ for ~/tmp/)
+        rather than in it, so a run that isn't sharded doesn't clear their journals when it clears its working dir
+
+        :param shard: Name of the shard, i.e. sas or 202401
+        """
+        self.shard = shard
+        self.working_dir = f"{self.working_dir.rstrip('/')}_shards/shard_{shard}/"
+        makedirs(self.working_dir, exist_ok=True)
+        if self.logger is not None:
+            self.open_log()
+
+    def start_run(self):
+        """ Get ready for another run with the same authorized transfer client, as the daemon mode of
+        gatekeeper_globus.py does for each batch of files. Each run gets its own log file, as if it had been started
+        by cron, and the emails, tasks and directory listings of the last run are forgotten """
+        self.set_current_date()
+        self.open_log()
+        self.current_time = datetime.now()
+        self.email_subject = '[Gatekeeper Globus] ' + self.current_time.strftime("%Y%m%d.%H%M : ")
+        self.email_message = ''
+        self.last_transfer_result = None
+        self.run_metrics = None
+        self.task_wait_s = 0.0
+        self.invalidate_listings()
+        self.created_dirs.clear()
+
+    def mirror_config_listing(self):
+        """ List the files in .config/ on the mirror that runs get: master.hashes, all_failed.txt and the files in
+        blocklist/, so they are only transferred again when they have changed
+
+        :return: Dictionary of path under .config/ (i.e. master.hashes, blocklist/file.txt): (size, last modified)
+        """
+        listing = {}
+        for directory, prefix in ((f"{self.mirror_root_dir}/.config", ""),
+                                  (f"{self.mirror_root_dir}/.config/blocklist", "blocklist/")):
+            for entry in self.transfer_client.operation_ls(self.mirror_uuid, path=directory):
+                if entry['type'] == 'file':
+                    listing[f"{prefix}{entry['name']}"] = (entry['size'], entry['last_modified'])
+        return listing
+
     def set_holding_dir(self, holding_dir):
         """ :param holding_dir: A directory where data files exist to be uploaded to mirror """
         self.holding_dir = holding_dir
@@ -389,13 +730,13 @@ class Gatekeeper(object):
     def get_transfer_client(self):
         """Call this function to get a transfer client for the globus python sdk
 
-        :returns: A globus python sdk TransferClient object"""
+        :returns: A GlobusBackend wrapping a globus python sdk TransferClient object"""
         if self.TRANSFER_RT is not None:
-            return globus_sdk.TransferClient(authorizer=self.get_refresh_token_authorizer())
+            return GlobusBackend(globus_sdk.TransferClient(authorizer=self.get_refresh_token_authorizer()))
         elif self.CLIENT_SECRET is not None:
-            return globus_sdk.TransferClient(authorizer=self.get_client_secret_authorizer())
+            return GlobusBackend(globus_sdk.TransferClient(authorizer=self.get_client_secret_authorizer()))
         else:
-            return globus_sdk.TransferClient(authorizer=self.get_auth_with_login())
+            return GlobusBackend(globus_sdk.TransferClient(authorizer=self.get_auth_with_login()))
 
     def check_for_consent_required(self, ep_uuid=None, path=None):
         """Call this function with all endpoint uuids that you're going to use (source and destination)
@@ -419,7 +760,7 @@ class Gatekeeper(object):
                 self.consents.extend(err.info.consent_required.required_scopes)
 
     def sync_files_from_list(self, files_to_sync,
-                             source_uuid=PERSONAL_UUID, dest_uuid=None, data_type=None):
+                             source_uuid=PERSONAL_UUID, dest_uuid=None, data_type=None, label=None):
         """Will synchronize files from a one endpoint to another in the appropriate mirror
         directory structure. Emails user if it fails.
 
@@ -427,6 +768,7 @@ class Gatekeeper(object):
         :param source_uuid: UUID of endpoint that files are on. Default PERSONAL_UUID.
         :param dest_uuid: UUID of endpoint to sync files to.
         :param data_type: One of the possible data types
+        :param label: Label of the transfer task, i.e. to tell upload chunks apart. Default the function name
         :returns: Globus python sdk transfer result object or None if there were no files"""
         if len(files_to_sync) < 1:
             return None
@@ -434,15 +776,16 @@ class Gatekeeper(object):
             data_type = 'raw'
         if dest_uuid is None:
             dest_uuid = self.mirror_uuid
-        function_name = inspect.currentframe().f_code.co_name
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=function_name, sync_level="checksum",
-                                                notify_on_succeeded=False, notify_on_failed=True)
+        if label is None:
+            label = inspect.currentframe().f_code.co_name
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=label, sync_level="checksum",
+                                                           notify_on_succeeded=False, notify_on_failed=True)
         for holding_file in files_to_sync:
             dest_dir_prefix = f"{self.mirror_root_dir}/{data_type}/{holding_file[0:4]}/{holding_file[4:6]}/"
             transfer_data.add_item(f"{self.holding_dir}/{holding_file}",
                                    f"{dest_dir_prefix}/{holding_file}")
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         return transfer_result
 
@@ -459,20 +802,23 @@ class Gatekeeper(object):
         if dest_uuid is None:
             dest_uuid = self.mirror_uuid
         function_name = inspect.currentframe().f_code.co_name
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=function_name, sync_level="checksum",
-                                                notify_on_succeeded=False, notify_on_failed=True)
+        dest_dir_prefixes = {}
         for failed_file_from_list in files_to_sync:
             elements = parse_data_filename(failed_file_from_list)
             if elements is None:
-                dest_dir_prefix = f"{self.mirror_failed_dir}/"
+                dest_dir_prefixes[failed_file_from_list] = f"{self.mirror_failed_dir}/"
             else:
-                dest_dir_prefix = f"{self.mirror_failed_dir}/{elements[6]}/"
-            if not self.create_new_dir(dest_dir_prefix):
-                return None  # Failed to create directory, so we can't upload these files
+                dest_dir_prefixes[failed_file_from_list] = f"{self.mirror_failed_dir}/{elements[6]}/"
+        # Many failed files share a radar's directory, so each directory is made once, failed/ before failed/<radar>/
+        if not self.create_new_dirs(dest_dir_prefixes.values(), dest_uuid):
+            return None  # Failed to create a directory, so we can't upload these files
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=function_name, sync_level="checksum",
+                                                           notify_on_succeeded=False, notify_on_failed=True)
+        for failed_file_from_list, dest_dir_prefix in dest_dir_prefixes.items():
             transfer_data.add_item(f"{self.holding_dir}/{failed_file_from_list}",
                                    f"{dest_dir_prefix}/{failed_file_from_list}")
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         return transfer_result
 
@@ -489,13 +835,13 @@ class Gatekeeper(object):
             dest_uuid = self.mirror_uuid
         if source_path is None:
             source_path = self.working_dir
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=inspect.currentframe().f_code.co_name,
-                                                sync_level="checksum", notify_on_succeeded=False,
-                                                notify_on_failed=True)
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True)
         transfer_data.add_item(f"{source_path}master.hashes",
                                f"{self.mirror_root_dir}/.config/master.hashes")
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         return transfer_result
 
@@ -519,15 +865,65 @@ class Gatekeeper(object):
             source_path = self.working_dir
         dest_path = f"{self.mirror_root_dir}/{data_type}/{int(year):04d}/{int(month):02d}/{int(year):04d}{int(month):02d}.hashes"
         source_path += f"{int(year):04d}{int(month):02d}.hashes"
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=inspect.currentframe().f_code.co_name,
-                                                sync_level="checksum", notify_on_succeeded=False,
-                                                notify_on_failed=True)
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True)
         transfer_data.add_item(source_path, dest_path)
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
+        self.last_transfer_result = transfer_result
+        return transfer_result
+
+    def put_hashes_months(self, year_months, data_type="raw", source_path=None, source_uuid=PERSONAL_UUID,
+                          dest_uuid=None):
+        """
+        Sync the hashes files for several months to the mirror directory structure in a single transfer task.
+        Emails user if it fails.
+
+        :param year_months: List of (year, month) tuples of the hashes files to upload
+        :param data_type: Default 'raw'. Which data type are we working with? typically dat or raw
+        :param source_path: Where are the hashes files to upload? Defaults to working dir
+        :param source_uuid: UUID of endpoint that the files are on. Default PERSONAL_UUID.
+        :param dest_uuid: UUID of endpoint to sync the files to. Default self.mirror_uuid.
+        :return: Globus python sdk transfer result object, or None if no months were given
+        """
+        if len(year_months) == 0:
+            return None
+        if dest_uuid is None:
+            dest_uuid = self.mirror_uuid
+        if source_path is None:
+            source_path = self.working_dir
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True)
+        for year, month in year_months:
+            transfer_data.add_item(f"{source_path}{int(year):04d}{int(month):02d}.hashes",
+                                   self.get_hash_file_path(year, month, data_type))
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         return transfer_result
 
+    def append_hashes(self, year, month, new_hashes, data_type="raw", source_path=None):
+        """
+        Add new (hash, filename) entries to a yyyymm.hashes file in the working dir (or source_path) and upload it
+        to the mirror. Files already in the hashes file with the same hash aren't added again.
+
+        :param year: Year of hash file to update
+        :param month: Month of hash file to update
+        :param new_hashes: List of (hash, filename) tuples
+        :param data_type: Default 'raw'. Which data type are we working with? typically dat or raw
+        :param source_path: Where is the hashes file to update? Defaults to working dir
+        :return: Globus python sdk transfer result object of the upload
+        """
+        if source_path is None:
+            source_path = self.working_dir
+        hashfile_path = f"{source_path}/{int(year):04d}{int(month):02d}.hashes"
+        hashes_file = HashesFile.load(hashfile_path)
+        hashes_file.merge(new_hashes)
+        hashes_file.save(hashfile_path)
+        return self.put_hashes(year, month, data_type=data_type, source_path=source_path)
+
     def ls(self, ep_uuid, path=None):
         """
         Convenience function to print directory contents with typical outputs (permissions, user,
@@ -583,12 +979,43 @@ class Gatekeeper(object):
         source_path = f"{self.mirror_root_dir}/{data_type}/{int(year):04d}/{int(month):02d}/{int(year):04d}{int(month):02d}.hashes"
         dest_path += f"{int(year):04d}{int(month):02d}.hashes"
         deadline_1min = str(datetime.now() + timedelta(minutes=1))
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=inspect.currentframe().f_code.co_name,
-                                                sync_level="checksum", notify_on_succeeded=False,
-                                                notify_on_failed=True, deadline=deadline_1min)
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True, deadline=deadline_1min)
         transfer_data.add_item(source_path, dest_path)
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
+        self.last_transfer_result = transfer_result
+        return transfer_result
+
+    def get_hashes_months(self, year_months, data_type="raw", dest_path=None, source_uuid=None,
+                          dest_uuid=PERSONAL_UUID):
+        """Retrieve the hashes files for several months from an endpoint in a single transfer task.
+        Emails user if it fails.
+
+        :param year_months: List of (year, month) tuples of the hashes files you wish to retrieve
+        :param data_type: Data type of the hashes files you wish to retrieve
+        :param dest_path: Destination path you want the hashes files to be synched to
+        :param source_uuid: UUID of endpoint that contains the hashes files
+        :param dest_uuid: UUID of endpoint to transfer hashes files to
+        :return: Globus python sdk transfer result object, or None if no months were given
+        """
+        if len(year_months) == 0:
+            return None
+        if source_uuid is None:
+            source_uuid = self.mirror_uuid
+        if dest_path is None:
+            dest_path = self.working_dir
+        # Same deadline as get_hashes() for one file, plus a minute for every 10 more files
+        deadline = str(datetime.now() + timedelta(minutes=1 + len(year_months) // 10))
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True, deadline=deadline)
+        for year, month in year_months:
+            transfer_data.add_item(self.get_hash_file_path(year, month, data_type),
+                                   f"{dest_path}{int(year):04d}{int(month):02d}.hashes")
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         return transfer_result
 
@@ -606,50 +1033,237 @@ class Gatekeeper(object):
             source_uuid = self.mirror_uuid
         if dest_path is None:
             dest_path = self.working_dir
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=inspect.currentframe().f_code.co_name,
-                                                sync_level="checksum", notify_on_succeeded=False,
-                                                notify_on_failed=True)
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True)
         transfer_data.add_item(f"{self.mirror_root_dir}/.config/master.hashes",
                                f"{dest_path}master.hashes")
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         return transfer_result
 
+    def read_master_hashes(self, master_hashes_path=None):
+        """ Read a master.hashes file
+
+        :param master_hashes_path: Path to the master.hashes file. Defaults to master.hashes in the working dir
+        :return: Dictionary of hashes file (of the form ./raw/yyyymm.hashes): sha1sum hash of the hashes file
+        """
+        if master_hashes_path is None:
+            master_hashes_path = f"{self.working_dir}/master.hashes"
+        hashes = {}
+        with open(master_hashes_path, 'r') as master_file:
+            for line in master_file:
+                if line.strip() == '':
+                    continue
+                (val, key) = line.split()
+                hashes[key] = val
+        return hashes
+
+    def refresh_local_hashes(self, local_dir=LOCAL_HASHES_DIR, data_types=None, recent_months=2,
+                             source_uuid=None, dest_uuid=PERSONAL_UUID):
+        """ Bring the local copy of the mirror's hashes files up to date. Gets master.hashes from the
+        mirror, and only transfers the yyyymm.hashes files whose sha1sum differs from master.hashes
+        (or that aren't in the local copy yet). The most recent months of raw data are always
+        transferred, since they can change before master.hashes is updated.
+
+        :param local_dir: Directory holding the local copy, as <data_type>/yyyymm.hashes. Defaults to
+        LOCAL_HASHES_DIR. Must be reachable by dest_uuid
+        :param data_types: Data types to refresh. Defaults to all possible data types
+        :param recent_months: Number of months (counting the current month) of raw hashes files to
+        always transfer. Default 2
+        :param source_uuid: UUID of the endpoint to get the hashes files from. Default self.mirror_uuid
+        :param dest_uuid: UUID of the endpoint local_dir is on. Default PERSONAL_UUID
+        :return: List of the hashes files that were transferred, of the form ./raw/yyyymm.hashes
+        """
+        if source_uuid is None:
+            source_uuid = self.mirror_uuid
+        if data_types is None:
+            data_types = self.get_possible_data_types()
+        local_dir = f"{local_dir.rstrip('/')}/"
+        for data_type in data_types:
+            makedirs(f"{local_dir}{data_type}", exist_ok=True)
+
+        self.get_master_hashes(dest_path=local_dir, source_uuid=source_uuid, dest_uuid=dest_uuid)
+        while not self.wait_for_last_task(timeout_s=600):
+            self.logger.info("Still waiting for master hashes...")
+        master_hashes = self.read_master_hashes(f"{local_dir}master.hashes")
+
+        # Months that are still being added to
+        recent = {f"./raw/{ym}.hashes" for ym in self.recent_year_months(recent_months)}
+
+        # Hashes files that aren't in master.hashes (and aren't recent) are gone from the mirror
+        for data_type in data_types:
+            for hashes_file in fnmatch.filter(listdir(f"{local_dir}{data_type}"), "*.hashes"):
+                key = f"./{data_type}/{hashes_file}"
+                if key not in master_hashes and key not in recent:
+                    self.logger.info(f"Removing {key} from {local_dir}, it isn't in master.hashes")
+                    remove(f"{local_dir}{data_type}/{hashes_file}")
+
+        stale = {data_type: [] for data_type in data_types}
+        for key in sorted(set(master_hashes) | recent):
+            _, data_type, filename = key.split('/')
+            if data_type not in data_types:
+                continue
+            local_path = f"{local_dir}{data_type}/{filename}"
+            if key in recent and key not in master_hashes and not self.file_exists(
+                    self.get_hash_file_path(filename[0:4], filename[4:6], data_type), source_uuid, "name:~*.hashes"):
+                continue  # No data for this month yet
+            if key in recent or not isfile(local_path) or \
+                    file_digests(local_path)['sha1'] != master_hashes.get(key):
+                stale[data_type].append((int(filename[0:4]), int(filename[4:6])))
+
+        transferred = []
+        for data_type, year_months in stale.items():
+            if len(year_months) == 0:
+                continue
+            self.logger.info(f"Refreshing {len(year_months)} {data_type} hashes files in {local_dir}")
+            self.get_hashes_months(year_months, data_type, f"{local_dir}{data_type}/", source_uuid, dest_uuid)
+            while not self.wait_for_last_task(timeout_s=600):
+                self.logger.info("Still waiting for hashes files...")
+            for year, month in year_months:
+                key = f"./{data_type}/{year:04d}{month:02d}.hashes"
+                transferred.append(key)
+                local_path = f"{local_dir}{data_type}/{year:04d}{month:02d}.hashes"
+                if key in master_hashes and file_digests(local_path)['sha1'] != master_hashes[key]:
+                    self.logger.warning(f"{key} on the mirror doesn't match master.hashes")
+        self.update_mirror_filter(local_dir)
+        open(f"{local_dir}{LOCAL_HASHES_STAMP}", 'w').close()
+        return transferred
+
+    def local_hashes_refresh_due(self, refresh_h, local_dir=LOCAL_HASHES_DIR):
+        """ :param refresh_h: Hours between refreshes of the local copy of the mirror's hashes files
+        :param local_dir: Directory holding the local copy. Defaults to LOCAL_HASHES_DIR
+        :return: True if the local copy was never refreshed, or not within the last refresh_h hours """
+        stamp = f"{local_dir.rstrip('/')}/{LOCAL_HASHES_STAMP}"
+        return not isfile(stamp) or time.time() - stat(stamp).st_mtime >= refresh_h * 3600
+
+    def prune_local_hashes(self, local_dir=LOCAL_HASHES_DIR, data_types=None, source_uuid=None):
+        """ Remove the hashes files in the local copy of the mirror's hashes files that are no longer on the mirror
+
+        :param local_dir: Directory holding the local copy, as <data_type>/yyyymm.hashes. Defaults to
+        LOCAL_HASHES_DIR
+        :param data_types: Data types to prune. Defaults to all possible data types
+        :param source_uuid: UUID of the endpoint the hashes files are copied from. Default self.mirror_uuid
+        :return: List of the hashes files that were removed, of the form ./raw/yyyymm.hashes
+        """
+        if source_uuid is None:
+            source_uuid = self.mirror_uuid
+        if data_types is None:
+            data_types = self.get_possible_data_types()
+        local_dir = f"{local_dir.rstrip('/')}/"
+
+        removed = []
+        for data_type in data_types:
+            if not isdir(f"{local_dir}{data_type}"):
+                continue
+            for hashes_file in sorted(fnmatch.filter(listdir(f"{local_dir}{data_type}"), "*.hashes")):
+                year, month = hashes_file[0:4], hashes_file[4:6]
+                # One listing per year finds the months that exist, as in get_hashes_range()
+                month_dirs = self.list_directory(f"{self.mirror_root_dir}/{data_type}/{year}", source_uuid)
+                if month_dirs is not None and month in month_dirs and self.file_exists(
+                        self.get_hash_file_path(year, month, data_type), source_uuid, "name:~*.hashes"):
+                    continue
+                remove(f"{local_dir}{data_type}/{hashes_file}")
+                removed.append(f"./{data_type}/{hashes_file}")
+        if len(removed) > 0:
+            self.logger.info(f"Removed {len(removed)} local hashes files that aren't on the mirror: {removed}")
+        return removed
+
+    def recent_year_months(self, recent_months=2):
+        """ :param recent_months: Number of months, counting the current month. Default 2
+        :return: List of the most recent months as yyyymm strings, newest first """
+        year_months = []
+        year, month = self.cur_year, self.cur_month
+        for _ in range(recent_months):
+            year_months.append(f"{year:04d}{month:02d}")
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        return year_months
+
+    def update_mirror_filter(self, local_dir=LOCAL_HASHES_DIR):
+        """ Rebuild the mirror filter (see tools/mirror_filter.py) for the hashes files in the local copy that
+        changed since it was last updated
+
+        :param local_dir: Directory holding the local copy of the hashes files. Defaults to LOCAL_HASHES_DIR
+        :return: The updated MirrorFilter """
+        mirror_filter = MirrorFilter.load(local_dir)
+        rebuilt_months = mirror_filter.update()
+        if len(rebuilt_months) > 0:
+            mirror_filter.save()
+            self.logger.info(f"Mirror filter rebuilt for {len(rebuilt_months)} months: {rebuilt_months}")
+        return mirror_filter
+
+    def copy_local_hashes(self, year_months, dest_path, master_hashes, data_type="raw", local_dir=LOCAL_HASHES_DIR,
+                          recent_months=2):
+        """ Copy yyyymm.hashes files from the local copy of the mirror's hashes files rather than
+        transferring them, for the months whose local copy matches master.hashes. The most recent
+        months are never copied, since they can change on the mirror before master.hashes is updated.
+
+        :param year_months: List of yyyymm strings
+        :param dest_path: Directory to copy the hashes files to
+        :param master_hashes: Dictionary from read_master_hashes() of the current master.hashes
+        :param data_type: Data type of the hashes files. Default raw
+        :param local_dir: Directory holding the local copy. Defaults to LOCAL_HASHES_DIR
+        :param recent_months: Number of months (counting the current month) to never copy. Default 2
+        :return: List of the yyyymm that were copied """
+        recent = self.recent_year_months(recent_months)
+        copied = []
+        for ym in year_months:
+            local_path = f"{local_dir.rstrip('/')}/{data_type}/{ym}.hashes"
+            if ym in recent or not isfile(local_path):
+                continue
+            if file_digests(local_path)['sha1'] == master_hashes.get(f"./{data_type}/{ym}.hashes"):
+                shutil.copyfile(local_path, f"{dest_path.rstrip('/')}/{ym}.hashes")
+                copied.append(ym)
+        return copied
+
     def update_master_hashes(self, source_path=None, source_uuid=PERSONAL_UUID,
-                             dest_uuid=None):
-        """ Update the master.hashes file. Emails user if it fails
+                             dest_uuid=None, local_dir=LOCAL_HASHES_DIR, incremental=False):
+        """ Rebuild the master.hashes file from every hashes file on the mirror. Emails user if it fails
 
         :param source_uuid: UUID of endpoint that will generate the master.hashes file
         :param dest_uuid: UUID of endpoint to transfer updated master.hashes file to
         :param source_path: Source path on the source endpoint where master.hashes file will be
         synced from. Defaults to working directory.
+        :param local_dir: Local copy of the hashes files to hash. Defaults to LOCAL_HASHES_DIR
+        :param incremental: If True, only get the hashes files that changed according to the current
+        master.hashes (see refresh_local_hashes()), which trusts the current master.hashes rather than
+        repairing it. Default False, get every hashes file from the mirror
         :return: Globus python sdk transfer result object """
         if dest_uuid is None:
             dest_uuid = self.mirror_uuid
         if source_path is None:
             source_path = self.working_dir
+        local_dir = f"{local_dir.rstrip('/')}/"
 
-        # Clear the master hashes file for recalculation
+        if incremental:
+            self.refresh_local_hashes(local_dir, dest_uuid=source_uuid)
+        else:
+            # Hashes files that are gone from the mirror mustn't be folded into the rebuilt master.hashes. The
+            # listings made here are reused by get_hashes_all()
+            self.prune_local_hashes(local_dir, source_uuid=dest_uuid)
+            for data_type in self.get_possible_data_types():
+                data_type_path = f"{local_dir}{data_type}/"
+                makedirs(data_type_path, exist_ok=True)
+                if self.get_hashes_all(data_type=data_type, dest_path=data_type_path, source_uuid=dest_uuid,
+                                       dest_uuid=source_uuid) is None:
+                    continue
+                while not self.wait_for_last_task(timeout_s=600):
+                    self.logger.info("Still waiting for last task...")
+                if not self.last_task_succeeded():
+                    sub = f"Getting the {data_type} hashes files to rebuild master.hashes failed. Exiting."
+                    self.log_email_exit(self.logger.error, 1, 1, sub=sub)
+            self.update_mirror_filter(local_dir)
+            open(f"{local_dir}{LOCAL_HASHES_STAMP}", 'w').close()
+
+        # Recalculate the master hashes file, with lines of the form "<hash>  ./raw/yyyymm.hashes"
         master_hashes_file_path = f"{source_path}/master.hashes"
-        open(master_hashes_file_path, 'w').close()
-        for data_type in self.get_possible_data_types():
-            data_type_path = f"{source_path}/{data_type}/"
-            try:
-                mkdir(data_type_path)
-            except OSError as error:
-                self.logger.warning(f"update_master_hashes() error. Failed to make directory {data_type_path}: {error}")
-            self.get_hashes_all(data_type=data_type,
-                                dest_path=data_type_path)
-            while not self.wait_for_last_task(timeout_s=600):
-                self.logger.info("Still waiting for last task...")
-            hash_process = subprocess.Popen(f"cd {self.get_working_dir()}; sha1sum ./{data_type}/*hashes",
-                                            shell=True, stdout=subprocess.PIPE,
-                                            stderr=subprocess.PIPE)
-            hash_process_out, hash_process_err = hash_process.communicate()
-            hash_process_output = hash_process_out.decode().split("\n")
-            with open(master_hashes_file_path, 'a+') as master_hash_file:
-                master_hash_file.write('\n'.join(hash_process_output))
+        with open(master_hashes_file_path, 'w') as master_hash_file:
+            for data_type in self.get_possible_data_types():
+                for hashes_file in sorted(listdir(f"{local_dir}{data_type}")):
+                    if fnmatch.fnmatch(hashes_file, "*.hashes"):
+                        data_hash = file_digests(f"{local_dir}{data_type}/{hashes_file}")['sha1']
+                        master_hash_file.write(f"{data_hash}  ./{data_type}/{hashes_file}\n")
         return self.put_master_hashes(source_path, source_uuid, dest_uuid)
 
     def print_last_tasks(self):
@@ -684,10 +1298,10 @@ class Gatekeeper(object):
         if dest_path is None:
             dest_path = self.working_dir
 
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=inspect.currentframe().f_code.co_name,
-                                                sync_level="checksum", notify_on_succeeded=False,
-                                                notify_on_failed=True)
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True)
         month_year_iter = month_year_iterator(start_month, start_year, end_month + 1, end_year)
         at_least_one_file = False
         for year_month in month_year_iter:
@@ -696,11 +1310,16 @@ class Gatekeeper(object):
             source_path = f"{self.mirror_root_dir}/{data_type}/{int(year):04d}/{int(month):02d}/{int(year):04d}{int(month):02d}.hashes"
             final_dest_path = f"{dest_path}{int(year):04d}{int(month):02d}.hashes"
 
-            if self.check_for_file_existence(source_path):
+            # One listing per year finds the months that exist, then only the hashes files are listed for each month
+            month_dirs = self.list_directory(f"{self.mirror_root_dir}/{data_type}/{int(year):04d}",
+                                             source_uuid)
+            if month_dirs is None or f"{int(month):02d}" not in month_dirs:
+                continue
+            if self.file_exists(source_path, source_uuid, name_filter="name:~*.hashes"):
                 at_least_one_file = True
                 transfer_data.add_item(source_path, final_dest_path)
         if at_least_one_file:
-            transfer_result = self.transfer_client.submit_transfer(transfer_data)
+            transfer_result = self.submit_transfer(transfer_data)
             self.last_transfer_result = transfer_result
             self.logger.info(f"Getting at least one file. Transfer result: {transfer_result}")
             return transfer_result
@@ -760,12 +1379,12 @@ class Gatekeeper(object):
         if dest_path is None:
             dest_path = self.working_dir
         dest_path += "/all_failed.txt"
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=inspect.currentframe().f_code.co_name,
-                                                sync_level="checksum", notify_on_succeeded=False,
-                                                notify_on_failed=True)
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True)
         transfer_data.add_item(f"{self.mirror_root_dir}/.config/all_failed.txt", dest_path)
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         return transfer_result
 
@@ -807,18 +1426,18 @@ class Gatekeeper(object):
                     else:
                         file_of_failed_updates.write(
                             f"{add_failed_files[filename_key][0]}  {filename_key} | {add_failed_files[filename_key][1]}\n")
-                # Now upload the file to mirror
-                transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid,
-                                                        dest_uuid,
-                                                        label=inspect.currentframe().f_code.co_name,
-                                                        sync_level="checksum",
-                                                        notify_on_succeeded=False,
-                                                        notify_on_failed=True)
-                transfer_data.add_item(f"{self.get_working_dir()}/all_failed.txt",
-                                       f"{self.mirror_root_dir}/.config/all_failed.txt")
-                transfer_result = self.transfer_client.submit_transfer(transfer_data)
-                self.last_transfer_result = transfer_result
-                return transfer_result
+            # Now upload the file to mirror, once it is closed so the new lines have been written
+            transfer_data = self.transfer_client.transfer_data(source_uuid,
+                                                               dest_uuid,
+                                                               label=inspect.currentframe().f_code.co_name,
+                                                               sync_level="checksum",
+                                                               notify_on_succeeded=False,
+                                                               notify_on_failed=True)
+            transfer_data.add_item(f"{self.get_working_dir()}/all_failed.txt",
+                                   f"{self.mirror_root_dir}/.config/all_failed.txt")
+            transfer_result = self.submit_transfer(transfer_data)
+            self.last_transfer_result = transfer_result
+            return transfer_result
         else:
             # If we don't have a failed files list, that's an error
             raise FileNotFoundError("Error: No failed files list from mirror, cannot update.")
@@ -838,28 +1457,50 @@ class Gatekeeper(object):
             source_uuid = self.mirror_uuid
         if dest_path is None:
             dest_path = self.working_dir
-        transfer_data = globus_sdk.TransferData(self.transfer_client, source_uuid, dest_uuid,
-                                                label=inspect.currentframe().f_code.co_name,
-                                                sync_level="checksum", notify_on_succeeded=False,
-                                                notify_on_failed=True)
+        transfer_data = self.transfer_client.transfer_data(source_uuid, dest_uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True)
         transfer_data.add_item(f"{self.mirror_root_dir}/.config/blocklist",
                                dest_path, recursive=True)
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         return transfer_result
 
-    def wait_for_last_task(self, timeout_s=60, poll_s=15):
-        """ Wait for the last transfer task to complete, given a timeout and poll time in seconds.
+    def wait_for_last_task(self, timeout_s=60):
+        """ Wait for the last transfer task to complete, given a timeout in seconds. The task is
+        polled after a fraction of a second, then less and less often (see tools/task_tracker.py).
 
         :param timeout_s: How long to wait before timing out, in seconds. Doesn't cancel the task
-        :param poll_s: Wait this long between polling the task to determine if it's done, in seconds
         :return: True if the task completed within the timeout, False otherwise
         """
         if self.last_transfer_result is None:
             self.logger.info("Error. No last transfer, returning.")
             return
-        task_id = self.last_transfer_result["task_id"]
-        return self.transfer_client.task_wait(task_id, timeout=timeout_s, polling_interval=poll_s)
+        return self.wait_for_tasks([self.last_transfer_result], timeout_s)
+
+    def wait_for_tasks(self, results, timeout_s=60, return_when=ALL_COMPLETED):
+        """ Wait for several transfer or delete tasks to complete at once, given a timeout in seconds.
+
+        :param results: Transfer result objects (returned by submit_transfer(), get_master_hashes(),
+        etc.) of the tasks, or their futures from task_future()
+        :param timeout_s: How long to wait before timing out, in seconds. Doesn't cancel the tasks
+        :param return_when: ALL_COMPLETED (default), or FIRST_COMPLETED to stop waiting once any task completes
+        :return: True if every task (or with FIRST_COMPLETED, any task) completed within the timeout, False otherwise
+        """
+        futures = [result if isinstance(result, Future) else self.task_future(result) for result in results]
+        wait_start = time.monotonic()
+        completed = self.task_tracker.wait(futures, timeout_s, return_when)
+        self.task_wait_s += time.monotonic() - wait_start
+        # Listings made while the tasks were running may be missing what they wrote
+        self.invalidate_listings()
+        return completed
+
+    def task_future(self, result):
+        """ :param result: Transfer result object of a submitted task
+        :return: concurrent.futures.Future resolved with the task's description (with its 'status')
+        once it completes. Callbacks can be added with add_done_callback() """
+        return self.task_tracker.track(result['task_id'])
 
     def list_of_files_to_upload(self):
         """ Gets a python list of data files to upload to the mirror. Uses the holding directory
@@ -873,6 +1514,101 @@ class Gatekeeper(object):
                 files.append(holding_file)
         return files
 
+    def submit_transfer(self, transfer_data):
+        """ Submit a transfer task and forget cached directory listings, since they may be changed by the task
+
+        :param transfer_data: Transfer task from self.transfer_client.transfer_data()
+        :return: Globus python sdk transfer result object
+        """
+        self.invalidate_listings()
+        result = self.transfer_client.submit_transfer(transfer_data)
+        self.task_tracker.track(result['task_id'], transfer_data.get('label'))
+        return result
+
+    def submit_delete(self, delete_data):
+        """ Submit a delete task and forget cached directory listings, since they may be changed by the task
+
+        :param delete_data: Delete task from self.transfer_client.delete_data()
+        :return: Globus python sdk delete result object
+        """
+        self.invalidate_listings()
+        result = self.transfer_client.submit_delete(delete_data)
+        self.task_tracker.track(result['task_id'], delete_data.get('label'))
+        return result
+
+    def invalidate_listings(self):
+        """ Forget all cached directory listings. Call after anything is written to an endpoint """
+        self.listing_cache.clear()
+
+    def list_directory(self, directory, uuid=None, name_filter=None):
+        """ Get the names of the files and directories in a directory on an endpoint. The listing is
+        cached until something is written to an endpoint, so each directory is listed only once per run.
+
+        :param directory: Path to the directory on the endpoint
+        :param uuid: UUID of the endpoint. Default self.mirror_uuid
+        :param name_filter: Globus ls filter, i.e. "name:~*.hashes" to only list the hashes files.
+        Listings with different filters are cached separately
+        :return: Set of names in the directory, or None if the directory doesn't exist (or can't be accessed)
+        """
+        if uuid is None:
+            uuid = self.mirror_uuid
+        directory = directory.rstrip('/') or '/'
+        key = (uuid, directory, name_filter)
+        if key in self.listing_cache:
+            return self.listing_cache[key]
+
+        maximum_retries = 5
+        retries = 0
+        errormsg = ''
+        while retries < maximum_retries:
+            try:
+                if name_filter is None:
+                    response = self.transfer_client.operation_ls(uuid, path=directory)
+                else:
+                    response = self.transfer_client.operation_ls(uuid, path=directory, filter=name_filter)
+                self.listing_cache[key] = frozenset(entry['name'] for entry in response)
+                return self.listing_cache[key]
+            except TRANSFER_API_ERRORS as err:
+                if err.http_status == 404:
+                    self.logger.warning(f"Directory {directory} does not exist.")
+                    self.listing_cache[key] = None
+                    return None
+                elif err.http_status == 403:
+                    self.logger.error(f"{directory} access permission denied by endpoint.")
+                    self.listing_cache[key] = None
+                    return None
+                else:
+                    # Not sure what this means so retry, then fail hard.
+                    errormsg = str(err)
+                    time.sleep(5)
+                    retries += 1
+            except TRANSFER_NETWORK_ERRORS as err:
+                errormsg = str(err)
+                time.sleep(5)
+                retries += 1
+        msg = f"Listing directory {directory} failed after {retries} retries. Exiting!\n{errormsg}"
+        sub = "Directory listing failed"
+        self.log_email_exit(self.logger.error, 1, 1, msg=msg, sub=sub)
+
+    def file_exists(self, file_path, uuid=None, name_filter=None):
+        """ Check to see if a file or directory exists on an endpoint, using the cached listing of its
+        parent directory. Cheaper than check_for_file_existence() when checking many files in the
+        same directories.
+
+        :param file_path: Path to the file or directory you wish to test existence of
+        :param uuid: UUID of endpoint you want to test for file existence on. Default self.mirror_uuid
+        :param name_filter: Globus ls filter used to list the parent directory. See list_directory()
+        :return: True if the file or directory exists, False otherwise.
+        """
+        file_path = file_path.rstrip('/')
+        directory, _, name = file_path.rpartition('/')
+        listing = self.list_directory(directory or '/', uuid, name_filter)
+        if listing is not None and name in listing:
+            self.logger.info(f"{file_path} exists.")
+            return True
+        self.logger.warning(f"{file_path} does not exist.")
+        return False
+
     def check_for_file_existence(self, file_path, uuid=None):
         """ Check to see if a file exists or not on an endpoint given by UUID.
         *NOTE* The developers of the Globus python sdk have indicated they will be implementing
@@ -897,7 +1633,7 @@ class Gatekeeper(object):
                 else:
                     self.logger.info(f"Directory {file_path} exists.")
                     return True
-            except globus_sdk.TransferAPIError as err:
+            except TRANSFER_API_ERRORS as err:
                 if err.http_status == 404:
                     self.logger.warning(f"{file_path} does not exist.")
                     return False
@@ -909,7 +1645,7 @@ class Gatekeeper(object):
                     errormsg = str(err)
                     time.sleep(5)
                     retries += 1
-            except globus_sdk.NetworkError as err:
+            except TRANSFER_NETWORK_ERRORS as err:
                 # Not good, can't make assumptions about whether the file or directory exists
                 # Retry a few times, then fail hard.
                 errormsg = str(err)
@@ -921,15 +1657,17 @@ class Gatekeeper(object):
         sub = "Check for file existence failed"
         self.log_email_exit(self.logger.error, 1, 1, msg=msg, sub=sub)
 
-    def get_task_successful_transfers(self):
+    def get_task_successful_transfers(self, result=None):
         """ Get the last transfer's successfully transferred files list. Will not contain files
         that were skipped due to checksums matching. Need to use the paginated version of the
         call, or if we have over 100 file transfers it will only return the first 100.
 
+        :param result: Transfer result object of the transfer to use instead of the last one
         :return: Python list of files that were successfully transferred during the last transfer
         """
-        return self.transfer_client.paginated.task_successful_transfers(
-            self.last_transfer_result['task_id']).items()
+        if result is None:
+            result = self.last_transfer_result
+        return self.transfer_client.task_successful_transfers(result['task_id'])
 
     def get_hash_file_path(self, year, month, data_type="raw"):
         """ Retrieve the correct path string to the hashes file for the given year and month
@@ -950,15 +1688,40 @@ class Gatekeeper(object):
         """
         if uuid is None:
             uuid = self.mirror_uuid
+        key = (uuid, normpath(path))
+        if key in self.created_dirs:
+            return True
         try:
+            self.invalidate_listings()
             self.transfer_client.operation_mkdir(uuid, path)
-        except globus_sdk.GlobusAPIError as error:
+        except TRANSFER_API_ERRORS as error:
             if error.http_status == 502:
                 # This means that the directory already exists
                 self.logger.info(f"Directory {path} already existed.")
             else:
                 self.logger.error(f"Failed to create {path} directory.")
                 return False
+        self.created_dirs.add(key)
+        return True
+
+    def create_new_dirs(self, paths, uuid=None):
+        """ Create several directories on an endpoint given by UUID, each distinct directory once. They're made one at a
+        time, from the calling thread like every other use of the transfer client, and parents before the directories
+        inside them
+
+        :param paths: Iterable of paths of directories to create, which may repeat
+        :param uuid: UUID of the endpoint to create the directories on
+        :returns: True if all the directories existed or were successfully created. False otherwise
+        """
+        if uuid is None:
+            uuid = self.mirror_uuid
+        new_paths = {}
+        for path in paths:
+            if (uuid, normpath(path)) not in self.created_dirs:
+                new_paths.setdefault(normpath(path), path)
+        for path in sorted(new_paths, key=lambda path: (path.count('/'), path)):
+            if not self.create_new_dir(new_paths[path], uuid):
+                return False
         return True
 
     def create_new_data_dir(self, year, month, data_type="raw", uuid=None):
@@ -974,25 +1737,7 @@ class Gatekeeper(object):
             uuid = self.mirror_uuid
         year_path = f"{self.mirror_root_dir}/{data_type}/{int(year):04d}/"
         month_path = f"{year_path}/{int(month):02d}"
-        try:
-            self.transfer_client.operation_mkdir(uuid, year_path)
-        except globus_sdk.GlobusAPIError as error:
-            if error.http_status == 502:
-                # This means that the directory already exists
-                self.logger.info(f"Directory {year_path} already existed.")
-            else:
-                self.logger.error(f"Failed to create {year_path} directory.")
-                return False
-        try:
-            self.transfer_client.operation_mkdir(uuid, month_path)
-        except globus_sdk.GlobusAPIError as error:
-            if error.http_status == 502:
-                # This means the directory already exists
-                self.logger.info(f"Directory {month_path} already existed.")
-            else:
-                self.logger.error(f"Failed to create {month_path} directory.")
-                return False
-        return True
+        return self.create_new_dir(year_path, uuid) and self.create_new_dir(month_path, uuid)
 
     def get_superdarn_mirror_uuid(self):
         """ Will search endpoints and retrieve the UUID of the SuperDARN mirror endpoint.
@@ -1006,15 +1751,20 @@ class Gatekeeper(object):
         sub = "Mirror endpoint not found"
         self.log_email_exit(self.logger.error, 1, 1, sub=sub)
 
-    def get_num_files_skipped(self):
-        """ :returns: The number of files that were skipped as a result of checksums matching
+    def get_num_files_skipped(self, result=None):
+        """ :param result: Transfer result object of the transfer to use instead of the last one
+        :returns: The number of files that were skipped as a result of checksums matching
         during the last transfer."""
-        return self.transfer_client.get_task(self.last_transfer_result['task_id'])['files_skipped']
+        if result is None:
+            result = self.last_transfer_result
+        return self.transfer_client.get_task(result['task_id'])['files_skipped']
 
-    def last_task_succeeded(self):
-        """ :returns: True if the last transfer task was successful, otherwise False """
-        task = self.last_transfer_result['task_id']
-        return 'SUCCEEDED' in self.transfer_client.get_task(task)['status']
+    def last_task_succeeded(self, result=None):
+        """ :param result: Transfer result object of the task to check instead of the last one
+        :returns: True if the last transfer task was successful, otherwise False """
+        if result is None:
+            result = self.last_transfer_result
+        return 'SUCCEEDED' in self.transfer_client.get_task(result['task_id'])['status']
 
     def move_files_on_endpoint(self, files_to_move, destination_directory,
                                uuid=None, data_type='raw'):
@@ -1028,38 +1778,39 @@ class Gatekeeper(object):
         if uuid is None:
             uuid = self.mirror_uuid
         try:
+            self.invalidate_listings()
             self.transfer_client.operation_mkdir(uuid, destination_directory)
-        except globus_sdk.GlobusAPIError as error:
+        except TRANSFER_API_ERRORS as error:
             if error.http_status == 502:
                 # This means that the directory already exists
                 pass
             else:
                 sub = f"Failed to create {destination_directory}"
                 self.log_email_exit(self.logger.error, 1, 1, sub=sub)
-        transfer_data = globus_sdk.TransferData(self.transfer_client, uuid, uuid,
-                                                label=inspect.currentframe().f_code.co_name,
-                                                sync_level="checksum", notify_on_succeeded=False,
-                                                notify_on_failed=True)
+        transfer_data = self.transfer_client.transfer_data(uuid, uuid,
+                                                           label=inspect.currentframe().f_code.co_name,
+                                                           sync_level="checksum", notify_on_succeeded=False,
+                                                           notify_on_failed=True)
         for file_to_move in files_to_move:
             transfer_data.add_item("{}/{}/{}/{}/{}".format(self.mirror_root_dir, data_type,
                                                            file_to_move[0:4], file_to_move[4:6],
                                                            file_to_move.strip('\n')),
                                    "{}/{}".format(destination_directory, file_to_move.strip('\n')))
-        transfer_result = self.transfer_client.submit_transfer(transfer_data)
+        transfer_result = self.submit_transfer(transfer_data)
         self.last_transfer_result = transfer_result
         if not self.wait_for_last_task(timeout_s=60 * len(files_to_move)):
             sub = "Copy failed before removing from origin"
             self.log_email_exit(self.logger.error, 1, 1, sub=sub)
         # Now that all the files are copied, remove them from origin
-        delete_data = globus_sdk.DeleteData(self.transfer_client, uuid,
-                                            label=inspect.currentframe().f_code.co_name,
-                                            notify_on_succeeded=False,
-                                            notify_on_failed=True)
+        delete_data = self.transfer_client.delete_data(uuid,
+                                                       label=inspect.currentframe().f_code.co_name,
+                                                       notify_on_succeeded=False,
+                                                       notify_on_failed=True)
         for file_to_move in files_to_move:
             delete_data.add_item("{}/{}/{}/{}/{}".format(self.mirror_root_dir, data_type,
                                                          file_to_move[0:4], file_to_move[4:6],
                                                          file_to_move.strip('\n')))
-        delete_result = self.transfer_client.submit_delete(delete_data)
+        delete_result = self.submit_delete(delete_data)
         self.last_transfer_result = delete_result
         while not self.wait_for_last_task(timeout_s=30 * len(files_to_move)):
             self.logger.info("Still waiting to delete files from origin.")
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Persistent cache of file hashes shared by the mirror scripts.
+
+Files that stay in a holding directory between runs (failed a step, timed out, skipped) are otherwise rehashed on every
+run of gatekeeper_globus.py and download_vt_data. The cache is a SQLite database that stores digests per
+(device, inode, size, mtime_ns), so a cached digest is only returned for a file that hasn't changed since it was
+hashed. Keying on the inode means the entry follows a file when it is moved within a filesystem, i.e. from
+holding/sas/ to holding/globus/. An entry is replaced as soon as its file's size or modification time changes.
+
+A fraction of cache hits can be re-verified by hashing the file anyway (verify_fraction), to catch files that were
+silently corrupted without their size or modification time changing.
+
+The cache stores any string per file and kind, so other per-file results (i.e. bz2 test results) can be cached too.
+
+Usage:
+    hash_cache.py check HASHES_FILE     Verify files against a sha1sum style hashes file. The output is the same as
+                                        `sha1sum -c HASHES_FILE` (file: OK, file: FAILED, file: FAILED open or read)
+    hash_cache.py hash FILE [FILE ...]  Print sha1sum style hashes of files
+    hash_cache.py prune                 Remove entries that haven't been used recently
+Run hash_cache.py -h for all options.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import time
+from os.path import expanduser
+
+HOME = expanduser("~")
+HASH_CACHE_FILENAME = f"{HOME}/.mirror_hash_cache.sqlite"
+HASH_BUFFER_SIZE = 1024 * 1024  # Read files in 1 MiB blocks when hashing
+HASH_KINDS = ('sha1', 'md5')
+COMMIT_INTERVAL = 500  # Number of writes between commits to the database
+
+
+def file_digests(file_path, kinds=('sha1',), buffer_size=HASH_BUFFER_SIZE):
+    """
+    Hash a file with one or more hash algorithms, reading the file only once
+
+    :param file_path: Path to the file to hash
+    :param kinds: Names of the hashlib algorithms to use. Default ('sha1',)
+    :param buffer_size: Number of bytes to read from the file at a time. Defaults to HASH_BUFFER_SIZE
+    :return: Dictionary of kind: hex digest
+    """
+    hashers = {kind: hashlib.new(kind) for kind in kinds}
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as file_to_hash:
+        while size := file_to_hash.readinto(buffer):  # true until end of file
+            for hasher in hashers.values():
+                hasher.update(view[:size])
+    return {kind: hasher.hexdigest() for kind, hasher in hashers.items()}
+
+
+class HashCache(object):
+    """ SQLite cache of per-file values (typically hashes) keyed by device, inode, size and modification time """
+
+    def __init__(self, db_path=HASH_CACHE_FILENAME, verify_fraction=0.0, logger=None):
+        """
+        :param db_path: Path to the SQLite database. Created if it doesn't exist. Defaults to HASH_CACHE_FILENAME
+        :param verify_fraction: Fraction (0 to 1) of cache hits that are treated as misses so the file is hashed again
+        and compared to the cached value. Default 0, never verify
+        :param logger: Logger to report mismatches to. Printed to stderr if None
+        """
+        self.db_path = db_path
+        self.verify_fraction = verify_fraction
+        self.logger = logger
+
+        self.hits = 0
+        self.misses = 0
+        self.mismatches = []  # Paths whose cached value didn't match the verified value
+        self.verifying = {}  # (dev, ino, kind) -> cached value of entries picked for verification
+        self.uncommitted = 0
+
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        # Write-ahead logging lets the mirror scripts read the cache while another script is writing to it
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS file_cache ("
+                                "dev INTEGER NOT NULL, ino INTEGER NOT NULL, kind TEXT NOT NULL, "
+                                "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, path TEXT, value TEXT NOT NULL, "
+                                "last_used REAL NOT NULL, PRIMARY KEY (dev, ino, kind))")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def report(self, msg):
+        """ :param msg: Message to log as a warning, or print to stderr if there is no logger """
+        if self.logger is not None:
+            self.logger.warning(msg)
+        else:
+            print(msg, file=sys.stderr)
+
+    def write(self, sql, parameters):
+        """ Execute a statement that modifies the database, committing every COMMIT_INTERVAL writes """
+        self.connection.execute(sql, parameters)
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        """ Commit any pending writes to the database """
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def lookup(self, file_path, kind='sha1', file_stat=None):
+        """
+        Get the cached value for a file if the file is unchanged since the value was stored
+
+        :param file_path: Path to the file
+        :param kind: Kind of value to look up. Default 'sha1'
+        :param file_stat: os.stat_result of the file, if already known
+        :return: The cached value, or None if there is no valid entry (or the entry was picked for verification)
+        """
+        if file_stat is None:
+            file_stat = os.stat(file_path)
+        row = self.connection.execute("SELECT size, mtime_ns, value FROM file_cache "
+                                      "WHERE dev = ? AND ino = ? AND kind = ?",
+                                      (file_stat.st_dev, file_stat.st_ino, kind)).fetchone()
+        if row is None or row[0] != file_stat.st_size or row[1] != file_stat.st_mtime_ns:
+            # No entry, or the file has changed (or the inode was reused) since it was cached
+            self.misses += 1
+            return None
+
+        if self.verify_fraction > 0 and random.random() < self.verify_fraction:
+            self.verifying[(file_stat.st_dev, file_stat.st_ino, kind)] = row[2]
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.write("UPDATE file_cache SET last_used = ?, path = ? WHERE dev = ? AND ino = ? AND kind = ?",
+                   (time.time(), os.path.abspath(file_path), file_stat.st_dev, file_stat.st_ino, kind))
+        return row[2]
+
+    def store(self, file_path, value, kind='sha1', file_stat=None):
+        """
+        Store a value for a file. If the file was picked for verification by lookup(), the value is compared to the
+        previously cached value and any mismatch is reported.
+
+        :param file_path: Path to the file
+        :param value: Value to store (i.e. a hex digest)
+        :param kind: Kind of value to store. Default 'sha1'
+        :param file_stat: os.stat_result of the file taken *before* the value was computed. If the file has changed
+        since, the value is not stored.
+        """
+        current_stat = os.stat(file_path)
+        if file_stat is None:
+            file_stat = current_stat
+        elif (file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns) != \
+                (current_stat.st_ino, current_stat.st_size, current_stat.st_mtime_ns):
+            return  # File was modified while it was being hashed, the value may not match the file anymore
+
+        key = (file_stat.st_dev, file_stat.st_ino, kind)
+        if key in self.verifying:
+            cached_value = self.verifying.pop(key)
+            if cached_value != value:
+                self.mismatches.append(file_path)
+                self.report(f"Cached {kind} of {file_path} ({cached_value}) doesn't match its current {kind} "
+                            f"({value}) although the file size and modification time are unchanged")
+
+        self.write("INSERT OR REPLACE INTO file_cache (dev, ino, kind, size, mtime_ns, path, value, last_used) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   (*key, file_stat.st_size, file_stat.st_mtime_ns, os.path.abspath(file_path), value, time.time()))
+
+    def digests(self, file_path, kinds=('sha1',), buffer_size=HASH_BUFFER_SIZE):
+        """
+        Get digests of a file from the cache, hashing the file (once, for all missing kinds) if needed
+
+        :param file_path: Path to the file
+        :param kinds: Names of the hashlib algorithms to use. Default ('sha1',)
+        :param buffer_size: Number of bytes to read from the file at a time. Defaults to HASH_BUFFER_SIZE
+        :return: Dictionary of kind: hex digest
+        """
+        file_stat = os.stat(file_path)
+        results = {}
+        for kind in kinds:
+            value = self.lookup(file_path, kind, file_stat)
+            if value is not None:
+                results[kind] = value
+        missing = [kind for kind in kinds if kind not in results]
+        if missing:
+            computed = file_digests(file_path, missing, buffer_size)
+            for kind, value in computed.items():
+                self.store(file_path, value, kind, file_stat)
+            results.update(computed)
+        return results
+
+    def prune(self, max_age_days=30):
+        """
+        Remove entries that haven't been looked up or stored in a while, i.e. for files that have been deleted
+
+        :param max_age_days: Remove entries unused for this many days. Default 30
+        :return: Number of entries removed
+        """
+        cursor = self.connection.execute("DELETE FROM file_cache WHERE last_used < ?",
+                                         (time.time() - max_age_days * 86400,))
+        self.commit()
+        return cursor.rowcount
+
+    def close(self):
+        """ Commit pending writes and close the database """
+        self.commit()
+        self.connection.close()
+
+
+def check_hashes_file(hashes_file, cache, kind='sha1'):
+    """
+    Verify files against a hashes file of the form "<hash>  <filename>" (sha1sum/md5sum output), printing the
+    results in the same format as `sha1sum -c`. Relative filenames are relative to the current directory.
+
+    :param hashes_file: Path to the hashes file
+    :param cache: HashCache to get cached hashes from
+    :param kind: Hash algorithm the hashes file was made with. Default 'sha1'
+    :return: Number of files that failed (missing, unreadable or mismatched)
+    """
+    failed_open = 0
+    failed_match = 0
+    with open(hashes_file) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.strip() == '':
+                continue
+            expected, _, filename = line.partition(' ')
+            filename = filename[1:] if filename[:1] in (' ', '*') else filename  # Text or binary mode marker
+            try:
+                digest = cache.digests(filename, (kind,))[kind]
+            except OSError as error:
+                print(f"{kind}sum: {filename}: {error.strerror}", file=sys.stderr)
+                print(f"{filename}: FAILED open or read")
+                failed_open += 1
+                continue
+            if digest == expected.lower():
+                print(f"{filename}: OK")
+            else:
+                print(f"{filename}: FAILED")
+                failed_match += 1
+
+    if failed_open:
+        print(f"{kind}sum: WARNING: {failed_open} listed file{'s' if failed_open > 1 else ''} could not be read",
+              file=sys.stderr)
+    if failed_match:
+        print(f"{kind}sum: WARNING: {failed_match} computed checksum{'s' if failed_match > 1 else ''} did NOT match",
+              file=sys.stderr)
+    return failed_open + failed_match
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cached file hashing for the mirror scripts")
+    parser.add_argument("--db", default=HASH_CACHE_FILENAME, help=f"Hash cache database. Default {HASH_CACHE_FILENAME}")
+    parser.add_argument("--kind", default='sha1', choices=HASH_KINDS, help="Hash algorithm. Default sha1")
+    parser.add_argument("--verify_fraction", type=float, default=0.0,
+                        help="Fraction of cached hashes to verify by hashing the file again. Default 0")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check_parser = subparsers.add_parser("check", help="Verify files against a hashes file, like sha1sum -c")
+    check_parser.add_argument("hashes_file", help="File of '<hash>  <filename>' lines")
+    hash_parser = subparsers.add_parser("hash", help="Print hashes of files, like sha1sum")
+    hash_parser.add_argument("files", nargs='+', help="Files to hash")
+    prune_parser = subparsers.add_parser("prune", help="Remove entries that haven't been used recently")
+    prune_parser.add_argument("--days", type=int, default=30, help="Remove entries unused for this many days")
+    args = parser.parse_args()
+
+    exit_code = 0
+    with HashCache(args.db, verify_fraction=args.verify_fraction) as hash_cache:
+        if args.command == "check":
+            if check_hashes_file(args.hashes_file, hash_cache, args.kind) > 0:
+                exit_code = 1
+        elif args.command == "hash":
+            for file_name in args.files:
+                try:
+                    print(f"{hash_cache.digests(file_name, (args.kind,))[args.kind]}  {file_name}")
+                except OSError as err:
+                    print(f"{args.kind}sum: {file_name}: {err.strerror}", file=sys.stderr)
+                    exit_code = 1
+        elif args.command == "prune":
+            print(f"Removed {hash_cache.prune(args.days)} entries from {args.db}")
+        if hash_cache.mismatches:
+            exit_code = 1
+    sys.exit(exit_code)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compact representation of the mirror's hashes files (yyyymm.hashes, master.hashes), which hold one
+"<sha1 hash>  <filename>" line per file.
+
+HashesFile keeps the file names in one bytes buffer with an array of offsets and the hashes as 20 byte binary
+digests, plus an array of the entries sorted by name for O(log n) lookups. Lines are kept in their original order and
+any line that isn't exactly "<lowercase hash>  <filename>\n" (extra whitespace, CRLF, blank lines, etc.) is kept as
+is, so writing a file that was read reproduces it byte for byte and its sha1 in master.hashes doesn't change.
+
+Usage:
+    hashes_file.py get HASHES_FILE FILENAME [FILENAME ...]    Print the hash lines for the files. Exits with 1 if any
+                                                              file isn't in the hashes file
+    hashes_file.py merge HASHES_FILE NEW_HASHES [--replace]   Append the lines of NEW_HASHES whose files aren't in
+                                                              HASHES_FILE yet
+    hashes_file.py remove HASHES_FILE FILENAME [FILENAME ...] Remove files from the hashes file
+    hashes_file.py check HASHES_FILE                          Check that reading and writing the file is byte-identical
+"""
+import argparse
+import bisect
+import os
+import re
+import sys
+from array import array
+
+DIGEST_SIZE = 20  # Size of a sha1 digest in bytes
+# "<hash><separator><filename><line ending>" as written by sha1sum (and with one space, as written by some mirrors)
+HASH_LINE_REGEX = re.compile(rb"^([0-9a-fA-F]{40})( +\*?|\t)(\S+)[ \t]*(\r?\n)?$")
+
+
+class SortedNames(object):
+    """ Read-only sequence of the names of a HashesFile in sorted order, for use with bisect """
+
+    def __init__(self, hashes_file):
+        self.hashes_file = hashes_file
+
+    def __len__(self):
+        return len(self.hashes_file.sorted_index)
+
+    def __getitem__(self, i):
+        return self.hashes_file.name_bytes(self.hashes_file.sorted_index[i])
+
+
+class HashesFile(object):
+    """ Sorted, array backed hashes file that writes back exactly what it read """
+
+    def __init__(self):
+        self.names = bytearray()  # All file names, concatenated in file order
+        self.name_offsets = array('Q', [0])  # Start of each name in self.names, plus the end of the last one
+        self.digests = bytearray()  # 20 byte digest of each entry, in file order
+        self.sorted_index = array('I')  # Entry indices sorted by name (then by position for duplicate names)
+        self.raw_lines = {}  # Entry index: original line, for entries whose line isn't written in the standard form
+        self.other_lines = []  # (number of entries before the line, line) for lines that aren't entries (i.e. blank)
+
+    def __len__(self):
+        return len(self.name_offsets) - 1
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    @classmethod
+    def parse(cls, data):
+        """
+        :param data: Contents of a hashes file, bytes or str
+        :return: HashesFile
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        hashes_file = cls()
+        for line in data.splitlines(keepends=True):
+            hashes_file.add_line(line)
+        hashes_file.reindex()
+        return hashes_file
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: Path to a hashes file
+        :return: HashesFile, empty if the file doesn't exist
+        """
+        if not os.path.isfile(path):
+            return cls()
+        with open(path, 'rb') as f:
+            return cls.parse(f.read())
+
+    def add_line(self, line):
+        """ Append a line to the end of the file. Call reindex() before lookups """
+        match = HASH_LINE_REGEX.match(line)
+        if match is None:
+            self.other_lines.append((len(self), line))
+            return
+        hex_digest, separator, name, line_ending = match.groups()
+        index = len(self)
+        self.names += name
+        self.name_offsets.append(len(self.names))
+        self.digests += bytes.fromhex(hex_digest.decode())
+        if line != b"%s  %s\n" % (hex_digest.lower(), name):
+            self.raw_lines[index] = line
+
+    def add_entry(self, hex_digest, name):
+        """ Append a "<hash>  <filename>" line to the end of the file. Call reindex() before lookups """
+        self.add_line(f"{hex_digest.lower()}  {name}\n".encode())
+
+    def reindex(self):
+        """ Rebuild the sorted index after lines have been added or removed """
+        self.sorted_index = array('I', sorted(range(len(self)), key=self.name_bytes))
+
+    def name_bytes(self, index):
+        """ :return: Name of the entry at index, as bytes """
+        return bytes(self.names[self.name_offsets[index]:self.name_offsets[index + 1]])
+
+    def name(self, index):
+        """ :return: Name of the entry at index """
+        return self.name_bytes(index).decode()
+
+    def hex_digest(self, index):
+        """ :return: Hash of the entry at index, as a lowercase hex string """
+        return self.digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE].hex()
+
+    def find(self, name):
+        """
+        :param name: File name
+        :return: Index of the last entry for the file name (the one a dictionary built from the file would keep), or
+        None if the file isn't in the hashes file
+        """
+        key = name.encode() if isinstance(name, str) else name
+        i = bisect.bisect_right(SortedNames(self), key)
+        if i > 0 and self.name_bytes(self.sorted_index[i - 1]) == key:
+            return self.sorted_index[i - 1]
+        return None
+
+    def get(self, name, default=None):
+        """
+        :param name: File name
+        :param default: Value to return if the file isn't in the hashes file
+        :return: Hash of the file as a lowercase hex string
+        """
+        index = self.find(name)
+        return default if index is None else self.hex_digest(index)
+
+    def items(self):
+        """ :return: Generator of (file name, hash) in file order """
+        for index in range(len(self)):
+            yield self.name(index), self.hex_digest(index)
+
+    def ends_with_newline(self):
+        """ :return: True if the file is empty or its last line ends with a newline """
+        last_other = self.other_lines[-1] if len(self.other_lines) > 0 else None
+        if last_other is not None and last_other[0] == len(self):
+            return last_other[1].endswith(b"\n")
+        if len(self) == 0:
+            return True
+        return self.raw_lines.get(len(self) - 1, b"\n").endswith(b"\n")
+
+    def merge(self, entries, replace=False):
+        """
+        Add many entries at once, appending a line for each new file in the order given
+
+        :param entries: Iterable of (hash, file name)
+        :param replace: If True, a file that is already in the hashes file with a different hash has its hash replaced
+                        in place. If False (default) a line with the new hash is appended, like appending to the file
+                        as text
+        :return: List of the file names that were added or changed
+        """
+        if not self.ends_with_newline():
+            # Terminate the last line so the new lines aren't joined to it
+            if len(self.other_lines) > 0 and self.other_lines[-1][0] == len(self):
+                self.other_lines[-1] = (len(self), self.other_lines[-1][1] + b"\n")
+            else:
+                self.raw_lines[len(self) - 1] += b"\n"
+                self.drop_standard_raw_line(len(self) - 1)
+
+        changed = []
+        new_entries = {}
+        for hex_digest, name in entries:
+            hex_digest = hex_digest.lower()
+            index = self.find(name)
+            if (index is not None and self.hex_digest(index) == hex_digest) or new_entries.get(name) == hex_digest:
+                continue  # Already there
+            if index is not None and replace:
+                self.digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE] = bytes.fromhex(hex_digest)
+                if index in self.raw_lines:
+                    self.raw_lines[index] = HASH_LINE_REGEX.sub(hex_digest.encode() + rb"\2\3\4",
+                                                                self.raw_lines[index])
+                    self.drop_standard_raw_line(index)
+            else:
+                self.add_entry(hex_digest, name)
+                new_entries[name] = hex_digest
+            changed.append(name)
+        self.reindex()
+        return changed
+
+    def drop_standard_raw_line(self, index):
+        """ Forget the original line of an entry if it is now written in the standard form anyway """
+        if self.raw_lines[index] == f"{self.hex_digest(index)}  {self.name(index)}\n".encode():
+            del self.raw_lines[index]
+
+    def remove(self, names):
+        """
+        Remove every line for the given files
+
+        :param names: Iterable of file names
+        :return: List of the file names that were removed
+        """
+        to_remove = set()
+        removed = []
+        for name in set(names):
+            key = name.encode()
+            i = bisect.bisect_left(SortedNames(self), key)
+            found = False
+            while i < len(self.sorted_index) and self.name_bytes(self.sorted_index[i]) == key:
+                to_remove.add(self.sorted_index[i])
+                found = True
+                i += 1
+            if found:
+                removed.append(name)
+        if len(to_remove) == 0:
+            return removed
+
+        # Rebuild the arrays without the removed entries, keeping the other lines where they were
+        old = self.__dict__.copy()
+        self.__init__()
+        kept_before = array('Q', [0])  # kept_before[i]: number of kept entries before old entry i
+        for index in range(len(old['name_offsets']) - 1):
+            if index not in to_remove:
+                self.names += old['names'][old['name_offsets'][index]:old['name_offsets'][index + 1]]
+                self.name_offsets.append(len(self.names))
+                self.digests += old['digests'][index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE]
+                if index in old['raw_lines']:
+                    self.raw_lines[len(self) - 1] = old['raw_lines'][index]
+            kept_before.append(len(self))
+        self.other_lines = [(kept_before[position], line) for position, line in old['other_lines']]
+        self.reindex()
+        return sorted(removed)
+
+    def to_bytes(self):
+        """ :return: Contents of the hashes file """
+        lines = []
+        other = 0
+        for index in range(len(self) + 1):
+            while other < len(self.other_lines) and self.other_lines[other][0] == index:
+                lines.append(self.other_lines[other][1])
+                other += 1
+            if index == len(self):
+                break
+            if index in self.raw_lines:
+                lines.append(self.raw_lines[index])
+            else:
+                lines.append(f"{self.hex_digest(index)}  {self.name(index)}\n".encode())
+        return b"".join(lines)
+
+    def save(self, path):
+        """ Write the hashes file, replacing the file at path all at once """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read and update mirror hashes files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    get_parser = subparsers.add_parser("get", help="Print the hash lines of files")
+    get_parser.add_argument("hashes_file")
+    get_parser.add_argument("filenames", nargs='+')
+    merge_parser = subparsers.add_parser("merge", help="Add the lines of another hashes file")
+    merge_parser.add_argument("hashes_file")
+    merge_parser.add_argument("new_hashes")
+    merge_parser.add_argument("--replace", action="store_true",
+                              help="Replace the hashes of files already in hashes_file rather than appending")
+    remove_parser = subparsers.add_parser("remove", help="Remove files from a hashes file")
+    remove_parser.add_argument("hashes_file")
+    remove_parser.add_argument("filenames", nargs='+')
+    check_parser = subparsers.add_parser("check", help="Check that a hashes file is written back byte-identically")
+    check_parser.add_argument("hashes_file")
+    args = parser.parse_args()
+
+    hashes = HashesFile.load(args.hashes_file)
+    if args.command == "get":
+        missing = 0
+        for filename in args.filenames:
+            data_hash = hashes.get(os.path.basename(filename))
+            if data_hash is None:
+                missing += 1
+            else:
+                print(f"{data_hash}  {os.path.basename(filename)}")
+        sys.exit(1 if missing > 0 else 0)
+    elif args.command == "merge":
+        new_hashes = HashesFile.load(args.new_hashes)
+        added = hashes.merge(((data_hash, name) for name, data_hash in new_hashes.items()), replace=args.replace)
+        hashes.save(args.hashes_file)
+        print(f"{len(added)} entries added to {args.hashes_file}")
+    elif args.command == "remove":
+        removed = hashes.remove(os.path.basename(f) for f in args.filenames)
+        hashes.save(args.hashes_file)
+        print(f"{len(removed)} entries removed from {args.hashes_file}")
+    elif args.command == "check":
+        with open(args.hashes_file, 'rb') as hashes_data:
+            identical = hashes_data.read() == hashes.to_bytes()
+        print(f"{args.hashes_file}: {len(hashes)} entries, {'OK' if identical else 'NOT byte-identical'}")
+        sys.exit(0 if identical else 1)
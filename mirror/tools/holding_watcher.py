@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Watches a holding directory for data files that have finished arriving, for the gatekeeper's daemon mode (see
+gatekeeper_globus.py --daemon).
+
+The directory is scanned with os.scandir(), which gets each file's size and modification time without a stat() per
+file on most filesystems. A file is settled once its size and modification time haven't changed for settle_s seconds,
+so files that are still being copied or written into holding aren't picked up. Files that were last modified more than
+settle_s ago are settled as soon as they are seen. Each settled file is handed out once; it's only handed out again
+if it changes, or if it is still in holding retry_s seconds later (i.e. it was held back by a failed upload chunk).
+
+Example:
+    watcher = HoldingWatcher("/data/holding/globus/", "*rawacf.bz2", settle_s=60)
+    while True:
+        batch = watcher.settled_files(max_files=5000)
+        if len(batch) > 0:
+            process(batch)
+        else:
+            time.sleep(30)
+"""
+import fnmatch
+import os
+import time
+
+SETTLE_S = 60  # Seconds a file's size and modification time must be unchanged before it is handed out
+RETRY_S = 3600  # Seconds before a file that is still in holding is handed out again
+
+
+class HoldingWatcher(object):
+    """ Finds the files in a holding directory that are ready to be uploaded """
+
+    def __init__(self, holding_dir, pattern="*rawacf.bz2", settle_s=SETTLE_S, retry_s=RETRY_S):
+        """
+        :param holding_dir: Directory to watch. Subdirectories (i.e. failed/, blocked/) aren't watched
+        :param pattern: Glob pattern of the data file names. Default *rawacf.bz2
+        :param settle_s: Seconds a file must be unchanged before it is handed out. Default SETTLE_S
+        :param retry_s: Seconds before a file that was handed out is handed out again. Default RETRY_S
+        """
+        self.holding_dir = holding_dir
+        self.pattern = pattern
+        self.settle_s = settle_s
+        self.retry_s = retry_s
+        self.seen = {}  # filename: ((size, mtime_ns), time.monotonic() since which the file has been unchanged)
+        self.handed_out = {}  # filename: ((size, mtime_ns), time.monotonic() the file was handed out)
+
+    def scan(self):
+        """ :return: Dictionary of filename: (size, mtime_ns) of the data files in the holding directory """
+        files = {}
+        with os.scandir(self.holding_dir) as entries:
+            for entry in entries:
+                if fnmatch.fnmatch(entry.name, self.pattern) and entry.is_file():
+                    try:
+                        file_stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # Removed since the directory was read
+                    files[entry.name] = (file_stat.st_size, file_stat.st_mtime_ns)
+        return files
+
+    def settled_files(self, max_files=None):
+        """
+        Scan the holding directory and hand out the files that have settled
+
+        :param max_files: Most files to hand out at once, oldest seen first. Default None, no limit
+        :return: Sorted list of file names
+        """
+        now = time.monotonic()
+        files = self.scan()
+        # Forget files that are gone, i.e. uploaded or moved to a subdirectory
+        self.seen = {name: seen for name, seen in self.seen.items() if name in files}
+        self.handed_out = {name: handed for name, handed in self.handed_out.items() if name in files}
+
+        ready = []
+        for name, file_stat in files.items():
+            if name not in self.seen or self.seen[name][0] != file_stat:
+                # A file last modified a while ago (i.e. already there when the watcher started) has settled already
+                unchanged_s = max(0.0, time.time() - file_stat[1] / 1e9)
+                self.seen[name] = (file_stat, now - unchanged_s)
+            if now - self.seen[name][1] < self.settle_s:
+                continue
+            handed = self.handed_out.get(name)
+            if handed is not None and handed[0] == file_stat and now - handed[1] < self.retry_s:
+                continue
+            ready.append((self.seen[name][1], name))
+
+        ready.sort()
+        if max_files is not None:
+            ready = ready[:max_files]
+        for _, name in ready:
+            self.handed_out[name] = (files[name], now)
+        return sorted(name for _, name in ready)
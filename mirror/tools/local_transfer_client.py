@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+A transfer backend (see transfer_backend.py) whose endpoints are local directories, for testing and benchmarking the
+Gatekeeper class without Globus. Transfers and deletes are carried out when they are submitted, but a task only
+reports that it is finished once the time a real transfer would take has passed (see bandwidth). Every call is counted
+in `calls` so tests can check how many round trips were made.
+
+Latency and failures of the transfer service can be simulated:
+    latency_s         - Seconds each call takes, as a round trip to Globus would
+    bandwidth         - Bytes per second tasks transfer at. None (default) for tasks that finish immediately
+    failure_rate      - Fraction of calls that fail with a BackendAPIError (503), before doing anything
+    file_failure_rate - Fraction of files in transfer tasks that aren't transferred. The task ends up FAILED
+
+Example:
+    client = LocalTransferClient({PERSONAL_UUID: "/", MIRROR_UUID: "/tmp/fake_mirror"}, latency_s=0.2)
+    gk = Gatekeeper(client_id, transfer_client=client, log_dir="/tmp/logs")
+"""
+import filecmp
+import fnmatch
+import os
+import random
+import shutil
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from tools.transfer_backend import TransferBackend, BackendAPIError
+
+
+class LocalTaskData(dict):
+    """ Transfer or delete task for a LocalTransferClient, like globus_sdk.TransferData and globus_sdk.DeleteData """
+
+    def __init__(self, data_type, **kwargs):
+        super().__init__(DATA_TYPE=data_type, DATA=[], **kwargs)
+
+    def add_item(self, source_path, destination_path=None, recursive=False):
+        """
+        :param source_path: Path to transfer from, or to delete for a delete task
+        :param destination_path: Path to transfer to. Not used for delete tasks
+        :param recursive: True if source_path is a directory to transfer with all its contents
+        """
+        if self['DATA_TYPE'] == "transfer":
+            self['DATA'].append({'source_path': source_path, 'destination_path': destination_path,
+                                 'recursive': recursive})
+        else:
+            self['DATA'].append({'path': source_path})
+
+
+class LocalTransferClient(TransferBackend):
+    """ Transfer backend whose endpoints are local directories """
+
+    def __init__(self, endpoints, latency_s=0.0, bandwidth=None, failure_rate=0.0, file_failure_rate=0.0, seed=None):
+        """
+        :param endpoints: Dictionary of endpoint UUID: local directory that is the root of the endpoint. Use "/" for
+                          an endpoint whose paths are paths on this machine (i.e. the personal endpoint)
+        :param latency_s: Seconds each call takes. Default 0
+        :param bandwidth: Bytes per second that tasks transfer. Default None, tasks finish immediately
+        :param failure_rate: Fraction of calls that fail with a 503 error. Default 0
+        :param file_failure_rate: Fraction of files in transfer tasks that fail to transfer. Default 0
+        :param seed: Seed for the simulated failures, for repeatable runs. Default None
+        """
+        self.endpoints = endpoints
+        self.latency_s = latency_s
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.file_failure_rate = file_failure_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.tasks = {}  # task_id: task dictionary, see get_task()
+        self.successful_transfers = {}  # task_id: list of transferred files, see task_successful_transfers()
+
+    def call(self, name):
+        """ Count a call to the service and simulate its latency and failures """
+        self.calls[name] += 1
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+        if self.failure_rate > 0 and self.random.random() < self.failure_rate:
+            raise BackendAPIError(503, "ServiceUnavailable", f"Simulated failure of {name}")
+
+    def local_path(self, endpoint_id, path):
+        """
+        :param endpoint_id: UUID of the endpoint
+        :param path: Path on the endpoint
+        :return: Path to the same file or directory on the local filesystem
+        """
+        if endpoint_id not in self.endpoints:
+            raise BackendAPIError(404, "EndpointNotFound", f"No such endpoint {endpoint_id}")
+        return os.path.join(self.endpoints[endpoint_id], str(path).lstrip('/'))
+
+    @staticmethod
+    def entry(local_path):
+        """ :return: Dictionary describing a file or directory, with the keys Globus uses """
+        file_stat = os.stat(local_path)
+        return {'name': os.path.basename(os.path.normpath(local_path)),
+                'type': 'dir' if os.path.isdir(local_path) else 'file',
+                'size': file_stat.st_size,
+                'last_modified': datetime.fromtimestamp(file_stat.st_mtime, timezone.utc).strftime(
+                    "%Y-%m-%d %H:%M:%S+00:00"),
+                'permissions': f"{file_stat.st_mode & 0o777:04o}", 'user': str(file_stat.st_uid),
+                'group': str(file_stat.st_gid)}
+
+    @staticmethod
+    def matches_filter(entry, ls_filter):
+        """
+        :param entry: Dictionary returned by entry()
+        :param ls_filter: Globus ls filter, i.e. 'name:~*.hashes', 'name:=master.hashes' or 'type:file'. Filters can be
+                          joined with '/'
+        :return: True if the entry passes the filter
+        """
+        if ls_filter is None:
+            return True
+        for condition in ls_filter.split('/'):
+            field, _, value = condition.partition(':')
+            if value.startswith('~'):
+                if not fnmatch.fnmatchcase(str(entry[field]), value[1:]):
+                    return False
+            elif value.startswith('='):
+                if str(entry[field]) != value[1:]:
+                    return False
+            elif value.startswith('!'):
+                if str(entry[field]) == value[1:]:
+                    return False
+            elif str(entry[field]) != value:
+                return False
+        return True
+
+    def operation_ls(self, endpoint_id, path=None, filter=None, **kwargs):
+        """ :return: List of entries in the directory, like globus_sdk.TransferClient.operation_ls """
+        self.call('operation_ls')
+        local_path = self.local_path(endpoint_id, path or '/')
+        if not os.path.exists(local_path):
+            raise BackendAPIError(404, "ClientError.NotFound", f"Directory {path} not found")
+        if not os.path.isdir(local_path):
+            raise BackendAPIError(502, "ExternalError.DirListingFailed.NotDirectory", f"{path} is a file")
+        entries = [self.entry(os.path.join(local_path, name)) for name in sorted(os.listdir(local_path))]
+        return [entry for entry in entries if self.matches_filter(entry, filter)]
+
+    def operation_stat(self, endpoint_id, path=None, **kwargs):
+        """ :return: Entry for the file or directory, like globus_sdk.TransferClient.operation_stat """
+        self.call('operation_stat')
+        local_path = self.local_path(endpoint_id, path or '/')
+        if not os.path.exists(local_path):
+            raise BackendAPIError(404, "NotFound", f"{path} not found")
+        return self.entry(local_path)
+
+    def operation_mkdir(self, endpoint_id, path, **kwargs):
+        """ Make a directory, like globus_sdk.TransferClient.operation_mkdir """
+        self.call('operation_mkdir')
+        local_path = self.local_path(endpoint_id, path)
+        if os.path.exists(local_path):
+            raise BackendAPIError(502, "ExternalError.MkdirFailed.Exists", f"{path} already exists")
+        try:
+            os.mkdir(local_path)
+        except FileNotFoundError:
+            raise BackendAPIError(404, "ClientError.NotFound", f"Parent of {path} not found")
+        return {'code': "DirectoryCreated"}
+
+    def transfer_data(self, source_endpoint, destination_endpoint, **kwargs):
+        """ :return: LocalTaskData for a transfer task, like globus_sdk.TransferData """
+        return LocalTaskData("transfer", source_endpoint=source_endpoint, destination_endpoint=destination_endpoint,
+                             **kwargs)
+
+    def delete_data(self, endpoint, **kwargs):
+        """ :return: LocalTaskData for a delete task, like globus_sdk.DeleteData """
+        return LocalTaskData("delete", endpoint=endpoint, **kwargs)
+
+    def new_task(self, task_type, data, destination_endpoint, num_bytes, files_failed):
+        """ Record a task that was carried out, finishing once its bytes would have been transferred """
+        task_id = str(uuid.uuid4())
+        duration = 0 if self.bandwidth is None else num_bytes / self.bandwidth
+        self.tasks[task_id] = {'task_id': task_id, 'type': task_type, 'label': data.get('label'),
+                               'destination_endpoint_id': destination_endpoint,
+                               'destination_endpoint_display_name': self.endpoints.get(destination_endpoint),
+                               'files': len(data['DATA']), 'files_skipped': 0, 'faults': files_failed,
+                               'bytes_transferred': num_bytes, 'completion_time': time.time() + duration,
+                               'final_status': 'FAILED' if files_failed > 0 else 'SUCCEEDED'}
+        self.successful_transfers[task_id] = []
+        return task_id
+
+    def submit_transfer(self, data):
+        """ Copy the files of a transfer task, like globus_sdk.TransferClient.submit_transfer
+
+        :param data: LocalTaskData from transfer_data()
+        :return: Dictionary with the 'task_id'
+        """
+        self.call('submit_transfer')
+        transferred = []
+        skipped = 0
+        failed = 0
+        num_bytes = 0
+        for item in data['DATA']:
+            source = self.local_path(data['source_endpoint'], item['source_path'])
+            destination = self.local_path(data['destination_endpoint'], item['destination_path'])
+            if not os.path.exists(source) or (self.file_failure_rate > 0 and
+                                              self.random.random() < self.file_failure_rate):
+                failed += 1
+                continue
+            if item['recursive']:
+                shutil.copytree(source, destination, dirs_exist_ok=True)
+                num_bytes += sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(source)
+                                 for f in files)
+            elif data.get('sync_level') is not None and os.path.isfile(destination) and \
+                    filecmp.cmp(source, destination, shallow=data.get('sync_level') not in ("checksum", 3)):
+                skipped += 1
+                continue
+            else:
+                # Globus makes any missing directories on the way to the destination
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copyfile(source, destination)
+                num_bytes += os.path.getsize(source)
+            transferred.append({'DATA_TYPE': "successful_transfer", 'source_path': item['source_path'],
+                                'destination_path': item['destination_path']})
+        task_id = self.new_task("TRANSFER", data, data['destination_endpoint'], num_bytes, failed)
+        self.tasks[task_id]['files_skipped'] = skipped
+        self.successful_transfers[task_id] = transferred
+        return {'task_id': task_id, 'code': "Accepted"}
+
+    def submit_delete(self, data):
+        """ Delete the files of a delete task, like globus_sdk.TransferClient.submit_delete
+
+        :param data: LocalTaskData from delete_data()
+        :return: Dictionary with the 'task_id'
+        """
+        self.call('submit_delete')
+        failed = 0
+        for item in data['DATA']:
+            local_path = self.local_path(data['endpoint'], item['path'])
+            if os.path.isdir(local_path) and data.get('recursive'):
+                shutil.rmtree(local_path)
+            elif os.path.isfile(local_path):
+                os.remove(local_path)
+            elif not data.get('ignore_missing'):
+                failed += 1
+        task_id = self.new_task("DELETE", data, data['endpoint'], 0, failed)
+        return {'task_id': task_id, 'code': "Accepted"}
+
+    def describe_task(self, task_id):
+        """ :return: Dictionary describing the task, with its current status """
+        task = dict(self.tasks[task_id])
+        task['status'] = 'ACTIVE' if time.time() < task['completion_time'] else task['final_status']
+        return task
+
+    def get_task(self, task_id):
+        """ :return: Dictionary describing the task, like globus_sdk.TransferClient.get_task """
+        self.call('get_task')
+        if task_id not in self.tasks:
+            raise BackendAPIError(404, "ClientError.NotFound", f"Task {task_id} not found")
+        return self.describe_task(task_id)
+
+    def task_wait(self, task_id, timeout=10, polling_interval=10):
+        """ :return: True if the task finished within timeout seconds, like globus_sdk.TransferClient.task_wait """
+        self.call('task_wait')
+        remaining = self.tasks[task_id]['completion_time'] - time.time()
+        time.sleep(max(0.0, min(remaining, timeout)))
+        return remaining <= timeout
+
+    def task_list(self, **kwargs):
+        """ :return: List of the tasks submitted to this client, most recent first """
+        self.call('task_list')
+        return [self.describe_task(task_id) for task_id in reversed(list(self.tasks))]
+
+    def task_successful_transfers(self, task_id):
+        """ :return: List of the files the task transferred, like globus_sdk.TransferClient.task_successful_transfers
+        """
+        self.call('task_successful_transfers')
+        return list(self.successful_transfers.get(task_id, []))
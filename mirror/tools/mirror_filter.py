@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Bloom filter of every file on the mirror, built from the local copy of the mirror's hashes files (see
+Gatekeeper.refresh_local_hashes()), for checking whether files are on the mirror without getting and reading hashes
+files.
+
+The filter holds both the file name and the (file name, sha1 hash) pair of every entry in the hashes files. It is split
+into one segment per data type and month, since every data file name starts with its date, so a lookup only touches
+one segment and an update only rebuilds the segments of hashes files that changed. Each segment records the sha1 of
+the hashes file it was built from, which is the same hash master.hashes lists for it.
+
+A negative answer from the filter is certain (for the version of the hashes files it was built from), a positive
+answer is wrong at most FALSE_POSITIVE_RATE of the time. contains() confirms positive answers with the hashes file.
+
+Usage:
+    mirror_filter.py update [--hashes_dir DIR]                         Rebuild the segments of changed hashes files
+    mirror_filter.py query [--exact] [--data_type raw] FILE[:HASH] ... Print the files that are (possibly) on the mirror
+Exit code of query is 0 if every file is (possibly) on the mirror, 1 otherwise.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+from os.path import expanduser, dirname, abspath
+
+# Run from the shell as tools/mirror_filter.py, the tools package is only importable once the mirror directory is added
+if __package__ in (None, ''):
+    sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from tools.hashes_file import HashesFile
+
+HOME = expanduser("~")
+LOCAL_HASHES_DIR = f"{HOME}/mirror_hashes/"
+MIRROR_FILTER_FILENAME = "mirror.filter"  # Kept in the local hashes directory
+FALSE_POSITIVE_RATE = 0.001
+FILTER_VERSION = 1
+
+
+def filter_keys(name, data_hash=None):
+    """ :return: Key for a file name, or for a (file name, hash) pair if data_hash is given """
+    return name.encode() if data_hash is None else f"{name}\0{data_hash.lower()}".encode()
+
+
+class BloomFilter(object):
+    """ Bloom filter of byte strings, using double hashing of a blake2b digest """
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        """
+        :param num_bits: Size of the filter in bits
+        :param num_hashes: Number of bits set per key
+        :param bits: Existing filter contents, as bytes
+        """
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray((num_bits + 7) // 8) if bits is None else bytearray(bits)
+
+    @classmethod
+    def for_capacity(cls, num_keys, false_positive_rate=FALSE_POSITIVE_RATE):
+        """
+        :param num_keys: Number of keys the filter will hold
+        :param false_positive_rate: Acceptable rate of false positives
+        :return: Empty BloomFilter of the optimal size
+        """
+        num_keys = max(1, num_keys)
+        num_bits = max(8, math.ceil(-num_keys * math.log(false_positive_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / num_keys * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def positions(self, key):
+        """ :return: Generator of the bit positions of a key """
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key):
+        """ :param key: bytes to add """
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class MirrorFilter(object):
+    """ Per-month Bloom filters of the files in the mirror's hashes files """
+
+    def __init__(self, hashes_dir=LOCAL_HASHES_DIR):
+        """
+        :param hashes_dir: Local copy of the mirror's hashes files, as <data_type>/yyyymm.hashes. The filter is kept in
+                           this directory too. Defaults to LOCAL_HASHES_DIR
+        """
+        self.hashes_dir = hashes_dir.rstrip('/')
+        self.segments = {}  # "raw/yyyymm": BloomFilter
+        self.sources = {}  # "raw/yyyymm": sha1 of the hashes file the segment was built from
+
+    @property
+    def filter_path(self):
+        return f"{self.hashes_dir}/{MIRROR_FILTER_FILENAME}"
+
+    @classmethod
+    def load(cls, hashes_dir=LOCAL_HASHES_DIR):
+        """
+        :param hashes_dir: Local copy of the mirror's hashes files. Defaults to LOCAL_HASHES_DIR
+        :return: MirrorFilter, with no segments if there is no (readable) filter file yet
+        """
+        mirror_filter = cls(hashes_dir)
+        if not os.path.isfile(mirror_filter.filter_path):
+            return mirror_filter
+        with open(mirror_filter.filter_path, 'rb') as f:
+            try:
+                header = json.loads(f.readline())
+                if header['version'] != FILTER_VERSION:
+                    return mirror_filter
+                data = f.read()
+                for month, (offset, num_bits, num_hashes, source) in header['segments'].items():
+                    num_bytes = (num_bits + 7) // 8
+                    mirror_filter.segments[month] = BloomFilter(num_bits, num_hashes, data[offset:offset + num_bytes])
+                    mirror_filter.sources[month] = source
+            except (ValueError, KeyError, TypeError):
+                mirror_filter.segments = {}
+                mirror_filter.sources = {}
+        return mirror_filter
+
+    def save(self):
+        """ Write the filter to the hashes directory, replacing the old filter all at once """
+        header = {'version': FILTER_VERSION, 'segments': {}}
+        offset = 0
+        for month in sorted(self.segments):
+            segment = self.segments[month]
+            header['segments'][month] = (offset, segment.num_bits, segment.num_hashes, self.sources[month])
+            offset += len(segment.bits)
+        tmp_path = f"{self.filter_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for month in sorted(self.segments):
+                f.write(self.segments[month].bits)
+        os.replace(tmp_path, self.filter_path)
+
+    def update(self, false_positive_rate=FALSE_POSITIVE_RATE):
+        """
+        Rebuild the segments whose hashes file has changed (or is new), and drop segments whose hashes file is gone
+
+        :param false_positive_rate: Acceptable rate of false positives for rebuilt segments
+        :return: List of the rebuilt months, of the form "raw/yyyymm"
+        """
+        rebuilt = []
+        current = set()
+        for data_type in sorted(os.listdir(self.hashes_dir)):
+            if not os.path.isdir(f"{self.hashes_dir}/{data_type}"):
+                continue
+            for hashes_filename in sorted(os.listdir(f"{self.hashes_dir}/{data_type}")):
+                if not hashes_filename.endswith(".hashes"):
+                    continue
+                month = f"{data_type}/{hashes_filename[:-len('.hashes')]}"
+                current.add(month)
+                with open(f"{self.hashes_dir}/{data_type}/{hashes_filename}", 'rb') as f:
+                    data = f.read()
+                source = hashlib.sha1(data).hexdigest()
+                if self.sources.get(month) == source:
+                    continue
+                hashes_file = HashesFile.parse(data)
+                segment = BloomFilter.for_capacity(2 * len(hashes_file), false_positive_rate)
+                for name, data_hash in hashes_file.items():
+                    segment.add(filter_keys(name))
+                    segment.add(filter_keys(name, data_hash))
+                self.segments[month] = segment
+                self.sources[month] = source
+                rebuilt.append(month)
+        for month in set(self.segments) - current:
+            del self.segments[month]
+            del self.sources[month]
+        return rebuilt
+
+    def is_current(self, data_type, yyyymm, source_hash):
+        """
+        :param data_type: Data type. Ex) raw
+        :param yyyymm: Year and month. Ex) 202001
+        :param source_hash: sha1 of the hashes file (i.e. from master.hashes)
+        :return: True if the month's segment was built from that version of the hashes file
+        """
+        return self.sources.get(f"{data_type}/{yyyymm}") == source_hash
+
+    def might_contain(self, name, data_hash=None, data_type="raw"):
+        """
+        :param name: Data file name. Ex) 20200101.0000.00.sas.rawacf.bz2
+        :param data_hash: sha1 hash of the file, to check for the file with this hash only
+        :param data_type: Data type of the file. Default raw
+        :return: False if the file is certainly not in the hashes files, True if it probably is
+        """
+        segment = self.segments.get(f"{data_type}/{name[0:6]}")
+        return segment is not None and filter_keys(name, data_hash) in segment
+
+    def contains(self, name, data_hash=None, data_type="raw"):
+        """
+        :param name: Data file name. Ex) 20200101.0000.00.sas.rawacf.bz2
+        :param data_hash: sha1 hash of the file, to check for the file with this hash only
+        :param data_type: Data type of the file. Default raw
+        :return: True if the file (with the hash, if given) is in its month's hashes file. The hashes file is only read
+                 when the filter can't rule the file out
+        """
+        if not self.might_contain(name, data_hash, data_type):
+            return False
+        hashes_file = HashesFile.load(f"{self.hashes_dir}/{data_type}/{name[0:6]}.hashes")
+        return name in hashes_file if data_hash is None else hashes_file.get(name) == data_hash.lower()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bloom filter of the files on the mirror")
+    parser.add_argument("--hashes_dir", default=LOCAL_HASHES_DIR,
+                        help=f"Local copy of the mirror hashes files. Default {LOCAL_HASHES_DIR}")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser("update", help="Rebuild the filter for changed hashes files")
+    update_parser.add_argument("--false_positive_rate", type=float, default=FALSE_POSITIVE_RATE,
+                               help=f"False positive rate of rebuilt months. Default {FALSE_POSITIVE_RATE}")
+    query_parser = subparsers.add_parser("query", help="Check if files are on the mirror")
+    query_parser.add_argument("files", nargs='+', help="File names, optionally followed by :<sha1 hash>")
+    query_parser.add_argument("--data_type", default="raw", help="Data type of the files. Default raw")
+    query_parser.add_argument("--exact", action="store_true",
+                              help="Confirm possible matches with the hashes files, to rule out false positives")
+    args = parser.parse_args()
+
+    mirror_filter = MirrorFilter.load(args.hashes_dir)
+    if args.command == "update":
+        rebuilt_months = mirror_filter.update(args.false_positive_rate)
+        mirror_filter.save()
+        print(f"Rebuilt {len(rebuilt_months)} of {len(mirror_filter.segments)} months")
+    else:
+        not_found = 0
+        for query in args.files:
+            filename, _, query_hash = os.path.basename(query).partition(':')
+            check = mirror_filter.contains if args.exact else mirror_filter.might_contain
+            if check(filename, query_hash or None, args.data_type):
+                print(query)
+            else:
+                not_found += 1
+        sys.exit(1 if not_found > 0 else 0)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Write-ahead journal of the files a gatekeeper run is working on, so a run that was killed or timed out can be resumed
+by the next one instead of being redone from scratch.
+
+Each file goes through the states below, in order. A state is written to the journal (and flushed to disk) before the
+gatekeeper acts on it, so after a crash the journal says how far each file got:
+    hashed          - The file in holding was hashed (Step 5)
+    validated       - The file passed the bz2 and empty file checks (Step 7)
+    submitting      - The file is about to be put in an upload task, recorded before the task is submitted (Step 9)
+    submitted       - The file is in an upload task, recorded with the task ID once it is submitted (Step 9)
+    confirmed       - The file is on the mirror. It is removed from holding after this is recorded (Step 10)
+    hashes_uploaded - The yyyymm.hashes file with the file's hash was uploaded to the mirror (Step 11)
+The journal is cleared once master.hashes has been uploaded (Step 12), so anything left in it at the start of a run
+belongs to a run that didn't finish. Files that were confirmed (and may already be gone from holding) still need
+their hashes added to yyyymm.hashes, files that were submitting or submitted may have been transferred by the old task,
+and months with uploaded hashes files still need master.hashes updated.
+
+The journal is a file of JSON lines, one per batch of files moving to a state:
+    {"time": 1700000000.0, "state": "submitted", "task_id": "...", "files": {"<filename>": "<sha1>", ...}}
+A line that was only partly written when the run was killed is ignored. A file's state never goes backwards while its
+hash is the same, so states written while a run is resumed don't hide what the earlier run got done.
+
+Usage:
+    run_journal.py show [JOURNAL]    Print the number of files in each state, and the files that were submitting or
+                                     got further
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from os.path import expanduser
+
+HOME = expanduser("~")
+JOURNAL_DIRNAME = "journal"  # Directory in the gatekeeper's working directory, kept when the working dir is cleared
+JOURNAL_FILENAME = "gatekeeper.journal"
+HASHED = "hashed"
+VALIDATED = "validated"
+SUBMITTING = "submitting"
+SUBMITTED = "submitted"
+CONFIRMED = "confirmed"
+HASHES_UPLOADED = "hashes_uploaded"
+STATES = (HASHED, VALIDATED, SUBMITTING, SUBMITTED, CONFIRMED, HASHES_UPLOADED)
+
+
+class JournalEntry(object):
+    """ Last recorded state of one file """
+    __slots__ = ('state', 'hash', 'task_id')
+
+    def __init__(self, state, data_hash, task_id=None):
+        self.state = state
+        self.hash = data_hash
+        self.task_id = task_id
+
+
+class RunJournal(object):
+    """ Journal of the state of each file of a gatekeeper run, see the module docstring """
+
+    def __init__(self, journal_dir):
+        """
+        :param journal_dir: Directory of the journal, made if it doesn't exist
+        """
+        os.makedirs(journal_dir, exist_ok=True)
+        self.path = f"{journal_dir}/{JOURNAL_FILENAME}"
+        self.files = {}  # filename: JournalEntry
+        self.load()
+
+    def __len__(self):
+        return len(self.files)
+
+    def load(self):
+        """ Read the journal left by earlier runs, if any """
+        self.files = {}
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partly written when the run was killed
+                self.apply(record)
+
+    def apply(self, record):
+        """ Update the state of the files in a journal record """
+        state_index = STATES.index(record['state'])
+        for filename, data_hash in record['files'].items():
+            entry = self.files.get(filename)
+            if entry is not None and entry.hash == data_hash and STATES.index(entry.state) > state_index:
+                continue
+            self.files[filename] = JournalEntry(record['state'], data_hash, record.get('task_id'))
+
+    def record(self, state, files, task_id=None):
+        """
+        Durably record that files moved to a state, before acting on it
+
+        :param state: One of STATES
+        :param files: Dictionary of filename: sha1 hash of the file
+        :param task_id: ID of the transfer task, for SUBMITTED. Default None
+        """
+        if len(files) == 0:
+            return
+        record = {'time': time.time(), 'state': state, 'files': dict(files)}
+        if task_id is not None:
+            record['task_id'] = task_id
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.apply(record)
+
+    def in_state(self, state):
+        """ :return: Dictionary of filename: JournalEntry of the files whose last recorded state is state """
+        return {filename: entry for filename, entry in self.files.items() if entry.state == state}
+
+    def resumable(self):
+        """ :return: Dictionary of filename: JournalEntry of the files that were submitting or got further, which are
+        what a later run has to resume. Files that were only hashed or validated are simply processed again """
+        return {filename: entry for filename, entry in self.files.items()
+                if STATES.index(entry.state) >= STATES.index(SUBMITTING)}
+
+    def clear(self):
+        """ Forget every file, once the run they were part of has finished """
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        self.files = {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the state of a gatekeeper run journal")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help="Print the number of files in each state")
+    show_parser.add_argument('journal', nargs='?', default=f"{HOME}/tmp/{JOURNAL_DIRNAME}",
+                             help=f"Journal directory, default ~/tmp/{JOURNAL_DIRNAME}")
+    args = parser.parse_args()
+
+    journal = RunJournal(args.journal)
+    if len(journal) == 0:
+        print("Journal is empty, the last run finished")
+        sys.exit(0)
+    for state in STATES:
+        entries = journal.in_state(state)
+        print(f"{state}: {len(entries)}")
+        if state not in (HASHED, VALIDATED):
+            for filename, entry in sorted(entries.items()):
+                print(f"    {filename} {entry.hash}{f' task {entry.task_id}' if entry.task_id else ''}")
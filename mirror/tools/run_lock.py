@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Locks that let several gatekeeper runs work on one machine at the same time, for sharded runs of gatekeeper_globus.py
+(see --shard and --shard_by).
+
+A shard is a run limited to one radar (-r) or one yyyymm (-y), or both. Any number of shards can hash, validate and
+upload their files at once, each in its own working directory, as long as no two of them work on the same shard. A run
+that isn't sharded, or the daemon, still runs alone:
+    run lock   - RUN_LOCK, held shared by every shard and exclusively by a run that isn't sharded
+    shard lock - shard_<name>.lock, held exclusively by the shard
+The files on the mirror that every run updates (all_failed.txt, yyyymm.hashes and master.hashes) are only updated
+while holding the commit lock (COMMIT_LOCK), and shards get them again from the mirror once they have it, so each
+shard's additions are merged with those of the shards that committed before it rather than overwriting them.
+
+The locks are fcntl.flock() locks on files in LOCK_DIR, so they are released when the process exits, however it exits.
+
+Usage:
+    run_lock.py [LOCK_DIR]    Print which locks are held
+"""
+import argparse
+import fcntl
+import os
+from os.path import expanduser
+
+HOME = expanduser("~")
+LOCK_DIR = f"{HOME}/.gatekeeper_locks"
+RUN_LOCK = "gatekeeper.lock"
+COMMIT_LOCK = "commit.lock"
+
+
+def shard_lock_name(shard):
+    """ :return: Name of the lock file of a shard """
+    return f"shard_{shard}.lock"
+
+
+class FileLock(object):
+    """ A shared or exclusive lock on a file in the lock directory """
+
+    def __init__(self, name, lock_dir=LOCK_DIR):
+        """
+        :param name: Name of the lock file, i.e. RUN_LOCK
+        :param lock_dir: Directory of the lock files, made if it doesn't exist. Default LOCK_DIR
+        """
+        os.makedirs(lock_dir, exist_ok=True)
+        self.path = f"{lock_dir}/{name}"
+        self.file = None
+
+    def acquire(self, shared=False, blocking=True):
+        """
+        :param shared: Take a shared lock, which other shared locks don't block. Default False, exclusive
+        :param blocking: Wait until the lock is free. Default True
+        :return: True if the lock was taken, False if it is held by another process and blocking is False
+        """
+        if self.file is not None:
+            return True
+        lock_file = open(self.path, 'a')
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.file = lock_file
+        return True
+
+    def release(self):
+        """ Release the lock, if it is held """
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+    def held(self):
+        """ :return: True if this lock is held """
+        return self.file is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def lock_state(path):
+    """ :return: "free", "shared" or "exclusive", for the lock on a lock file held by other processes """
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return "exclusive"
+            return "shared"
+        return "free"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print which gatekeeper locks are held")
+    parser.add_argument('lock_dir', nargs='?', default=LOCK_DIR, help=f"Lock directory, default {LOCK_DIR}")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.lock_dir):
+        print(f"{args.lock_dir} doesn't exist, no gatekeeper has run")
+    else:
+        for name in sorted(os.listdir(args.lock_dir)):
+            print(f"{name}: {lock_state(f'{args.lock_dir}/{name}')}")
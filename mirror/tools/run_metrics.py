@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Per-step timing of gatekeeper runs, to see whether a slow run was spent hashing, waiting on transfer tasks or making
+requests to the mirror.
+
+gatekeeper_globus.py runs as numbered steps. RunMetrics.step() starts a span for a step, ending the span of the step
+before it, so the steps don't need to be restructured to be timed. Each span records:
+    wall_s          - Seconds the step took
+    files_in        - Files the step started with, and files_out the files left for the next step (if set)
+    bytes_hashed    - Bytes read to hash files (if set)
+    tasks_submitted - Transfer and delete tasks submitted
+    task_wait_s     - Seconds spent waiting for tasks to finish (see Gatekeeper.wait_for_tasks())
+    calls           - Requests made to the transfer backend, by type (i.e. operation_ls, get_task)
+    status          - "ok", or "exited" for a step the run exited in
+
+Each span is written as a line of JSON to the metrics file as soon as it ends, and a summary table of all the spans
+is written to the log when the run finishes or exits. The metrics file is next to the gatekeeper log, with the same
+name ending in _metrics.jsonl instead of .log, i.e. 20240101.0000_globus_gatekeeper_metrics.jsonl
+
+Usage:
+    run_metrics.py METRICS_FILE [METRICS_FILE ...]   Print the summary table of the runs in the metrics files
+"""
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+METRICS_SUFFIX = "_metrics.jsonl"
+
+
+def metrics_filename(log_file):
+    """ :return: Path of the metrics file of a gatekeeper log file """
+    return f"{os.path.splitext(log_file)[0]}{METRICS_SUFFIX}"
+
+
+class Span(object):
+    """ Timing and counts of one step of a run """
+
+    def __init__(self, step, name, files_in=None, started=None):
+        self.step = step
+        self.name = name
+        self.files_in = files_in
+        self.files_out = None
+        self.bytes_hashed = None
+        self.start_time = time.time() if started is None else started
+        self.wall_s = None
+        self.tasks_submitted = 0
+        self.task_wait_s = 0.0
+        self.calls = {}
+        self.status = "ok"
+
+    def to_dict(self):
+        """ :return: Dictionary of the span, as written to the metrics file """
+        return {'step': self.step, 'name': self.name, 'start': round(self.start_time, 3), 'wall_s': self.wall_s,
+                'files_in': self.files_in, 'files_out': self.files_out, 'bytes_hashed': self.bytes_hashed,
+                'tasks_submitted': self.tasks_submitted, 'task_wait_s': self.task_wait_s, 'calls': self.calls,
+                'status': self.status}
+
+
+class RunMetrics(object):
+    """ Spans of the steps of a gatekeeper run, written to a JSON lines metrics file """
+
+    def __init__(self, metrics_file, gatekeeper=None, logger=None):
+        """
+        :param metrics_file: Path of the JSON lines file to append the spans to (see metrics_filename())
+        :param gatekeeper: Gatekeeper whose task waits and transfer backend calls are counted. Default None
+        :param logger: Logger for the summary table. Default the gatekeeper's logger
+        """
+        self.metrics_file = metrics_file
+        self.gatekeeper = gatekeeper
+        self.logger = logger if logger is not None or gatekeeper is None else gatekeeper.logger
+        self.run_id = os.path.basename(metrics_file)[:-len(METRICS_SUFFIX)]
+        self.spans = []
+        self.current = None
+        self.current_counts = None
+        self.finished = False
+
+    def counts(self):
+        """ :return: Tuple of (Counter of transfer backend calls by type, seconds waited for tasks) so far """
+        if self.gatekeeper is None:
+            return Counter(), 0.0
+        return Counter(getattr(self.gatekeeper.transfer_client, 'calls', {})), self.gatekeeper.task_wait_s
+
+    def step(self, step, name, files_in=None, started=None):
+        """
+        End the current span, if any, and start one for the next step
+
+        :param step: Step number, i.e. "5" or "5.5"
+        :param name: Short description of the step
+        :param files_in: Number of files the step starts with, which are also the files_out of the step before it
+                         unless that was set. Default None
+        :param started: time.time() the step started at, for a step that began before RunMetrics was made.
+                        Default now
+        :return: The new Span. Set its files_out and bytes_hashed as the step goes
+        """
+        if self.current is not None and self.current.files_out is None:
+            self.current.files_out = files_in
+        self.end_step()
+        self.current = Span(step, name, files_in, started)
+        self.current_counts = self.counts()
+        return self.current
+
+    def set(self, **kwargs):
+        """ Set counts of the current span, i.e. set(files_out=10, bytes_hashed=1000) """
+        if self.current is not None:
+            for key, value in kwargs.items():
+                setattr(self.current, key, value)
+
+    def end_step(self, status="ok"):
+        """ End the current span and append it to the metrics file """
+        span = self.current
+        if span is None:
+            return
+        self.current = None
+        calls_before, wait_before = self.current_counts
+        calls_after, wait_after = self.counts()
+        calls = calls_after - calls_before
+        span.wall_s = round(time.time() - span.start_time, 3)
+        span.calls = dict(sorted(calls.items()))
+        span.tasks_submitted = calls['submit_transfer'] + calls['submit_delete']
+        span.task_wait_s = round(wait_after - wait_before, 3)
+        span.status = status
+        self.spans.append(span)
+        try:
+            with open(self.metrics_file, 'a') as f:
+                f.write(json.dumps(dict(run=self.run_id, **span.to_dict())) + "\n")
+        except OSError as error:
+            if self.logger is not None:
+                self.logger.warning(f"Couldn't write to metrics file {self.metrics_file}: {error}")
+
+    def finish(self, status="ok"):
+        """ End the current span and write the summary table of the run to the log. Only the first call does """
+        if self.finished:
+            return
+        self.finished = True
+        self.end_step(status)
+        if self.logger is not None:
+            self.logger.info("Step timings:\n" + "\n".join(summary_table([span.to_dict() for span in self.spans])))
+
+
+def summary_table(spans):
+    """
+    :param spans: List of span dictionaries (see Span.to_dict())
+    :return: List of lines of a table of the spans, with a total line
+    """
+    def number(value, fmt):
+        return "" if value is None else format(value, fmt)
+
+    lines = [f"{'step':>5} {'name':<30} {'wall s':>9} {'files in':>9} {'files out':>9} {'MB hashed':>9} "
+             f"{'tasks':>5} {'wait s':>8} {'calls':>6}  status"]
+    for span in spans:
+        bytes_hashed = None if span['bytes_hashed'] is None else span['bytes_hashed'] / 1e6
+        lines.append(f"{span['step']:>5} {span['name'][:30]:<30} {span['wall_s']:>9.2f} "
+                     f"{number(span['files_in'], 'd'):>9} {number(span['files_out'], 'd'):>9} "
+                     f"{number(bytes_hashed, '.1f'):>9} {span['tasks_submitted']:>5} {span['task_wait_s']:>8.2f} "
+                     f"{sum(span['calls'].values()):>6}  {span['status']}")
+    lines.append(f"{'':>5} {'total':<30} {sum(span['wall_s'] for span in spans):>9.2f} {'':>9} {'':>9} "
+                 f"{sum(span['bytes_hashed'] or 0 for span in spans) / 1e6:>9.1f} "
+                 f"{sum(span['tasks_submitted'] for span in spans):>5} "
+                 f"{sum(span['task_wait_s'] for span in spans):>8.2f} "
+                 f"{sum(sum(span['calls'].values()) for span in spans):>6}")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the step timings of gatekeeper runs")
+    parser.add_argument('metrics_files', nargs='+', help=f"Metrics files (*{METRICS_SUFFIX}) next to the logs")
+    args = parser.parse_args()
+
+    for metrics_file in args.metrics_files:
+        runs = {}
+        with open(metrics_file) as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                runs.setdefault(span['run'], []).append(span)
+        for run_id, spans in runs.items():
+            print(run_id)
+            print("\n".join(summary_table(spans)))
+            print()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Follows any number of outstanding transfer or delete tasks at once, for the Gatekeeper class.
+
+Each tracked task gets a concurrent.futures.Future that is resolved with the task's description (see
+TransferBackend.get_task()) once it is no longer ACTIVE, so callers can wait on several tasks together, check on them
+with done() or attach callbacks with add_done_callback(). A task Globus has paused (INACTIVE) resolves its future too,
+and last_task_succeeded() reports it as failed. Tasks are polled with exponential backoff: first after
+INITIAL_POLL_S, then twice as long after every poll that finds the task still running, up to MAX_POLL_S, so short
+tasks are seen to finish within a second and long tasks aren't polled more than needed.
+
+Polling happens in wait() and poll(), in the calling thread, so nothing calls the transfer backend in the background.
+
+Example:
+    tracker = TaskTracker(transfer_client)
+    futures = [tracker.track(gk.get_master_hashes()['task_id']), tracker.track(gk.get_failed()['task_id'])]
+    if tracker.wait(futures, timeout_s=60):
+        statuses = [future.result()['status'] for future in futures]
+"""
+import time
+from concurrent.futures import Future, ALL_COMPLETED, FIRST_COMPLETED
+
+INITIAL_POLL_S = 0.25  # Seconds before a new task is first polled
+MAX_POLL_S = 15  # Longest time between polls of a task
+# Status of a task that is still running. As for transfer_client.task_wait(), any other status (SUCCEEDED, FAILED, or
+# INACTIVE for a paused task, i.e. with expired credentials) means the task is done
+ACTIVE_STATUS = "ACTIVE"
+
+
+class TrackedTask(object):
+    """ A task being followed, with its future and when to poll it next """
+
+    def __init__(self, task_id, label, initial_poll_s):
+        self.task_id = task_id
+        self.label = label
+        self.future = Future()
+        self.future.task_id = task_id
+        self.interval = initial_poll_s
+        self.next_poll = time.monotonic() + initial_poll_s
+        self.polls = 0
+
+
+class TaskTracker(object):
+    """ Follows outstanding tasks on a transfer backend, polling with exponential backoff """
+
+    def __init__(self, transfer_client, logger=None, initial_poll_s=INITIAL_POLL_S, max_poll_s=MAX_POLL_S):
+        """
+        :param transfer_client: Transfer backend the tasks were submitted to (see transfer_backend.py)
+        :param logger: Logger for errors while polling. Default None
+        :param initial_poll_s: Seconds before a task is first polled. Default INITIAL_POLL_S
+        :param max_poll_s: Longest time between polls of a task. Default MAX_POLL_S
+        """
+        self.transfer_client = transfer_client
+        self.logger = logger
+        self.initial_poll_s = initial_poll_s
+        self.max_poll_s = max_poll_s
+        self.tasks = {}  # task_id: TrackedTask, for tasks that haven't finished yet
+        self.finished = {}  # task_id: resolved Future, for tasks that have finished
+
+    def track(self, task_id, label=None):
+        """
+        Start following a task. Tracking a task that is already followed (or has finished) returns the same future
+
+        :param task_id: ID of the task
+        :param label: Name of the task for log messages. Default None
+        :return: Future resolved with the task description once the task has finished
+        """
+        if task_id in self.finished:
+            return self.finished[task_id]
+        if task_id not in self.tasks:
+            self.tasks[task_id] = TrackedTask(task_id, label, self.initial_poll_s)
+        return self.tasks[task_id].future
+
+    def poll(self, task_ids=None, force=False):
+        """
+        Check on the tasks that are due to be polled, resolving the futures of those that have finished
+
+        :param task_ids: Only check these tasks. Default all followed tasks
+        :param force: Poll the tasks even if they aren't due yet. Default False
+        :return: Number of tasks that finished
+        """
+        finished = 0
+        now = time.monotonic()
+        for task_id in list(self.tasks if task_ids is None else task_ids):
+            tracked = self.tasks.get(task_id)
+            if tracked is None or (not force and tracked.next_poll > now):
+                continue
+            tracked.polls += 1
+            try:
+                task = self.transfer_client.get_task(task_id)
+            except Exception as error:
+                # Try again later, the task itself may be fine
+                if self.logger is not None:
+                    self.logger.warning(f"Couldn't get the status of task {tracked.label or task_id}: {error}")
+                task = None
+            if task is not None and task['status'] != ACTIVE_STATUS:
+                del self.tasks[task_id]
+                self.finished[task_id] = tracked.future
+                tracked.future.set_result(task)  # Runs the callbacks
+                finished += 1
+            else:
+                tracked.interval = min(tracked.interval * 2, self.max_poll_s)
+                tracked.next_poll = time.monotonic() + tracked.interval
+        return finished
+
+    def wait(self, futures_or_task_ids=None, timeout_s=60, return_when=ALL_COMPLETED):
+        """
+        Wait for tasks to finish
+
+        :param futures_or_task_ids: Futures from track() or task IDs to wait for. Default all followed tasks
+        :param timeout_s: Seconds to wait for. The tasks aren't cancelled when this runs out
+        :param return_when: ALL_COMPLETED (default) to wait for every task, or FIRST_COMPLETED to return as soon as any
+                            of them has finished, as for concurrent.futures.wait()
+        :return: True if all the tasks (or with FIRST_COMPLETED, any of them) finished within the timeout, False
+                 otherwise
+        """
+        if futures_or_task_ids is None:
+            futures = [tracked.future for tracked in self.tasks.values()]
+        else:
+            futures = [item if isinstance(item, Future) else self.track(item) for item in futures_or_task_ids]
+        deadline = time.monotonic() + timeout_s
+        while True:
+            pending = [future.task_id for future in futures if not future.done()]
+            if len(pending) == 0 or (return_when == FIRST_COMPLETED and len(pending) < len(futures)):
+                return True
+            now = time.monotonic()
+            if now >= deadline:
+                return False
+            next_poll = min(self.tasks[task_id].next_poll for task_id in pending)
+            if next_poll > now:
+                time.sleep(min(next_poll, deadline) - now)
+                # One last look at the deadline, so a task that finished in the meantime isn't reported as timed out
+                self.poll(pending, force=time.monotonic() >= deadline)
+            else:
+                self.poll(pending)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Transfer backends for the Gatekeeper class. A backend is everything the gatekeeper needs from a transfer service:
+building and submitting transfer and delete tasks, waiting for tasks, listing, stat'ing and making directories on
+endpoints and getting the files a task transferred. The method names and arguments are those of
+globus_sdk.TransferClient, so GlobusBackend only has to pass calls through.
+
+Backends:
+    GlobusBackend      - The Globus transfer service (the default, see Gatekeeper.get_transfer_client())
+    LocalTransferClient - Endpoints that are local directories, for testing and benchmarks (local_transfer_client.py)
+
+Backends count the requests they make by method name in `calls` (a Counter), for run metrics and benchmarks.
+
+Errors a backend raises for a failed request are BackendAPIError (with the HTTP status Globus would respond with) or
+BackendNetworkError, unless they come from globus_sdk itself. See TRANSFER_API_ERRORS in gatekeeper_class.py.
+"""
+from abc import ABC, abstractmethod
+from collections import Counter
+
+
+class BackendError(Exception):
+    """ Base class of the errors raised by transfer backends other than GlobusBackend """
+
+
+class BackendAPIError(BackendError):
+    """ Raised like globus_sdk.TransferAPIError, with the HTTP status Globus would respond with """
+
+    def __init__(self, http_status, code, message):
+        super().__init__(f"{http_status} {code}: {message}")
+        self.http_status = http_status
+        self.code = code
+        self.message = message
+
+
+class BackendNetworkError(BackendError):
+    """ Raised like globus_sdk.NetworkError, when the transfer service can't be reached """
+
+
+class TransferBackend(ABC):
+    """ Interface the Gatekeeper class uses to move files between endpoints """
+
+    @abstractmethod
+    def transfer_data(self, source_endpoint, destination_endpoint, **kwargs):
+        """
+        :param source_endpoint: UUID of the endpoint to transfer from
+        :param destination_endpoint: UUID of the endpoint to transfer to
+        :param kwargs: Task options, i.e. label, sync_level, deadline, as for globus_sdk.TransferData
+        :return: Transfer task to add items to with add_item(source_path, destination_path, recursive=False)
+        """
+
+    @abstractmethod
+    def delete_data(self, endpoint, **kwargs):
+        """
+        :param endpoint: UUID of the endpoint to delete from
+        :param kwargs: Task options, i.e. label, as for globus_sdk.DeleteData
+        :return: Delete task to add items to with add_item(path)
+        """
+
+    @abstractmethod
+    def submit_transfer(self, data):
+        """
+        :param data: Task from transfer_data()
+        :return: Dictionary like result with the 'task_id'
+        """
+
+    @abstractmethod
+    def submit_delete(self, data):
+        """
+        :param data: Task from delete_data()
+        :return: Dictionary like result with the 'task_id'
+        """
+
+    @abstractmethod
+    def task_wait(self, task_id, timeout=10, polling_interval=10):
+        """
+        :param task_id: ID of the task
+        :param timeout: Number of seconds to wait for
+        :param polling_interval: Number of seconds between checks of the task status
+        :return: True if the task finished within the timeout, False otherwise
+        """
+
+    @abstractmethod
+    def get_task(self, task_id):
+        """ :return: Dictionary like description of the task, with at least 'status' and 'files_skipped' """
+
+    @abstractmethod
+    def task_list(self, **kwargs):
+        """ :return: Iterable of dictionary like descriptions of the recent tasks (see get_task()) """
+
+    @abstractmethod
+    def task_successful_transfers(self, task_id):
+        """ :return: List of the files the task transferred, each a dictionary with 'source_path' and
+        'destination_path'. Files that were skipped because they were already at the destination aren't listed """
+
+    @abstractmethod
+    def operation_ls(self, endpoint_id, path=None, **kwargs):
+        """ :return: Iterable of dictionaries describing the entries of a directory, with at least 'name' and 'type'.
+        Takes an optional Globus ls filter as filter= """
+
+    @abstractmethod
+    def operation_stat(self, endpoint_id, path=None, **kwargs):
+        """ :return: Dictionary describing a file or directory, with at least 'name' and 'type' """
+
+    @abstractmethod
+    def operation_mkdir(self, endpoint_id, path, **kwargs):
+        """ Make a directory. Raises an error with http_status 502 if it already exists """
+
+
+class GlobusBackend(TransferBackend):
+    """ Backend for the Globus transfer service, passing calls through to a globus_sdk.TransferClient """
+
+    def __init__(self, transfer_client):
+        """
+        :param transfer_client: Authorized globus_sdk.TransferClient
+        """
+        self.transfer_client = transfer_client
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        # Everything else the Gatekeeper uses directly (endpoint_search, etc.) goes to the client
+        return getattr(self.transfer_client, name)
+
+    def transfer_data(self, source_endpoint, destination_endpoint, **kwargs):
+        import globus_sdk
+        return globus_sdk.TransferData(self.transfer_client, source_endpoint, destination_endpoint, **kwargs)
+
+    def delete_data(self, endpoint, **kwargs):
+        import globus_sdk
+        return globus_sdk.DeleteData(self.transfer_client, endpoint, **kwargs)
+
+    def submit_transfer(self, data):
+        self.calls['submit_transfer'] += 1
+        return self.transfer_client.submit_transfer(data)
+
+    def submit_delete(self, data):
+        self.calls['submit_delete'] += 1
+        return self.transfer_client.submit_delete(data)
+
+    def task_wait(self, task_id, timeout=10, polling_interval=10):
+        self.calls['task_wait'] += 1
+        return self.transfer_client.task_wait(task_id, timeout=timeout, polling_interval=polling_interval)
+
+    def get_task(self, task_id):
+        self.calls['get_task'] += 1
+        return self.transfer_client.get_task(task_id)
+
+    def task_list(self, **kwargs):
+        self.calls['task_list'] += 1
+        return self.transfer_client.task_list(**kwargs)
+
+    def task_successful_transfers(self, task_id):
+        self.calls['task_successful_transfers'] += 1
+        # The paginated call, otherwise only the first 100 files are returned
+        return list(self.transfer_client.paginated.task_successful_transfers(task_id).items())
+
+    def operation_ls(self, endpoint_id, path=None, **kwargs):
+        self.calls['operation_ls'] += 1
+        return self.transfer_client.operation_ls(endpoint_id, path=path, **kwargs)
+
+    def operation_stat(self, endpoint_id, path=None, **kwargs):
+        self.calls['operation_stat'] += 1
+        return self.transfer_client.operation_stat(endpoint_id, path=path, **kwargs)
+
+    def operation_mkdir(self, endpoint_id, path, **kwargs):
+        self.calls['operation_mkdir'] += 1
+        return self.transfer_client.operation_mkdir(endpoint_id, path, **kwargs)